@@ -1,27 +1,125 @@
-import requests
-from database import open_connection, close_connection, create_tables, get_max_id, fetch_users_batch, fetch_organizations_batch, fetch_repos_batch, insert_organization_data, insert_user_data, insert_repository_data, insert_issue_data, insert_log_data, get_max_ids
-from config import BASE_URL, PARAMS_BASE, HEADERS
-from requests.exceptions import ConnectionError, Timeout
+from database import open_connection, close_connection, create_tables, get_max_id, fetch_users_batch, fetch_organizations_batch, fetch_repos_batch, insert_organizations_batch, insert_users_batch, insert_repos_batch, insert_issues_batch, get_checkpoint, set_checkpoint, get_http_cache, upsert_http_cache, fetch_repos_refresh_batch, upsert_issue_watermark, get_comment_watermarks, upsert_comment_watermark, insert_comments_batch, get_issue_ids_by_number, enqueue_work_units, claim_work_unit, renew_work_unit, complete_work_unit, enqueue_id_partitions, set_work_unit_progress, get_page_cursors, set_page_cursor, get_after_cursor, store_page, clear_page_cursors, build_crawl_plan, has_crawl_plan, fetch_plan_batch, fetch_repos_of_owners_batch
+from config import BASE_URL, PARAMS_BASE, HEADERS, USER_DETAILS_MODE, ISSUES_MODE, WORK_QUEUE, WORK_UNIT_SIZE, LEASE_SECONDS, WORKER_ID, CRAWL_CONCURRENCY, ENUMERATION_START, ENUMERATION_END, ENUMERATION_PARTITION_SIZE, CRAWL_PLAN, PLAN_OWNER_PRIORITY, PLAN_REPOSITORY_PRIORITY
+from transport import request, TRANSPORT_ERRORS
+from requests.utils import parse_header_links
+from urllib.parse import urlencode
+from tokens import TokenPool
+from pipeline import Pipeline, apply_write
+from archive import archive_page
+from metrics import HTTP_REQUESTS, HTTP_REQUEST_SECONDS, endpoint_of, decode_json
+from concurrent.futures import wait
 import time
 import traceback
 
-def safe_request(url, headers, params=None, max_retries=3, delay=5):
+# Shared by every crawler so all requests are scheduled against the same quotas
+token_pool = TokenPool.from_env()
+
+def safe_request(url, headers, params=None, max_retries=3, delay=5, method='GET', json=None, resource='core', max_rate_limited=10):
     """
-    Makes a HTTP GET request to the specified URL with retries.
-    - max_retries: Maximum number of retries.
+    Makes a HTTP request (GET by default) to the specified URL with retries over the shared connection pool.
+    Each request is sent with the pooled token that has the most headroom, paced by that token's
+    rate limiter, and retried after being rejected by a rate limit or an invalid token.
+    Returns None when the retries are used up or no usable token is left.
+    - max_retries: Maximum number of retries after failed requests and rejected tokens.
     - delay: Wait time between retries in seconds.
+    - resource: The rate limit resource the request counts against, e.g. 'core' or 'graphql'.
+    - max_rate_limited: Maximum number of retries after primary or secondary rate limits, the limiter waits before each.
     """
-    for attempt in range(max_retries):
+    attempt = 0
+    rate_limited = 0
+    endpoint = endpoint_of(url)
+    while attempt < max_retries and rate_limited < max_rate_limited:
+        token = token_pool.acquire(resource)
+        if token is None:
+            print(f"No usable GitHub token is left, the request to {url} was not sent.")
+            return None
+        token_headers = dict(headers, Authorization=f'token {token.value}')
+        started = time.perf_counter()
         try:
-            response = requests.get(url, headers=headers, params=params)
-            return response
-        except (ConnectionError, Timeout) as e:
-            print(f"Request failed: {e}. Attempt {attempt + 1} of {max_retries}. Retrying in {delay} seconds...")
+            response = request(method, url, headers=token_headers, params=params, json=json)
+        except TRANSPORT_ERRORS as e:
+            HTTP_REQUESTS.inc(endpoint=endpoint, status='error')
+            attempt += 1
+            print(f"Request failed: {e}. Attempt {attempt} of {max_retries}. Retrying in {delay} seconds...")
             time.sleep(delay)
+            continue
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        if response.status_code == 401:
+            token_pool.remove(token)
+            attempt += 1
+            continue
+        if token.rate_limiter.update(response, resource):
+            rate_limited += 1
+            print(f"Request to {url} was rate limited. Attempt {rate_limited} of {max_rate_limited}. Retrying...")
+            continue
+        return response
     # Return None or raise an exception if all retries fail
-    print("All retry attempts failed.")
+    print(f"All retry attempts for {url} failed.")
     return None
 
+def http_cache_key(url, params=None):
+    """
+    Builds the key under which the validators of a page are stored.
+    """
+    if not params:
+        return url
+    return f"{url}?{urlencode(sorted(params.items()))}"
+
+def conditional_headers(cache_entry, headers=HEADERS):
+    """
+    Adds the If-None-Match and If-Modified-Since headers of a stored page to the headers.
+    """
+    headers = dict(headers)
+    if cache_entry:
+        if cache_entry['etag']:
+            headers['If-None-Match'] = cache_entry['etag']
+        if cache_entry['last_modified']:
+            headers['If-Modified-Since'] = cache_entry['last_modified']
+    return headers
+
+def cached_links(cache_entry):
+    """
+    Parses the Link header stored for a page into the same shape as response.links.
+    """
+    if not cache_entry or not cache_entry['link']:
+        return {}
+    return {link.get('rel') or link['url']: link for link in parse_header_links(cache_entry['link'])}
+
+def revalidatable(cache_entry, params=None):
+    """
+    Returns the stored entry of a page if its validators may be sent, or None. The ETag of a page
+    covers only its body, so a full last page answers 304 with its stored Link header even after
+    new rows started a next page. Such pages, and last pages of unknown size, are fetched in full.
+    """
+    if not cache_entry or 'next' in cached_links(cache_entry):
+        return cache_entry
+    per_page = int((params or {}).get('per_page', 30))
+    if cache_entry['row_count'] is None or cache_entry['row_count'] >= per_page:
+        return None
+    return cache_entry
+
+def conditional_request(conn, url, params=None):
+    """
+    Makes a HTTP GET request that GitHub answers with 304 Not Modified, without counting it
+    against the rate limit, when the page did not change since it was stored.
+    Returns the response and the links of the page, which are taken from the cache for a 304.
+    """
+    cache_entry = revalidatable(get_http_cache(conn, http_cache_key(url, params)), params)
+    response = safe_request(url, headers=conditional_headers(cache_entry), params=params)
+    if response is not None and response.status_code == 304:
+        return response, cached_links(cache_entry)
+    return response, response.links if response is not None else {}
+
+def remember_response(conn, url, params, response, row_count=None):
+    """
+    Stores the validators of a page and its number of rows. Call it only after the page's rows are stored.
+    """
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if etag or last_modified:
+        upsert_http_cache(conn, http_cache_key(url, params), etag, last_modified, response.headers.get('Link'), row_count)
+
 def get_rate_limits():
     """
     Fetches the current rate limits from GitHub API and returns the rate limit data.
@@ -29,7 +127,7 @@ def get_rate_limits():
     rate_limit_url = f"{BASE_URL}/rate_limit"
     response = safe_request(rate_limit_url, headers=HEADERS)
     if response and response.status_code == 200:
-        rate_limit_data = response.json()
+        rate_limit_data = decode_json(response)
         return rate_limit_data['resources']['core']
     elif response:
         print(f"Failed to fetch rate limits: HTTP {response.status_code}, Error: {response.text}")
@@ -38,13 +136,88 @@ def get_rate_limits():
         print(f"Failed to fetch rate limits. No response is available.")
         return None
 
+def _enumerate_range(pipeline, conn, stage, url, unit, kind, insert_batch, resolve_rows):
+    """
+    Follows the since cursor of an id range from where it stopped, until the ids pass the end of the range.
+    Returns True when the whole range was crawled.
+    """
+    range_start, range_end, since = unit
+    params = PARAMS_BASE.copy()
+    renewed_at = time.time()
+    while since < range_end:
+        params['since'] = since
+        response = safe_request(url, headers=HEADERS, params=params)
+        if response and response.status_code == 200:
+            data = decode_json(response)
+            if not data:
+                break
+            rows = [row for row in data if row['id'] <= range_end]
+            if rows:
+                if resolve_rows:
+                    rows = resolve_rows(rows)
+                pipeline.write(insert_batch, rows)
+                archive_page(kind, url, dict(params), response, rows)
+            since = min(data[-1]['id'], range_end)
+            # Queued behind the page's rows, a restart resumes after the last stored page
+            pipeline.write(set_work_unit_progress, stage, range_start, since)
+            if len(rows) < len(data):
+                break
+            if time.time() - renewed_at > LEASE_SECONDS / 3:
+                apply_write(conn, renew_work_unit, stage, range_start, WORKER_ID, LEASE_SECONDS)
+                renewed_at = time.time()
+        elif response and response.status_code >= 400:
+            print(f"Failed to fetch {url} since {since}. HTTP {response.status_code}, Error: {response.text}")
+            return False
+        else:
+            print(f"Failed to fetch {url} since {since}. No response is available")
+            return False
+    return True
+
+def _enumerate_partitions(pipeline, stage, url, kind, insert_batch, resolve_rows):
+    """
+    Claims id ranges of a stage and crawls them one after another. Runs on a fetcher worker.
+    A range that failed stays leased and is retried once its lease expires.
+    """
+    conn = pipeline.read_connection()
+    while True:
+        unit = apply_write(conn, claim_work_unit, stage, WORKER_ID, LEASE_SECONDS)
+        if unit is None:
+            return
+        if _enumerate_range(pipeline, conn, stage, url, unit, kind, insert_batch, resolve_rows):
+            pipeline.write(complete_work_unit, stage, unit[0])
+            print(f"Range ({unit[0]}, {unit[1]}] of {stage} has been processed.")
+
+def _enumerate_partitioned(stage, url, kind, insert_batch, resolve_rows=None):
+    """
+    Enumerates the id space [ENUMERATION_START, ENUMERATION_END) of an endpoint paginated by since,
+    split into ranges that are crawled in parallel.
+    - kind: The kind of rows, as archived.
+    - insert_batch: Function(conn, rows) that stores a page of rows.
+    - resolve_rows: Optional function(rows) returning the rows to store for a page.
+    """
+    conn = open_connection()
+    try:
+        apply_write(conn, create_tables)
+        added = apply_write(conn, enqueue_id_partitions, stage, ENUMERATION_START, ENUMERATION_END, ENUMERATION_PARTITION_SIZE)
+        print(f"Queued {added} new id ranges for {stage}.")
+        with Pipeline() as pipeline:
+            _wait_all([pipeline.fetch(_enumerate_partitions, pipeline, stage, url, kind, insert_batch, resolve_rows) for _ in range(CRAWL_CONCURRENCY)])
+    finally:
+        close_connection(conn)
+
 def fetch_organizations():
     """
     Fetches organizations from the GitHub API and inserts data into the database.
+    Pages are written by the pipeline's writer while the next page is fetched.
+    With ENUMERATION_END set, id ranges are enumerated in parallel.
     """
+    if ENUMERATION_END:
+        _enumerate_partitioned('org_enumeration', f"{BASE_URL}/organizations", 'organizations', insert_organizations_batch)
+        return
+
     conn = open_connection()
     try:
-        create_tables(conn)
+        apply_write(conn, create_tables)
 
         max_id = get_max_id(conn, "organizations")
 
@@ -53,46 +226,78 @@ def fetch_organizations():
         params.update({
             'since': max_id
         })
-        iterate = 0
-        has_more = True        
-        while has_more:
-            if iterate == 100:  
-                iterate = 0
-                rate_limits = get_rate_limits()
-                if rate_limits and rate_limits['remaining'] == 0:
-                    reset_time = rate_limits['reset']
-                    sleep_duration = max(reset_time - time.time(), 1)
-                    print(f"Rate limit exceeded. Sleeping for {sleep_duration} seconds.")
-                    time.sleep(sleep_duration)
-                    continue
-            iterate += 1
+        with Pipeline() as pipeline:
+            has_more = True        
+            while has_more:
+                response = safe_request(base_url, headers=HEADERS, params=params)
+                if response and response.status_code == 200:
+                    data = decode_json(response)
+                    if not data:
+                        print("No more organizations to fetch.")
+                        break
 
-            response = safe_request(base_url, headers=HEADERS, params=params)
-            if response and response.status_code == 200:
-                data = response.json()
-                if not data:
-                    print("No more organizations to fetch.")
-                    break
-
-                for org in data:
-                    insert_organization_data(conn, org)
-                
-                print(f"Page of organizations since ID {params['since']} has been processed.")
-                params['since'] = data[-1]['id']  # Update 'since' to the last organization's ID
-            elif response and response.status_code >= 400:
-                print(f"Failed to fetch organization data since {params['since']}. HTTP {response.status_code}, Error: {response.text}")
-            else:
-                print(f"Failed to fetch organization data since {params['since']}. No response is available")    
+                    pipeline.write(insert_organizations_batch, data)
+                    archive_page('organizations', base_url, dict(params), response, data)
+                    
+                    print(f"Page of organizations since ID {params['since']} has been processed.")
+                    params['since'] = data[-1]['id']  # Update 'since' to the last organization's ID
+                elif response and response.status_code >= 400:
+                    print(f"Failed to fetch organization data since {params['since']}. HTTP {response.status_code}, Error: {response.text}")
+                else:
+                    print(f"Failed to fetch organization data since {params['since']}. No response is available")    
     finally:
         close_connection(conn)
 
+def _fetch_user_detail(user_summary):
+    # Fetch detailed user information
+    user_detail_url = user_summary.get('url')
+    detail_response = safe_request(user_detail_url, headers=HEADERS)
+    if detail_response and detail_response.status_code == 200:
+        return decode_json(detail_response)
+    elif detail_response and detail_response.status_code >= 400:
+        print(f"Failed to fetch detailed data for user: {user_summary.get('url')}\nHTTP {detail_response.status_code}, Error: {detail_response.text}")
+    else:
+        print(f"Failed to fetch detailed data for user: {user_summary.get('url')}. No response is available.")
+    user_summary['error'] = True
+    return user_summary
+
+def fetch_user_details_rest(users, pipeline=None):
+    """
+    Fetches the detailed information of each user summary with one REST request per user,
+    spread over the pipeline's fetcher workers when a pipeline is given.
+    Summaries whose details could not be fetched are returned with the error flag set.
+    """
+    if pipeline is not None:
+        return pipeline.map(_fetch_user_detail, users)
+    return [_fetch_user_detail(user_summary) for user_summary in users]
+
+def _user_rows(users, pipeline=None):
+    """
+    Resolves the details of a page of user summaries the way USER_DETAILS_MODE asks for.
+    """
+    user_rows = None
+    if USER_DETAILS_MODE == 'GRAPHQL':
+        # One GraphQL query instead of one REST request per user
+        from graphql_api import fetch_user_details
+        user_rows = fetch_user_details(users)
+    if user_rows is None:
+        user_rows = fetch_user_details_rest(users, pipeline)
+    return user_rows
+
 def fetch_users():
     """
     Fetches users from the GitHub API and inserts data into the database.
+    Pages are written by the pipeline's writer while the next page is fetched.
+    With ENUMERATION_END set, id ranges are enumerated in parallel.
     """
+    if ENUMERATION_END:
+        # Every range already runs on a fetcher worker, so the details of a page are fetched in turn
+        _enumerate_partitioned('user_enumeration', f"{BASE_URL}/users", 'users', insert_users_batch, _user_rows)
+        return
+
     conn = open_connection()
     try:
-        create_tables(conn)
+        apply_write(conn, create_tables)
 
         max_id = get_max_id(conn, "users")
 
@@ -101,233 +306,614 @@ def fetch_users():
         params.update({
             'since': max_id
         })
-        iterate = 0
-        has_more = True        
-        while has_more:
-            if iterate == 100:  
-                iterate = 0
-                rate_limits = get_rate_limits()
-                if rate_limits and rate_limits['remaining'] == 0:
-                    reset_time = rate_limits['reset']
-                    sleep_duration = max(reset_time - time.time(), 1)
-                    print(f"Rate limit exceeded. Sleeping for {sleep_duration} seconds.")
-                    time.sleep(sleep_duration)
-                    continue
-            iterate += 1
+        with Pipeline() as pipeline:
+            has_more = True        
+            while has_more:
+                response = safe_request(base_url, headers=HEADERS, params=params)
+                if response and response.status_code == 200:
+                    users = decode_json(response)
+                    if not users:
+                        print("No more users to fetch.")
+                        break
 
-            response = safe_request(base_url, headers=HEADERS, params=params)
-            if response and response.status_code == 200:
-                users = response.json()
-                if not users:
-                    print("No more users to fetch.")
+                    user_rows = _user_rows(users, pipeline)
+                    pipeline.write(insert_users_batch, user_rows)
+                    archive_page('users', base_url, dict(params), response, user_rows)
+                    
+                    print(f"Page of users since ID {params['since']} has been processed.")
+                    params['since'] = users[-1]['id']  # Update 'since' to the last user's ID
+                elif response and response.status_code >= 400:
+                    print(f"Failed to fetch users: HTTP {response.status_code}, Error: {response.text}")    
+                else:
+                    print(f"Failed to fetch users data since {params['since']}. No response is available.")     
+    finally:
+        close_connection(conn)
+
+def _wait_all(futures):
+    """
+    Waits for the fetches of a batch, re-raising the first failure.
+    """
+    return [future.result() for future in futures]
+
+def _fetch_batch(pipeline, conn, stage, items, fetch_item):
+    """
+    Starts the fetches of a batch of owners or repositories, each from the page its cursor points at.
+    Items whose pages were all stored before a restart are skipped.
+    Returns the futures of the fetches.
+    """
+    cursors = get_page_cursors(conn, stage, [item['id'] for item in items])
+    futures = []
+    for item in items:
+        next_page = cursors.get(item['id'], 1)
+        if next_page is None:
+            continue
+        futures.append(pipeline.fetch(fetch_item, pipeline, item, stage, next_page))
+    return futures
+
+def _wait_leased(conn, futures, stage, range_start):
+    """
+    Waits for the fetches of a work unit, renewing the unit's lease while they run.
+    Re-raises the first failure.
+    """
+    pending = set(futures)
+    while pending:
+        _, pending = wait(pending, timeout=LEASE_SECONDS / 3)
+        if pending and not apply_write(conn, renew_work_unit, stage, range_start, WORKER_ID, LEASE_SECONDS):
+            print(f"Lost the lease on work unit {range_start} of {stage}, another worker may repeat it.")
+    return _wait_all(futures)
+
+def _crawl_work_units(stage, load_batch, fetch_item):
+    """
+    Crawls a stage as one of possibly many workers: the stage's ids are cut into work units,
+    and units are leased from the database one at a time until none is left.
+    A unit is marked done by the writer behind its rows, a unit of a crashed worker is retried
+    by another one once its lease expired.
+    - load_batch: Function(conn, last_id, batch_size) returning the owners or repositories after an id.
+    - fetch_item: Fetcher worker function(pipeline, item, stage, next_page).
+    """
+    conn = open_connection()
+    try:
+        apply_write(conn, create_tables)
+        added = apply_write(conn, enqueue_work_units, stage, WORK_UNIT_SIZE)
+        print(f"Queued {added} new work units for {stage}.")
+
+        with Pipeline() as pipeline:
+            while True:
+                unit = apply_write(conn, claim_work_unit, stage, WORKER_ID, LEASE_SECONDS)
+                if unit is None:
+                    print(f"No more work units of {stage} to process.")
                     break
+                range_start, range_end, _ = unit
 
-                for user_summary in users:
-                    # Fetch detailed user information
-                    user_detail_url = user_summary.get('url')
-                    detail_response = safe_request(user_detail_url, headers=HEADERS)
-                    if detail_response and detail_response.status_code == 200:
-                        user_data = detail_response.json()
-                        insert_user_data(conn, user_data)
-                    elif detail_response and detail_response.status_code >= 400:
-                        print(f"Failed to fetch detailed data for user: {user_summary.get('url')}\nHTTP {detail_response.status_code}, Error: {detail_response.text}")
-                        user_summary['error'] = True
-                        insert_user_data(conn, user_summary)
-                    else:
-                        print(f"Failed to fetch detailed data for user: {user_summary.get('url')}. No response is available.")
-                        user_summary['error'] = True
-                        insert_user_data(conn, user_summary)
-                
-                print(f"Page of users since ID {params['since']} has been processed.")
-                params['since'] = users[-1]['id']  # Update 'since' to the last user's ID
-            elif response and response.status_code >= 400:
-                print(f"Failed to fetch users: HTTP {response.status_code}, Error: {response.text}")    
-            else:
-                print(f"Failed to fetch users data since {params['since']}. No response is available.")     
+                futures = []
+                last_id = range_start
+                while last_id < range_end:
+                    items = [item for item in load_batch(conn, last_id, WORK_UNIT_SIZE) if item['id'] <= range_end]
+                    if not items:
+                        break
+                    futures.extend(_fetch_batch(pipeline, conn, stage, items, fetch_item))
+                    last_id = items[-1]['id']
+                _wait_leased(conn, futures, stage, range_start)
+
+                pipeline.write(complete_work_unit, stage, range_start)
+                print(f"Work unit ({range_start}, {range_end}] of {stage} has been processed.")
+    finally:
+        close_connection(conn)
+
+def _plan_priority(stage):
+    if stage == 'org_repositories':
+        # Only the ids of organizations are stored
+        return 'id'
+    return PLAN_REPOSITORY_PRIORITY if stage.endswith('_issues') else PLAN_OWNER_PRIORITY
+
+def plan_crawl(conn, stage):
+    """
+    Builds the crawl plan of a repository or issue stage from the stored owner and repository metadata.
+    """
+    planned, skipped = apply_write(conn, build_crawl_plan, stage, _plan_priority(stage), f"{stage}_plan")
+    print(f"Planned {planned} requests for {stage}, skipped {skipped} that are guaranteed to return nothing.")
+
+def _crawl_planned(stage, fetch_item):
+    """
+    Crawls a stage in the order of its crawl plan, building the plan first if there is none.
+    Progress is kept as the last processed plan position under the checkpoint '<stage>_plan'.
+    - fetch_item: Fetcher worker function(pipeline, item, stage, next_page).
+    """
+    conn = open_connection()
+    try:
+        apply_write(conn, create_tables)
+        if not has_crawl_plan(conn, stage):
+            plan_crawl(conn, stage)
+        plan_stage = f"{stage}_plan"
+        last_position = get_checkpoint(conn, plan_stage)
+
+        with Pipeline() as pipeline:
+            while True:
+                items = fetch_plan_batch(conn, stage, last_position=last_position, batch_size=100)
+                if not items:
+                    print(f"The crawl plan of {stage} is complete.")
+                    break
+
+                _wait_all(_fetch_batch(pipeline, conn, stage, items, fetch_item))
+
+                last_position = items[-1]['position']
+                pipeline.write(set_checkpoint, plan_stage, last_position)
+                pipeline.write(clear_page_cursors, stage, [item['id'] for item in items])
     finally:
         close_connection(conn)
+
+def _fetch_owner_repositories(pipeline, owner, stage, next_page=1):
+    """
+    Fetches the repository pages of one owner, starting at next_page. Runs on a fetcher worker.
+    Each page is stored together with the owner's page cursor.
+    """
+    conn = pipeline.read_connection()
+    login = owner['login']
+    repos_url = f"{BASE_URL}/users/{login}/repos"
+
+    params= {
+        'type': 'public',
+        'sort': 'created',
+        'direction': 'asc',
+        'per_page': 100,
+        'page': next_page
+    }
+
+    has_more_pages = True
+    while has_more_pages:
+        response, links = conditional_request(conn, repos_url, params)
+        if response and response.status_code in (200, 304):
+            # A 304 means the stored page is still current
+            if response.status_code == 200:
+                repos = decode_json(response)
+                if not repos:
+                    # print(f"No more repositories to fetch for {owner['type']} {login}.")
+                    pipeline.write(set_page_cursor, stage, owner['id'], None)
+                    break
+
+                for repo in repos:
+                    repo['owner'] = login
+                    repo['owner_id'] = owner['id']
+                    repo['owner_type'] = owner['type']
+                pipeline.write(store_page, insert_repos_batch, repos, stage, owner['id'], params['page'] + 1 if 'next' in links else None)
+                pipeline.write(remember_response, repos_url, dict(params), response, len(repos))
+                archive_page('repositories', repos_url, dict(params), response, repos)
+            elif 'next' not in links:
+                # The unchanged last page completes the owner
+                pipeline.write(set_page_cursor, stage, owner['id'], None)
+
+            if 'next' in links:
+                params['page'] += 1  # Go to the next page
+            else:
+                has_more_pages = False
+        elif response and response.status_code >= 400:
+            has_more_pages = False
+            print(f"Failed to fetch repositories for user {repos_url}. HTTP {response.status_code}, Error: {response.text}")
+        else:
+            has_more_pages = False
+            print(f"Failed to fetch repositories for user {repos_url}. No response is available")
         
 def fetch_repositories(type='organizations'):
     """
     Fetches repositories for each user from the GitHub API and inserts data into the database.
+    Owners of a batch are fetched by the pipeline's fetcher workers and written by its writer.
+    With WORK_QUEUE enabled the owners are leased in work units, shared with other workers,
+    with CRAWL_PLAN enabled they are crawled in the order of the crawl plan.
     """
+    # Keep trak of last processed owner
+    stage = 'org_repositories' if type=='organizations' else 'user_repositories'
+    if WORK_QUEUE:
+        load_owners = fetch_organizations_batch if type=='organizations' else fetch_users_batch
+        _crawl_work_units(stage, load_owners, _fetch_owner_repositories)
+        return
+    if CRAWL_PLAN:
+        _crawl_planned(stage, _fetch_owner_repositories)
+        return
+
     conn = open_connection()
     try:
-        create_tables(conn)
-        iterate = 0
-        # Keep trak of last processed owner
-        max_ids = get_max_ids(conn)
-        if type=='organizations':
-            last_owner_id = max_ids.get('max_last_org_id')
-        else:
-            last_owner_id = max_ids.get('max_last_user_id')
-            
-        while True:
-            if iterate == 100:  
-                iterate = 0
-                rate_limits = get_rate_limits()
-                if rate_limits and rate_limits['remaining'] == 0:
-                    reset_time = rate_limits['reset']
-                    sleep_duration = max(reset_time - time.time(), 1)
-                    print(f"Rate limit exceeded. Sleeping for {sleep_duration} seconds.")
-                    time.sleep(sleep_duration)
-                    continue
-            iterate += 1
-            # Fetch a batch of owners from the database
+        apply_write(conn, create_tables)
+        last_owner_id = get_checkpoint(conn, stage)
             
-            if type=='organizations':
-                owners = fetch_organizations_batch(conn, last_owner_id=last_owner_id, batch_size=100)
-            else:
-                owners = fetch_users_batch(conn, last_owner_id=last_owner_id, batch_size=100)
-                
-            if not owners:
-                print(f"No more {type} to process.")
-                break
+        with Pipeline() as pipeline:
+            while True:
+                # Fetch a batch of owners from the database
+                if type=='organizations':
+                    owners = fetch_organizations_batch(conn, last_owner_id=last_owner_id, batch_size=100)
+                else:
+                    owners = fetch_users_batch(conn, last_owner_id=last_owner_id, batch_size=100)
+                    
+                if not owners:
+                    print(f"No more {type} to process.")
+                    break
 
-            for owner in owners:
-                login = owner['login']
-                repos_url = f"{BASE_URL}/users/{login}/repos"
-
-                params= {
-                    'type': 'public',
-                    'sort': 'created',
-                    'direction': 'asc',
-                    'per_page': 100,
-                    'page': 1
-                }
-
-                has_more_pages = True
-                while has_more_pages:
-                    response = safe_request(repos_url, headers=HEADERS, params=params)
-                    if response.status_code == 200:
-                        repos = response.json()
-                        if not repos:
-                            # print(f"No more repositories to fetch for {type} {login}.")
-                            break
-
-                        for repo in repos:
-                            repo['owner'] = login
-                            repo['owner_id'] = owner['id']
-                            repo['owner_type'] = owner['type']
-                            insert_repository_data(conn, repo)
-
-                        if 'next' in response.links:
-                            params['page'] += 1  # Go to the next page
-                        else:
-                            has_more_pages = False
-                    elif response and response.status_code >= 400:
-                        has_more_pages = False
-                        print(f"Failed to fetch repositories for user {repos_url}. HTTP {response.status_code}, Error: {response.text}")
-                    else:
-                        has_more_pages = False
-                        print(f"Failed to fetch repositories for user {repos_url}. No response is available")
-                                    
-            # Assuming the 'id' of the last user in the batch is the highest 'id' processed in this batch
-            last_owner_id = owners[-1]['id']
-            
-            # Store the lates owner that we processed
-            if type=='organizations':
-                log_data = {'last_org_id': last_owner_id}
-            else:
-                log_data = {'last_user_id': last_owner_id}    
-            insert_log_data(conn, log_data)
+                _wait_all(_fetch_batch(pipeline, conn, stage, owners, _fetch_owner_repositories))
+                                        
+                # Assuming the 'id' of the last user in the batch is the highest 'id' processed in this batch
+                last_owner_id = owners[-1]['id']
+                
+                # Store the lates owner that we processed, queued behind all rows of the batch
+                pipeline.write(set_checkpoint, stage, last_owner_id)
     finally:
         close_connection(conn)
+
+def _fetch_repository_issues_graphql(pipeline, repo, stage, next_page=1):
+    """
+    Fetches the issues of one repository with GraphQL, starting after the stored cursor. Runs on a fetcher worker.
+    Each page is stored together with the repository's page cursor. The page cursor's next page counts
+    REST pages of 100 issues stored so far, so the REST crawler can take over without missing issues.
+    Repositories with pull requests are fetched with REST, which lists the pull requests among the
+    issues under ids that GraphQL does not return.
+    """
+    from graphql_api import fetch_issues_page, MAX_ISSUES_PAGE_SIZE, MIN_ISSUES_PAGE_SIZE, ISSUES_PAGE_SIZE_RECOVERY
+    full_name = repo['full_name']
+    after = get_after_cursor(pipeline.read_connection(), stage, repo['id'])
+    # A page cursor left by the REST crawler has no GraphQL cursor, the repository then starts over
+    stored = (next_page - 1) * 100 if after else 0
+    page_size = MAX_ISSUES_PAGE_SIZE
+    # Pages stored in a row at the current page size
+    successes = 0
+
+    while True:
+        page = fetch_issues_page(full_name, repo['id'], after, page_size)
+        if page is None:
+            if page_size > MIN_ISSUES_PAGE_SIZE:
+                # Large pages of long issues can time out or exceed GitHub's resource limits
+                page_size = max(MIN_ISSUES_PAGE_SIZE, page_size // 2)
+                successes = 0
+                print(f"Retrying the issues of {full_name} in pages of {page_size}.")
+                continue
+            print(f"Failed to fetch issues for repository {full_name} with GraphQL.")
+            return
+        issues, after, has_next_page, pull_requests = page
+        if pull_requests:
+            # GraphQL pages skip the pull requests, so the REST pages start over
+            _fetch_repository_issues_rest(pipeline, repo, stage)
+            return
+        stored += len(issues)
+        if issues:
+            if has_next_page:
+                pipeline.write(store_page, insert_issues_batch, issues, stage, repo['id'], stored // 100 + 1, after)
+            else:
+                pipeline.write(store_page, insert_issues_batch, issues, stage, repo['id'], None)
+        elif not has_next_page:
+            pipeline.write(set_page_cursor, stage, repo['id'], None)
+        if not has_next_page:
+            return
+        successes += 1
+        if successes >= ISSUES_PAGE_SIZE_RECOVERY and page_size < MAX_ISSUES_PAGE_SIZE:
+            # Only a run of stored pages tries larger pages again, so a repository that needs small
+            # pages does not alternate between failing and working requests
+            page_size = min(MAX_ISSUES_PAGE_SIZE, page_size * 2)
+            successes = 0
+
+def _fetch_repository_issues(pipeline, repo, stage, next_page=1):
+    """
+    Fetches the issue pages of one repository, starting at next_page. Runs on a fetcher worker.
+    With ISSUES_MODE set to GRAPHQL the issues are fetched with GraphQL instead.
+    """
+    if ISSUES_MODE == 'GRAPHQL':
+        _fetch_repository_issues_graphql(pipeline, repo, stage, next_page)
+    else:
+        _fetch_repository_issues_rest(pipeline, repo, stage, next_page)
+
+def _fetch_repository_issues_rest(pipeline, repo, stage, next_page=1):
+    """
+    Fetches the issue pages of one repository from the REST endpoint, starting at next_page.
+    Each page is stored together with the repository's page cursor.
+    """
+    conn = pipeline.read_connection()
+    full_name = repo['full_name']
+    issues_url = f"{BASE_URL}/repos/{full_name}/issues"
+
+    params = {
+        'state': 'all',
+        'sort': 'created',
+        'direction': 'asc',
+        'per_page': 100,
+        'page': next_page
+    }
+
+    has_more_pages = True
+    while has_more_pages:
+        try:
+            response, links = conditional_request(conn, issues_url, params)
+            if response and response.status_code in (200, 304):
+                # A 304 means the stored page is still current
+                if response.status_code == 200:
+                    issues = decode_json(response)
+                    if not issues:
+                        # print(f"No more issues to fetch for {full_name}.")
+                        pipeline.write(set_page_cursor, stage, repo['id'], None)
+                        break
+
+                    for issue in issues:
+                        issue['repository_id'] = repo['id']
+                    pipeline.write(store_page, insert_issues_batch, issues, stage, repo['id'], params['page'] + 1 if 'next' in links else None)
+                    pipeline.write(remember_response, issues_url, dict(params), response, len(issues))
+                    archive_page('issues', issues_url, dict(params), response, issues)
+                elif 'next' not in links:
+                    # The unchanged last page completes the repository
+                    pipeline.write(set_page_cursor, stage, repo['id'], None)
+
+                if 'next' in links:
+                    params['page'] += 1
+                else:
+                    has_more_pages = False
+            elif response and response.status_code >= 400:
+                print(f"Failed to fetch issues for repository {issues_url}. HTTP {response.status_code}, Error: {response.text}")
+                has_more_pages = False
+            else:
+                print(f"Failed to fetch issues for repository {issues_url}. No response is available")
+                has_more_pages = False
+        except Exception as e:
+            print(f"Exception occurred while fetching issues for {full_name}: {e}")
+            traceback.print_exc()  # Print the stack trace to understand the cause of the exception
+            raise
         
 def fetch_issues(type='organizations'):
     """
     Fetches issues for each repository from the GitHub API and inserts data into the database.
+    Repositories of a batch are fetched by the pipeline's fetcher workers and written by its writer.
+    With WORK_QUEUE enabled the repositories are leased in work units, shared with other workers,
+    with CRAWL_PLAN enabled they are crawled in the order of the crawl plan.
     """
+    # Keep trak of last processed repository
+    stage = 'org_issues' if type=='organizations' else 'user_issues'
+    if WORK_QUEUE:
+        owner_type = 'Organization' if type=='organizations' else 'User'
+        _crawl_work_units(stage, lambda conn, last_id, batch_size: fetch_repos_batch(conn, last_id, batch_size, owner_type), _fetch_repository_issues)
+        return
+    if CRAWL_PLAN:
+        _crawl_planned(stage, _fetch_repository_issues)
+        return
+
     conn = open_connection()
     try:
-        create_tables(conn)
-        iterate = 0
-        # Keep trak of last processed repository
-        max_ids = get_max_ids(conn)
-        if type=='organizations':
-            last_repository_id = max_ids.get('max_last_org_repository_id')
-        else:
-            last_repository_id = max_ids.get('max_last_user_repository_id')
+        apply_write(conn, create_tables)
+        last_repository_id = get_checkpoint(conn, stage)
             
-        while True:
-            if iterate == 100:  
-                iterate = 0        
-                rate_limits = get_rate_limits()
-                if rate_limits and rate_limits['remaining'] == 0:
-                    reset_time = rate_limits['reset']
-                    sleep_duration = max(reset_time - time.time(), 1)
-                    print(f"Rate limit exceeded. Sleeping for {sleep_duration} seconds.")
-                    time.sleep(sleep_duration)
+        with Pipeline() as pipeline:
+            while True:
+                # Fetch a batch of repositories from the database
+                if type=='organizations':
+                    repos = fetch_repos_batch(conn, last_repository_id=last_repository_id, batch_size=100, owner_type='Organization')
+                else:
+                    repos = fetch_repos_batch(conn, last_repository_id=last_repository_id, batch_size=100, owner_type='User')
+                
+                if not repos:
+                    print("No more repositories to process.")
+                    break
+
+                _wait_all(_fetch_batch(pipeline, conn, stage, repos, _fetch_repository_issues))
+
+                # Assuming the 'id' of the last repository in the batch is the highest 'id' processed in this batch
+                last_repository_id = repos[-1]['id']
+                
+                # Store the lates repository that we processed, queued behind all rows of the batch
+                pipeline.write(set_checkpoint, stage, last_repository_id)
+    finally:
+        close_connection(conn)
+
+def follow_issues(type='organizations', upstream_running=lambda: False, poll_seconds=10):
+    """
+    Fetches issues while the repository crawl of the same owners is still running: the issues of an
+    owner's repositories are fetched as soon as the repository stage's checkpoint has passed the owner.
+    Progress is kept as the last processed owner under the checkpoint '<stage>_follow'.
+    Returns once upstream_running() is False and the repositories of all its owners were crawled.
+    - poll_seconds: Wait time for new repositories while the repository stage is running.
+    """
+    stage = 'org_issues' if type=='organizations' else 'user_issues'
+    repository_stage = 'org_repositories' if type=='organizations' else 'user_repositories'
+    follow_stage = f"{stage}_follow"
+    owner_type = 'Organization' if type=='organizations' else 'User'
+
+    conn = open_connection()
+    try:
+        apply_write(conn, create_tables)
+        last_owner_id = get_checkpoint(conn, follow_stage)
+
+        with Pipeline() as pipeline:
+            while True:
+                # Checked before the checkpoint is read, so a repository stage that just finished has stored its last checkpoint
+                running = upstream_running()
+                up_to_owner_id = get_checkpoint(conn, repository_stage)
+                repos = fetch_repos_of_owners_batch(conn, last_owner_id=last_owner_id, up_to_owner_id=up_to_owner_id, batch_size=100, owner_type=owner_type)
+                if not repos:
+                    if not running:
+                        print(f"No more repositories to process for {stage}.")
+                        break
+                    time.sleep(poll_seconds)
                     continue
-            iterate += 1
-            # Fetch a batch of repositories from the database
-            # Fetch a batch of owners from the database
-            if type=='organizations':
-                repos = fetch_repos_batch(conn, last_repository_id=last_repository_id, batch_size=100, owner_type='Organization')
+
+                _wait_all(_fetch_batch(pipeline, conn, stage, repos, _fetch_repository_issues))
+
+                last_owner_id = repos[-1]['owner_id']
+                pipeline.write(set_checkpoint, follow_stage, last_owner_id)
+                pipeline.write(clear_page_cursors, stage, [repo['id'] for repo in repos])
+    finally:
+        close_connection(conn)
+
+def _refresh_repository_issues(pipeline, repo):
+    """
+    Fetches the issues of one repository updated since its watermark. Runs on a fetcher worker.
+    Returns True when all pages were fetched and the watermark was advanced.
+    """
+    full_name = repo['full_name']
+    issues_url = f"{BASE_URL}/repos/{full_name}/issues"
+    params = {
+        'state': 'all',
+        'sort': 'updated',
+        'direction': 'asc',
+        'per_page': 100,
+        'page': 1
+    }
+    max_updated_at = repo['max_updated_at']
+    if max_updated_at:
+        params['since'] = max_updated_at
+
+    while True:
+        response = safe_request(issues_url, headers=HEADERS, params=params)
+        if response and response.status_code == 200:
+            issues = decode_json(response)
+            if issues:
+                for issue in issues:
+                    issue['repository_id'] = repo['id']
+                pipeline.write(insert_issues_batch, issues)
+                archive_page('issues', issues_url, dict(params), response, issues)
+                # ISO 8601 timestamps in UTC compare correctly as strings
+                max_updated_at = max([issue['updated_at'] for issue in issues] + ([max_updated_at] if max_updated_at else []))
+
+            if issues and 'next' in response.links:
+                params['page'] += 1
             else:
-                repos = fetch_repos_batch(conn, last_repository_id=last_repository_id, batch_size=100, owner_type='User')
-            
-            
-            if not repos:
-                print("No more repositories to process.")
                 break
+        elif response is not None and response.status_code in (404, 410):
+            print(f"Issues of repository {issues_url} are not available. HTTP {response.status_code}")
+            # Deleted repositories and repositories with issues disabled are skipped until the repository changes
+            pipeline.write(upsert_issue_watermark, repo['id'], max_updated_at, repo['updated_at'], repo['pushed_at'])
+            return False
+        elif response is not None and response.status_code >= 400:
+            print(f"Failed to refresh issues for repository {issues_url}. HTTP {response.status_code}, Error: {response.text}")
+            # A failed repository keeps its old watermark and is retried by the next refresh
+            return False
+        else:
+            print(f"Failed to refresh issues for repository {issues_url}. No response is available")
+            return False
 
-            for repo in repos:
-                full_name = repo['full_name']
-                issues_url = f"{BASE_URL}/repos/{full_name}/issues"
-
-                params = {
-                    'state': 'all',
-                    'sort': 'created',
-                    'direction': 'asc',
-                    'per_page': 100,
-                    'page': 1
-                }
-
-                has_more_pages = True
-                while has_more_pages:
-                    try:
-                        response = safe_request(issues_url, headers=HEADERS, params=params)
-                        if response and response.status_code == 200:
-                            issues = response.json()
-                            if not issues:
-                                # print(f"No more issues to fetch for {full_name}.")
-                                break
-
-                            for issue in issues:
-                                try:
-                                    issue['repository_id'] = repo['id']
-                                    insert_issue_data(conn, issue)
-                                except Exception as e:
-                                    print(f"Error processing issue {issue.get('number', 'Unknown')} for repository {full_name}: {e}")
-                                    traceback.print_exc()  # Provides the stack trace
-                                    exit(1)
-
-                            if 'next' in response.links:
-                                params['page'] += 1
-                            else:
-                                has_more_pages = False
-                        elif response and response.status_code >= 400:
-                            print(f"Failed to fetch issues for repository {issues_url}. HTTP {response.status_code}, Error: {response.text}")
-                            has_more_pages = False
-                        else:
-                            print(f"Failed to fetch issues for repository {issues_url}. No response is available")
-                            has_more_pages = False
-                    except Exception as e:
-                        print(f"Exception occurred while fetching issues for {full_name}: {e}")
-                        traceback.print_exc()  # Print the stack trace to understand the cause of the exception
-                        has_more_pages = False  # Prevent further attempts to fetch pages
-                        exit(1)
-
-
-            # Assuming the 'id' of the last repository in the batch is the highest 'id' processed in this batch
-            last_repository_id = repos[-1]['id']
-            
-            # Store the lates repository that we processed
-            if type=='organizations':
-                log_data = {'last_org_repository_id': last_repository_id}
+    pipeline.write(upsert_issue_watermark, repo['id'], max_updated_at, repo['updated_at'], repo['pushed_at'])
+    return True
+
+def plan_crawls():
+    """
+    Rebuilds the crawl plans of all repository and issue stages, e.g. after new owners or repositories were crawled.
+    """
+    conn = open_connection()
+    try:
+        apply_write(conn, create_tables)
+        for stage in ('org_repositories', 'user_repositories', 'org_issues', 'user_issues'):
+            plan_crawl(conn, stage)
+    finally:
+        close_connection(conn)
+
+def refresh_issues(type='organizations'):
+    """
+    Incrementally refreshes issues of each repository: only issues updated since the newest one
+    stored by the last refresh are fetched, and repositories whose updated_at and pushed_at
+    did not move since then are skipped.
+    """
+    conn = open_connection()
+    try:
+        apply_write(conn, create_tables)
+        owner_type = 'Organization' if type=='organizations' else 'User'
+        last_repository_id = 0
+        refreshed = 0
+        skipped = 0
+
+        with Pipeline() as pipeline:
+            while True:
+                repos = fetch_repos_refresh_batch(conn, last_repository_id=last_repository_id, batch_size=100, owner_type=owner_type)
+                if not repos:
+                    print(f"No more repositories to refresh. Refreshed {refreshed}, skipped {skipped} unchanged repositories.")
+                    break
+
+                futures = []
+                for repo in repos:
+                    if repo['refreshed'] and repo['updated_at'] == repo['repo_updated_at'] and repo['pushed_at'] == repo['repo_pushed_at']:
+                        skipped += 1
+                        continue
+                    futures.append(pipeline.fetch(_refresh_repository_issues, pipeline, repo))
+                refreshed += sum(_wait_all(futures))
+
+                last_repository_id = repos[-1]['id']
+    finally:
+        close_connection(conn)
+
+def _fetch_repository_comments(pipeline, repo, since):
+    """
+    Fetches the comment pages of one repository updated since the given timestamp, or all of them
+    when since is None. Runs on a fetcher worker.
+    Once all pages are stored, the newest updated_at seen becomes the repository's comment watermark.
+    """
+    conn = pipeline.read_connection()
+    full_name = repo['full_name']
+    comments_url = f"{BASE_URL}/repos/{full_name}/issues/comments"
+
+    params = {
+        'sort': 'created',
+        'direction': 'asc',
+        'per_page': 100,
+        'page': 1
+    }
+    if since:
+        params['since'] = since
+    max_updated_at = since
+
+    has_more_pages = True
+    while has_more_pages:
+        response, links = conditional_request(conn, comments_url, params)
+        if response and response.status_code in (200, 304):
+            # A 304 means the stored page is still current
+            if response.status_code == 200:
+                comments = decode_json(response)
+                if not comments:
+                    break
+
+                numbers = [int(comment['issue_url'].rsplit('/', 1)[-1]) for comment in comments]
+                issue_ids = get_issue_ids_by_number(conn, repo['id'], numbers)
+                for comment, number in zip(comments, numbers):
+                    comment['issue_id'] = issue_ids.get(number)
+                pipeline.write(insert_comments_batch, comments)
+                pipeline.write(remember_response, comments_url, dict(params), response, len(comments))
+                archive_page('comments', comments_url, dict(params), response, comments)
+                # ISO 8601 timestamps in UTC compare correctly as strings
+                max_updated_at = max([comment['updated_at'] for comment in comments] + ([max_updated_at] if max_updated_at else []))
+
+            if 'next' in links:
+                params['page'] += 1
             else:
-                log_data = {'last_user_repository_id': last_repository_id}    
-            insert_log_data(conn, log_data)
+                has_more_pages = False
+        elif response is not None and response.status_code >= 400:
+            # A failed repository keeps its old watermark
+            print(f"Failed to fetch comments for repository {comments_url}. HTTP {response.status_code}, Error: {response.text}")
+            return
+        else:
+            print(f"Failed to fetch comments for repository {comments_url}. No response is available")
+            return
+
+    if max_updated_at:
+        pipeline.write(upsert_comment_watermark, repo['id'], max_updated_at)
+
+def fetch_comments(type='organizations', since=None):
+    """
+    Fetches comments of each repository from the GitHub API with the repository-wide comments
+    endpoint, so each page costs one request regardless of the number of issues, and inserts
+    data into the database. Comments are linked to their issue by the issue number.
+    By default only comments updated since the newest one of the repository's last complete crawl are fetched.
+    - since: Fetch comments updated at or after this ISO 8601 timestamp instead, for every repository.
+    """
+    conn = open_connection()
+    try:
+        apply_write(conn, create_tables)
+        # Keep trak of last processed repository
+        stage = 'org_comments' if type=='organizations' else 'user_comments'
+        last_repository_id = get_checkpoint(conn, stage)
+        owner_type = 'Organization' if type=='organizations' else 'User'
+
+        with Pipeline() as pipeline:
+            while True:
+                repos = fetch_repos_batch(conn, last_repository_id=last_repository_id, batch_size=100, owner_type=owner_type)
+                if not repos:
+                    print("No more repositories to process.")
+                    break
+
+                watermarks = {} if since else get_comment_watermarks(conn, [repo['id'] for repo in repos])
+                _wait_all([pipeline.fetch(_fetch_repository_comments, pipeline, repo, since or watermarks.get(repo['id'])) for repo in repos])
+
+                # Assuming the 'id' of the last repository in the batch is the highest 'id' processed in this batch
+                last_repository_id = repos[-1]['id']
+
+                # Store the lates repository that we processed, queued behind all rows of the batch
+                pipeline.write(set_checkpoint, stage, last_repository_id)
     finally:
-        close_connection(conn)
\ No newline at end of file
+        close_connection(conn)
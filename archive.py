@@ -0,0 +1,164 @@
+import atexit
+import glob
+import io
+import json
+import mmap
+import os
+import threading
+import time
+from database import open_connection, close_connection, create_tables, insert_organizations_batch, insert_users_batch, insert_repos_batch, insert_issues_batch, insert_comments_batch
+from pipeline import apply_write
+from config import ARCHIVE_DIR, ARCHIVE_SEGMENT_PAGES
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Response headers kept with every archived page
+ARCHIVED_HEADERS = ('ETag', 'Last-Modified', 'Link', 'Date', 'X-GitHub-Request-Id')
+
+# The insert function that loads each kind of archived page
+LOADERS = {
+    'organizations': insert_organizations_batch,
+    'users': insert_users_batch,
+    'repositories': insert_repos_batch,
+    'issues': insert_issues_batch,
+    'comments': insert_comments_batch,
+}
+
+SEGMENT_SUFFIX = '.ndjson.zst'
+
+class Archive:
+    """
+    Appends pages to zstd compressed NDJSON segment files, one JSON line per page with its
+    URL, params, status, headers and the rows handed to the database.
+    A segment is written under a .part name and renamed when it is closed, so replay only
+    ever reads complete segments.
+    """
+
+    def __init__(self, directory, segment_pages=ARCHIVE_SEGMENT_PAGES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_pages = segment_pages
+        self._lock = threading.Lock()
+        self._compressor = zstandard.ZstdCompressor(level=3)
+        self._stream = None
+        self._path = None
+        self._pages = 0
+        self._sequence = 0
+
+    def _open_segment(self):
+        name = f"pages-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._sequence:06d}{SEGMENT_SUFFIX}"
+        self._path = os.path.join(self.directory, name)
+        self._stream = self._compressor.stream_writer(open(f"{self._path}.part", 'wb'))
+
+    def _close_segment(self):
+        # Closing the compressor finishes the frame and closes the file
+        self._stream.close()
+        os.replace(f"{self._path}.part", self._path)
+        self._stream = None
+        self._pages = 0
+        self._sequence += 1
+
+    def record(self, kind, url, params, response, rows):
+        """
+        Appends a page to the current segment, starting a new segment every segment_pages pages.
+        """
+        line = json.dumps({
+            'kind': kind,
+            'url': url,
+            'params': params,
+            'status': response.status_code,
+            'headers': {header: response.headers[header] for header in ARCHIVED_HEADERS if header in response.headers},
+            'fetched_at': time.time(),
+            'rows': rows,
+        }, separators=(',', ':')) + '\n'
+        data = line.encode('utf-8')
+        with self._lock:
+            if self._stream is None:
+                self._open_segment()
+            self._stream.write(data)
+            self._pages += 1
+            if self._pages >= self.segment_pages:
+                self._close_segment()
+
+    def close(self):
+        """
+        Closes the current segment.
+        """
+        with self._lock:
+            if self._stream is not None:
+                self._close_segment()
+
+def _create_archive():
+    if not ARCHIVE_DIR:
+        return None
+    if zstandard is None:
+        print("ARCHIVE_DIR is set but zstandard is not installed. Pages are not archived.")
+        return None
+    archive = Archive(ARCHIVE_DIR)
+    atexit.register(archive.close)
+    return archive
+
+_archive = _create_archive()
+
+def archive_page(kind, url, params, response, rows):
+    """
+    Archives a page of rows of the given kind when ARCHIVE_DIR is set.
+    """
+    if _archive is not None:
+        _archive.record(kind, url, params, response, rows)
+
+def close_archive():
+    """
+    Closes the current segment, so everything archived so far can be replayed.
+    """
+    if _archive is not None:
+        _archive.close()
+
+def read_segment(path):
+    """
+    Yields the pages of a segment file. The file is memory mapped and decompressed as a stream,
+    so segments of any size are read with bounded memory.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            reader = zstandard.ZstdDecompressor().stream_reader(mapped)
+            for line in io.TextIOWrapper(io.BufferedReader(reader), encoding='utf-8'):
+                yield json.loads(line)
+
+def replay_archive(directory=ARCHIVE_DIR, batch_rows=10000):
+    """
+    Loads all complete segments of the archive into the database without any API calls.
+    Rows of consecutive pages of a kind are inserted together, batch_rows at a time.
+    Loading is an upsert, so replaying a segment twice is harmless.
+    """
+    if zstandard is None:
+        raise RuntimeError("Replaying the archive needs zstandard, install it with: pip install zstandard")
+    if not directory:
+        raise ValueError("No archive directory is given, set ARCHIVE_DIR.")
+
+    conn = open_connection()
+    try:
+        apply_write(conn, create_tables)
+        for path in sorted(glob.glob(os.path.join(directory, f"*{SEGMENT_SUFFIX}"))):
+            pending = {kind: [] for kind in LOADERS}
+            pages = 0
+            rows = 0
+            for page in read_segment(path):
+                kind = page['kind']
+                pending[kind].extend(page['rows'])
+                pages += 1
+                rows += len(page['rows'])
+                if len(pending[kind]) >= batch_rows:
+                    apply_write(conn, LOADERS[kind], pending[kind])
+                    pending[kind] = []
+            for kind, kind_rows in pending.items():
+                if kind_rows:
+                    apply_write(conn, LOADERS[kind], kind_rows)
+            print(f"Replayed {pages} pages with {rows} rows of {os.path.basename(path)}.")
+    finally:
+        close_connection(conn)
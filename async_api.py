@@ -0,0 +1,193 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+from database import open_connection, close_connection, create_tables, fetch_users_batch, fetch_organizations_batch, fetch_repos_batch, insert_repos_batch, insert_issues_batch, get_checkpoint, set_checkpoint, get_http_cache
+from config import BASE_URL, CRAWL_CONCURRENCY
+from pipeline import open_writer, apply_write
+from archive import archive_page
+from metrics import decode_json
+from api import safe_request, http_cache_key, conditional_headers, cached_links, remember_response, revalidatable
+
+# Database reads happen on the event loop thread and writes are queued for a dedicated
+# writer thread, only the HTTP round trips and the JSON decoding run in worker threads. Pages of one owner or repository are
+# fetched concurrently once the first page reveals the last page number, later pages are followed one by one. Pages are
+# requested conditionally, so unchanged pages cost no quota and are not rewritten.
+
+def _get_page(url, params, headers):
+    """
+    Fetches one page and decodes it. Runs in a worker thread.
+    Returns the response and the decoded JSON, or None when the request failed or the page did not change.
+    """
+    response = safe_request(url, headers=headers, params=params)
+    if response and response.status_code == 200:
+        return response, decode_json(response)
+    return response, None
+
+def _last_page(links):
+    """
+    Returns the page number of the 'last' link of a paginated response, or None.
+    """
+    last = links.get('last')
+    if not last:
+        return None
+    page = parse_qs(urlparse(last['url']).query).get('page')
+    return int(page[0]) if page else None
+
+async def _write(writer, function, *args):
+    # Queue from a worker thread, so a full write queue does not block the event loop
+    await asyncio.to_thread(writer.submit, function, *args)
+
+async def _fetch_all_pages(conn, writer, semaphore, url, params, handle_page, description, kind):
+    """
+    Fetches every page of a paginated endpoint and passes each changed, decoded page to the
+    coroutine handle_page, which prepares the rows of the given kind and stores them.
+    The first page is fetched alone, the remaining pages are fetched concurrently.
+    """
+    async def fetch(page):
+        # Returns the links of the page, or None when the page failed or was empty
+        page_params = dict(params, page=page)
+        cache_entry = revalidatable(get_http_cache(conn, http_cache_key(url, page_params)), page_params)
+        async with semaphore:
+            response, data = await asyncio.to_thread(_get_page, url, page_params, conditional_headers(cache_entry))
+        if response and response.status_code == 304:
+            # The stored page is still current
+            return cached_links(cache_entry)
+        if data is None:
+            if response:
+                print(f"Failed to fetch {description} {url} page {page}. HTTP {response.status_code}, Error: {response.text}")
+            else:
+                print(f"Failed to fetch {description} {url} page {page}. No response is available")
+            return None
+        if not data:
+            return None
+        await handle_page(data)
+        await _write(writer, remember_response, url, page_params, response, len(data))
+        archive_page(kind, url, page_params, response, data)
+        return response.links
+
+    links = await fetch(1)
+    if links is None:
+        return
+
+    page = 1
+    last_page = _last_page(links)
+    if last_page:
+        results = await asyncio.gather(*(fetch(page) for page in range(2, last_page + 1)))
+        # The 'last' link of an unchanged first page is the stored one, pages added since follow the last page
+        if results:
+            page = last_page
+            links = results[-1]
+    # Without a 'last' link, and after the last one, follow pages one by one
+    while links and 'next' in links:
+        page += 1
+        links = await fetch(page)
+
+async def _fetch_owner_repositories(conn, writer, semaphore, owner):
+    login = owner['login']
+    repos_url = f"{BASE_URL}/users/{login}/repos"
+    params = {
+        'type': 'public',
+        'sort': 'created',
+        'direction': 'asc',
+        'per_page': 100
+    }
+
+    async def handle_page(repos):
+        for repo in repos:
+            repo['owner'] = login
+            repo['owner_id'] = owner['id']
+            repo['owner_type'] = owner['type']
+        await _write(writer, insert_repos_batch, repos)
+
+    await _fetch_all_pages(conn, writer, semaphore, repos_url, params, handle_page, "repositories for user", 'repositories')
+
+async def _fetch_repository_issues(conn, writer, semaphore, repo):
+    full_name = repo['full_name']
+    issues_url = f"{BASE_URL}/repos/{full_name}/issues"
+    params = {
+        'state': 'all',
+        'sort': 'created',
+        'direction': 'asc',
+        'per_page': 100
+    }
+
+    async def handle_page(issues):
+        for issue in issues:
+            issue['repository_id'] = repo['id']
+        await _write(writer, insert_issues_batch, issues)
+
+    await _fetch_all_pages(conn, writer, semaphore, issues_url, params, handle_page, "issues for repository", 'issues')
+
+async def _crawl_repositories(conn, writer, type, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    # Keep trak of last processed owner
+    stage = 'org_repositories' if type=='organizations' else 'user_repositories'
+    last_owner_id = get_checkpoint(conn, stage)
+
+    while True:
+        if type=='organizations':
+            owners = fetch_organizations_batch(conn, last_owner_id=last_owner_id, batch_size=100)
+        else:
+            owners = fetch_users_batch(conn, last_owner_id=last_owner_id, batch_size=100)
+
+        if not owners:
+            print(f"No more {type} to process.")
+            break
+
+        await asyncio.gather(*(_fetch_owner_repositories(conn, writer, semaphore, owner) for owner in owners))
+
+        # Owners finish out of order, only once the whole batch is done its last owner is a safe checkpoint
+        last_owner_id = owners[-1]['id']
+        await _write(writer, set_checkpoint, stage, last_owner_id)
+
+async def _crawl_issues(conn, writer, type, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    # Keep trak of last processed repository
+    stage = 'org_issues' if type=='organizations' else 'user_issues'
+    last_repository_id = get_checkpoint(conn, stage)
+    owner_type = 'Organization' if type=='organizations' else 'User'
+
+    while True:
+        repos = fetch_repos_batch(conn, last_repository_id=last_repository_id, batch_size=100, owner_type=owner_type)
+        if not repos:
+            print("No more repositories to process.")
+            break
+
+        await asyncio.gather(*(_fetch_repository_issues(conn, writer, semaphore, repo) for repo in repos))
+
+        # Repositories finish out of order, only once the whole batch is done its last repository is a safe checkpoint
+        last_repository_id = repos[-1]['id']
+        await _write(writer, set_checkpoint, stage, last_repository_id)
+
+def _run(crawl, type, concurrency):
+    async def runner():
+        # asyncio.to_thread uses the default executor, size it to the concurrency bound
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+        conn = open_connection()
+        try:
+            apply_write(conn, create_tables)
+            writer = open_writer()
+            try:
+                await crawl(conn, writer, type, concurrency)
+            finally:
+                # Drain the queued writes before leaving
+                await asyncio.to_thread(writer.close)
+        finally:
+            close_connection(conn)
+
+    asyncio.run(runner())
+
+def fetch_repositories_concurrently(type='organizations', concurrency=CRAWL_CONCURRENCY):
+    """
+    Fetches repositories of many owners at once and inserts data into the database.
+    - concurrency: Maximum number of requests in flight.
+    """
+    _run(_crawl_repositories, type, concurrency)
+
+def fetch_issues_concurrently(type='organizations', concurrency=CRAWL_CONCURRENCY):
+    """
+    Fetches issues of many repositories at once and inserts data into the database.
+    - concurrency: Maximum number of requests in flight.
+    """
+    _run(_crawl_issues, type, concurrency)
@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from dotenv import load_dotenv
+from mock_github import MockGitHubServer, add_mock_arguments, mock_from_arguments
+
+# Throughput benchmark of the crawlers against the local mock API. Every database backend runs
+# in a process of its own, since the backend is chosen when database.py is imported. Postgres
+# runs in a separate 'benchmark' schema of the database configured in .env, which is recreated
+# on every run, so crawled data is never touched.
+
+BENCHMARK_SCHEMA = 'benchmark'
+
+# Stage name, crawler function name, arguments and the table it fills
+STAGES = [
+    ('organizations', 'fetch_organizations', (), 'organizations'),
+    ('users', 'fetch_users', (), 'users'),
+    ('org repositories', 'fetch_repositories', ('organizations',), 'repositories'),
+    ('user repositories', 'fetch_repositories', ('users',), 'repositories'),
+    ('org issues', 'fetch_issues', ('organizations',), 'issues'),
+    ('user issues', 'fetch_issues', ('users',), 'issues'),
+    ('org comments', 'fetch_comments', ('organizations',), 'comments'),
+    ('user comments', 'fetch_comments', ('users',), 'comments'),
+]
+
+def _prepare_postgres():
+    import psycopg2
+    conn = psycopg2.connect(
+        dbname=os.getenv('DB_NAME'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        host=os.getenv('DB_HOST'),
+        port=os.getenv('DB_PORT')
+    )
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {BENCHMARK_SCHEMA}")
+    conn.close()
+    # libpq applies these options to every connection the crawlers open
+    os.environ['PGOPTIONS'] = f"-c search_path={BENCHMARK_SCHEMA}"
+
+def _count_rows(table):
+    from database import open_connection, close_connection, create_tables
+    from pipeline import apply_write
+    conn = open_connection()
+    try:
+        apply_write(conn, create_tables)
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+    finally:
+        close_connection(conn)
+
+def run_backend(dbms, args):
+    """
+    Crawls every stage against a fresh mock API and database, returns one result per stage.
+    Runs in the process of the backend.
+    """
+    load_dotenv()
+    server = MockGitHubServer(mock_from_arguments(args)).start()
+    directory = tempfile.mkdtemp(prefix='github-benchmark-')
+    os.environ.update({
+        'DBMS': dbms,
+        'DB_PATH': os.path.join(directory, 'benchmark.db'),
+        'GITHUB_API_URL': server.url,
+        'PAT_KEY': 'mock-token',
+        'PAT_KEYS': '',
+        'PAT_KEYS_FILE': '',
+        'CRAWL_CONCURRENCY': str(args.concurrency),
+        'ARCHIVE_DIR': '',
+    })
+    if dbms == 'POSTGRES':
+        _prepare_postgres()
+
+    import api
+    from config import CRAWL_ENGINE, WORK_QUEUE
+    from metrics import DB_WRITE_SECONDS, ROWS_UNCHANGED
+    crawlers = {name: getattr(api, name) for _, name, _, _ in STAGES}
+    if CRAWL_ENGINE == 'ASYNCIO' and not WORK_QUEUE:
+        import async_api
+        crawlers['fetch_repositories'] = async_api.fetch_repositories_concurrently
+        crawlers['fetch_issues'] = async_api.fetch_issues_concurrently
+
+    results = []
+    try:
+        for stage, name, stage_args, table in STAGES:
+            rows_before = _count_rows(table)
+            served_before = server.mock.snapshot()
+            writes_before, write_seconds_before = DB_WRITE_SECONDS.totals()
+            unchanged_before = ROWS_UNCHANGED.total()
+            started = time.perf_counter()
+            crawlers[name](*stage_args)
+            seconds = time.perf_counter() - started
+            served = server.mock.snapshot()
+            writes, write_seconds = DB_WRITE_SECONDS.totals()
+            rows = _count_rows(table) - rows_before
+            pages = served['pages'] + served['not_modified'] - served_before['pages'] - served_before['not_modified']
+            results.append({
+                'dbms': dbms,
+                'stage': stage,
+                'seconds': round(seconds, 3),
+                'requests': served['requests'] - served_before['requests'],
+                'pages': pages,
+                'rows': rows,
+                'pages_per_second': round(pages / seconds, 1) if seconds else None,
+                'rows_per_second': round(rows / seconds, 1) if seconds else None,
+                'db_writes': writes - writes_before,
+                'db_write_seconds': round(write_seconds - write_seconds_before, 3),
+                'rows_unchanged': ROWS_UNCHANGED.total() - unchanged_before,
+            })
+    finally:
+        server.stop()
+    return results
+
+def print_results(results):
+    columns = ['dbms', 'stage', 'seconds', 'requests', 'pages', 'rows', 'pages_per_second', 'rows_per_second', 'db_writes', 'db_write_seconds', 'rows_unchanged']
+    widths = {column: max(len(column), *(len(str(result[column])) for result in results)) for column in columns}
+    print('  '.join(column.ljust(widths[column]) for column in columns))
+    for result in results:
+        print('  '.join(str(result[column]).ljust(widths[column]) for column in columns))
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures crawler throughput against the local mock GitHub API.')
+    parser.add_argument('--dbms', default='SQLITE', help='Comma separated backends to run: SQLITE, POSTGRES.')
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('CRAWL_CONCURRENCY', 8)))
+    parser.add_argument('--output', help='Also write the results as JSON to this file, e.g. to compare runs.')
+    parser.add_argument('--backend', help=argparse.SUPPRESS)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    if args.backend:
+        # Child process of one backend, report the results on the last line
+        print(json.dumps(run_backend(args.backend, args)))
+        return
+
+    results = []
+    for dbms in [dbms.strip().upper() for dbms in args.dbms.split(',') if dbms.strip()]:
+        print(f"Benchmarking {dbms}...")
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--backend', dbms] + sys.argv[1:], capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(completed.stdout[-2000:])
+            print(completed.stderr[-2000:])
+            print(f"Benchmark of {dbms} failed.")
+            continue
+        results.extend(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    if results:
+        print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 import os
+import socket
 
 # Configuration settings for the application
-BASE_URL = 'https://api.github.com'
+# Points the crawlers at another server, e.g. the mock API of mock_github.py
+BASE_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/53.0.2785.143 Safari/537.36',
     'Authorization': f'token {os.environ.get('PAT_KEY')}',
@@ -10,4 +12,79 @@ HEADERS = {
 PARAMS_BASE = {
     'since': 1,
     'per_page': 100
-}
\ No newline at end of file
+}
+
+# Shared HTTP transport settings
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 60))
+HTTP2 = os.environ.get('HTTP2', 'FALSE').upper() == 'TRUE'
+
+# Maximum number of requests in flight per crawler
+CRAWL_CONCURRENCY = int(os.environ.get('CRAWL_CONCURRENCY', 1))
+# THREADS runs crawlers as fetcher threads feeding a database writer, ASYNCIO runs the repository and issue crawlers on an event loop
+CRAWL_ENGINE = os.environ.get('CRAWL_ENGINE', 'THREADS').upper()
+# Maximum number of pages waiting for the database writer before fetchers are held back
+WRITE_QUEUE_SIZE = int(os.environ.get('WRITE_QUEUE_SIZE', 100))
+
+# SQLite tuning: WAL journal, synchronous level (OFF, NORMAL, FULL or EXTRA), bytes of the file memory mapped,
+# KiB of page cache per connection, seconds between WAL checkpoints of the writer and seconds to wait on a locked database
+SQLITE_WAL = os.environ.get('SQLITE_WAL', 'TRUE').upper() == 'TRUE'
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 268435456))
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', 65536))
+SQLITE_CHECKPOINT_SECONDS = float(os.environ.get('SQLITE_CHECKPOINT_SECONDS', 30))
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 60))
+
+# Postgres: connections pooled per process, which must cover STAGE_CONCURRENCY * (CRAWL_CONCURRENCY + 2),
+# and the batch size from which rows are loaded with COPY into a staging table and merged (0 turns COPY off)
+PG_POOL_SIZE = int(os.environ.get('PG_POOL_SIZE', 64))
+PG_COPY_MIN_ROWS = int(os.environ.get('PG_COPY_MIN_ROWS', 1000))
+
+# Distributed crawling: repositories and issues are crawled in work units leased from the database,
+# so several crawler processes, also on different hosts, can share one stage
+WORK_QUEUE = os.environ.get('WORK_QUEUE', 'FALSE').upper() == 'TRUE'
+# Number of owners or repositories per work unit
+WORK_UNIT_SIZE = int(os.environ.get('WORK_UNIT_SIZE', 100))
+# Seconds after which the unit of a worker that stopped renewing its lease is handed to another worker
+LEASE_SECONDS = int(os.environ.get('LEASE_SECONDS', 600))
+WORKER_ID = os.environ.get('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+
+# Partitioned enumeration of users and organizations: with ENUMERATION_END set, the ids [ENUMERATION_START, ENUMERATION_END)
+# are split into ranges of ENUMERATION_PARTITION_SIZE ids that are crawled in parallel, each with its own since cursor
+ENUMERATION_START = int(os.environ.get('ENUMERATION_START', 1))
+ENUMERATION_END = int(os.environ.get('ENUMERATION_END', 0))
+ENUMERATION_PARTITION_SIZE = int(os.environ.get('ENUMERATION_PARTITION_SIZE', 1000000))
+
+# Crawl repositories and issues in the order of a crawl plan that skips owners and repositories guaranteed to return nothing
+CRAWL_PLAN = os.environ.get('CRAWL_PLAN', 'FALSE').upper() == 'TRUE'
+# Planned users are crawled by followers or public_repos, planned repositories by e.g. stargazers_count or open_issues_count, highest first
+PLAN_OWNER_PRIORITY = os.environ.get('PLAN_OWNER_PRIORITY', 'followers')
+PLAN_REPOSITORY_PRIORITY = os.environ.get('PLAN_REPOSITORY_PRIORITY', 'stargazers_count')
+
+# Directory of the raw page archive, pages are archived only when it is set
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', '')
+# Number of pages per zstd compressed archive segment
+ARCHIVE_SEGMENT_PAGES = int(os.environ.get('ARCHIVE_SEGMENT_PAGES', 1000))
+
+# Parquet export: target directory, tables, rows read per query and rows per file
+EXPORT_DIR = os.environ.get('EXPORT_DIR', './export')
+EXPORT_TABLES = [table.strip() for table in os.environ.get('EXPORT_TABLES', 'organizations,users,repositories,issues,comments,labels').split(',') if table.strip()]
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 50000))
+EXPORT_FILE_ROWS = int(os.environ.get('EXPORT_FILE_ROWS', 1000000))
+
+# Metrics: port of the local Prometheus endpoint (0 turns it off), JSON snapshot file (empty turns it off) and seconds between snapshots
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+METRICS_SNAPSHOT_FILE = os.environ.get('METRICS_SNAPSHOT_FILE', '')
+METRICS_SNAPSHOT_INTERVAL = int(os.environ.get('METRICS_SNAPSHOT_INTERVAL', 60))
+
+# Headless scheduler: stages of a crawl cycle, stages running at once and seconds between cycle starts (0 runs a single cycle)
+SCHEDULE_STAGES = [stage.strip() for stage in os.environ.get('SCHEDULE_STAGES', 'organizations,users,org_repositories,user_repositories,org_issues,user_issues').split(',') if stage.strip()]
+STAGE_CONCURRENCY = int(os.environ.get('STAGE_CONCURRENCY', 2))
+RECRAWL_INTERVAL = int(os.environ.get('RECRAWL_INTERVAL', 0))
+
+# How fetch_users resolves user details: REST (one request per user) or GRAPHQL (one query per page)
+USER_DETAILS_MODE = os.environ.get('USER_DETAILS_MODE', 'REST').upper()
+
+# How the issue crawlers of the THREADS engine fetch issues: REST (100 issues per request with every field) or GRAPHQL (only the stored fields)
+ISSUES_MODE = os.environ.get('ISSUES_MODE', 'REST').upper()
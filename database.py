@@ -1,7 +1,14 @@
+import hashlib
+import io
 import os
 import sqlite3
+import threading
 import psycopg2
+from psycopg2.extras import execute_values
 import json
+from datetime import timezone
+from metrics import DB_UPSERT_SECONDS, ROWS_WRITTEN, ROWS_UNCHANGED
+from config import SQLITE_WAL, SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE, SQLITE_BUSY_TIMEOUT, PG_POOL_SIZE, PG_COPY_MIN_ROWS
 
 DBMS = os.getenv('DBMS')
 
@@ -13,33 +20,138 @@ elif DBMS == 'POSTGRES':
 else:
     raise ValueError("Unsupported DBMS")
 
+# Null-safe inequality, SQLite before 3.39 lacks IS DISTINCT FROM
+IS_DISTINCT_FROM = 'IS NOT' if DBMS == 'SQLITE' else 'IS DISTINCT FROM'
+
+# The database clock as unix seconds, so leases of workers on different hosts compare against one clock
+if DBMS == 'SQLITE':
+    NOW_EPOCH = "CAST(strftime('%s', 'now') AS INTEGER)"
+else:
+    NOW_EPOCH = "CAST(EXTRACT(EPOCH FROM NOW()) AS BIGINT)"
+
+# Size the WAL file is truncated to after a checkpoint, so it does not keep the size of its largest burst
+SQLITE_JOURNAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+def _tune_sqlite(conn):
+    """
+    Applies the SQLite settings for crawling: a WAL journal, so readers and exporters run alongside
+    the writer, the configured synchronous level, a memory mapped file and a larger page cache.
+    """
+    if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        raise ValueError(f"Unsupported SQLITE_SYNCHRONOUS {SQLITE_SYNCHRONOUS}")
+    if SQLITE_WAL:
+        # Stored in the database file, so only the first connection actually switches
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA journal_size_limit={SQLITE_JOURNAL_SIZE_LIMIT}')
+    conn.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}')
+    # A negative size is in KiB instead of pages
+    conn.execute(f'PRAGMA cache_size=-{int(SQLITE_CACHE_SIZE)}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+
+# Longest wait for a pooled connection, a pool that is too small for the crawlers would otherwise hang them
+POOL_WAIT_SECONDS = 300
+
+class _ConnectionPool:
+    """
+    Postgres connections shared by all crawlers and workers of the process, up to PG_POOL_SIZE at once.
+    Connections are opened on demand and kept open when handed back. Taking a connection blocks
+    while all of them are in use.
+    """
+
+    def __init__(self, size):
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def get(self):
+        if not self._slots.acquire(timeout=POOL_WAIT_SECONDS):
+            raise RuntimeError(f"All {PG_POOL_SIZE} pooled database connections stayed in use for {POOL_WAIT_SECONDS} seconds, raise PG_POOL_SIZE.")
+        try:
+            with self._lock:
+                if self._idle:
+                    return self._idle.pop()
+            return psycopg2.connect(
+                dbname=os.getenv('DB_NAME'),
+                user=os.getenv('DB_USER'),
+                password=os.getenv('DB_PASSWORD'),
+                host=os.getenv('DB_HOST'),
+                port=os.getenv('DB_PORT')
+            )
+        except Exception:
+            self._slots.release()
+            raise
+
+    def put(self, conn):
+        try:
+            # Broken connections are dropped, open transactions are not handed to the next user
+            if not conn.closed:
+                conn.rollback()
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _ConnectionPool(PG_POOL_SIZE)
+    return _pool
+
 def open_connection():
     if DBMS == 'SQLITE':
-        conn = sqlite3.connect(os.getenv('DB_PATH'))
+        # Connections of the crawler pipeline are closed by another thread than the one using them
+        conn = sqlite3.connect(os.getenv('DB_PATH'), check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT)
+        _tune_sqlite(conn)
     elif DBMS == 'POSTGRES':
-        conn = psycopg2.connect(
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT')
-        )
+        conn = _get_pool().get()
     else:
         raise ValueError("Unsupported DBMS")
 
     return conn
 
 def close_connection(conn):
+    if DBMS == 'POSTGRES':
+        try:
+            conn.commit()
+        finally:
+            # Hand the connection back to the pool
+            _get_pool().put(conn)
+        return
     conn.commit()
     # Close the database connection
     conn.close()
     
+def checkpoint_wal(conn, mode='PASSIVE'):
+    """
+    Copies the pages of the SQLite WAL back into the database file. PASSIVE never waits for readers,
+    TRUNCATE also empties the WAL file once no reader needs it. Does nothing on Postgres.
+    """
+    if DBMS == 'SQLITE' and SQLITE_WAL:
+        conn.execute(f'PRAGMA wal_checkpoint({mode})')
+
 def remove_nul_characters(text):
     """Remove NUL (0x00) characters from a string."""
     if text is None:
         return ''
     return text.replace('\x00', '')
     
+def _add_column_if_missing(conn, table_name, column_name, column_type):
+    """
+    Adds a column to an existing table, used to migrate databases created by older versions.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT * FROM {table_name} LIMIT 0")
+    if column_name not in [column[0] for column in cursor.description]:
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
+        return True
+    return False
+
 def create_tables(conn):
     cursor = conn.cursor()
     # Create the tags table
@@ -140,7 +252,6 @@ def create_tables(conn):
         owner TEXT,
         owner_type TEXT,
         owner_id BIGINT,  
-        labels JSONB,
         state TEXT,
         locked BOOLEAN,
         comments INTEGER,
@@ -150,7 +261,6 @@ def create_tables(conn):
         author_association TEXT,
         active_lock_reason TEXT,
         body TEXT,
-        reactions JSONB,
         state_reason TEXT
     )
     ''')
@@ -170,6 +280,48 @@ def create_tables(conn):
         reactions JSON
     )
     ''')
+    # Hash of the stored values of each crawled row, rows whose hash did not change are not rewritten
+    for table in ('organizations', 'users', 'repositories', 'issues', 'comments'):
+        _add_column_if_missing(conn, table, 'content_hash', 'TEXT')
+    # Reaction counts of issues as integers, filled from the labels and reactions JSON columns of older databases by _migrate_issue_labels
+    for column in ISSUE_REACTION_COLUMNS:
+        _add_column_if_missing(conn, 'issues', column, 'INTEGER')
+
+    # Labels are stored once by their GitHub id and linked to their issues
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS labels (
+        id BIGINT NOT NULL PRIMARY KEY,
+        repository_id BIGINT,
+        node_id TEXT,
+        url TEXT,
+        name TEXT,
+        color TEXT,
+        "default" BOOLEAN,
+        description TEXT,
+        content_hash TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS issue_labels (
+        issue_id BIGINT NOT NULL,
+        label_id BIGINT NOT NULL,
+        PRIMARY KEY (issue_id, label_id)
+    )
+    ''')
+    # Issues are looked up by label, labels by name
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_issue_labels_label_id ON issue_labels (label_id, issue_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_labels_name ON labels (name, repository_id)')
+
+    # Write sequence of each row's last insert or change, incremental exports resume from it.
+    # Postgres uses the writing transaction's id, SQLite a counter in the write_sequence table.
+    if DBMS == 'SQLITE':
+        cursor.execute('CREATE TABLE IF NOT EXISTS write_sequence (id INTEGER NOT NULL PRIMARY KEY, value BIGINT NOT NULL)')
+        cursor.execute("INSERT INTO write_sequence (id, value) VALUES (1, 0) ON CONFLICT(id) DO NOTHING")
+    for table in WRITE_SEQ_TABLES:
+        if _add_column_if_missing(conn, table, 'write_seq', 'BIGINT'):
+            # Rows stored by older versions count as written before any export
+            cursor.execute(f"UPDATE {table} SET write_seq = 0")
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_write_seq ON {table} (write_seq, id)')
     
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS logs (
@@ -178,59 +330,323 @@ def create_tables(conn):
         last_user_id BIGINT,
         last_org_repository_id BIGINT,
         last_user_repository_id BIGINT,
+        last_org_comment_repository_id BIGINT,
+        last_user_comment_repository_id BIGINT,
         created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
     )
     ''')
+    # Databases created before the comments crawler lack its checkpoint columns
+    _add_column_if_missing(conn, 'logs', 'last_org_comment_repository_id', 'BIGINT')
+    _add_column_if_missing(conn, 'logs', 'last_user_comment_repository_id', 'BIGINT')
+
+    # One row per crawler stage, replacing the append-only logs table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        stage TEXT NOT NULL PRIMARY KEY,
+        last_id BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    # Issues are looked up by repository, comments are linked to their issue by repository and issue number
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_issues_repository_number ON issues (repository_id, number)')
+    # Repository batches are read per owner type in id order
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_repositories_owner_type_id ON repositories (owner_type, id)')
+    # Issue stages following a repository stage read the repositories per owner
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_repositories_owner_type_owner_id ON repositories (owner_type, owner_id, id)')
+
+    # Validators of stored pages, so unchanged pages are answered with 304 Not Modified
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS http_cache (
+        cache_key TEXT NOT NULL PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        link TEXT,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    # Rows of the stored page, a full last page may have gained a next page that its ETag does not cover
+    _add_column_if_missing(conn, 'http_cache', 'row_count', 'INTEGER')
+
+    # Per repository high-water mark of the issues' updated_at for incremental refreshes
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS issue_watermarks (
+        repository_id BIGINT NOT NULL PRIMARY KEY,
+        max_updated_at TEXT,
+        repo_updated_at TIMESTAMP,
+        repo_pushed_at TIMESTAMP,
+        refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    # Per repository high-water mark of the comments' updated_at, comment crawls fetch only comments updated since
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS comment_watermarks (
+        repository_id BIGINT NOT NULL PRIMARY KEY,
+        max_updated_at TEXT,
+        refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    # Ranges of owner or repository ids that crawler workers claim and lease, (range_start, range_end]
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS work_units (
+        stage TEXT NOT NULL,
+        range_start BIGINT NOT NULL,
+        range_end BIGINT NOT NULL,
+        last_id BIGINT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        lease_owner TEXT,
+        lease_expires_at BIGINT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (stage, range_start)
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_work_units_stage_status ON work_units (stage, status, range_start)')
+    # Work units created before partitioned enumeration lack their resume cursor
+    _add_column_if_missing(conn, 'work_units', 'last_id', 'BIGINT')
+
+    # The next page of each owner or repository of an unfinished batch, next_page is NULL once all pages are stored
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS page_cursors (
+        stage TEXT NOT NULL,
+        entity_id BIGINT NOT NULL,
+        next_page INTEGER,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (stage, entity_id)
+    )
+    ''')
+    # The GraphQL cursor after the last stored page, for crawlers paginating with cursors
+    _add_column_if_missing(conn, 'page_cursors', 'after_cursor', 'TEXT')
+
+    # Owners or repositories of a stage in the order the planner wants them crawled
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS crawl_plan (
+        stage TEXT NOT NULL,
+        position BIGINT NOT NULL,
+        entity_id BIGINT NOT NULL,
+        PRIMARY KEY (stage, position)
+    )
+    ''')
+
+    _migrate_checkpoints(conn)
+    _migrate_issue_labels(conn)
    
     conn.commit()
 
-def insert_log_data(conn, log_data):
+def _migrate_checkpoints(conn):
+    """
+    Seeds the checkpoints table of a database created by an older version. Older versions resumed
+    from the highest id in the logs table and from the highest owner or repository id found in the
+    data tables, so both are scanned once here.
+    """
     cursor = conn.cursor()
-    # Assuming PostgreSQL for SQL syntax; adjust as necessary for other DBMS like MySQL
-    sql = f'''
-    INSERT INTO logs 
-    (last_org_id, last_user_id, last_org_repository_id, last_user_repository_id, created_at) 
-    VALUES ({PH}, {PH}, {PH}, {PH}, CURRENT_TIMESTAMP)
-    '''
-    # Values to insert or update
-    values = (
-        log_data.get('last_org_id', 0), 
-        log_data.get('last_user_id', 0), 
-        log_data.get('last_org_repository_id', 0), 
-        log_data.get('last_user_repository_id', 0)
-    )
-    cursor.execute(sql, values)
-    conn.commit()
+    cursor.execute("SELECT COUNT(*) FROM checkpoints")
+    if cursor.fetchone()[0] > 0:
+        return
 
-def insert_organization_data(conn, org_data):
+    queries = {
+        'org_repositories': ["SELECT MAX(last_org_id) FROM logs",
+                             "SELECT MAX(owner_id) FROM repositories WHERE owner_type = 'Organization'"],
+        'user_repositories': ["SELECT MAX(last_user_id) FROM logs",
+                              "SELECT MAX(owner_id) FROM repositories WHERE owner_type = 'User'"],
+        'org_issues': ["SELECT MAX(last_org_repository_id) FROM logs",
+                       "SELECT MAX(i.repository_id) FROM issues i JOIN repositories r ON r.id = i.repository_id WHERE r.owner_type = 'Organization'"],
+        'user_issues': ["SELECT MAX(last_user_repository_id) FROM logs",
+                        "SELECT MAX(i.repository_id) FROM issues i JOIN repositories r ON r.id = i.repository_id WHERE r.owner_type = 'User'"],
+        'org_comments': ["SELECT MAX(last_org_comment_repository_id) FROM logs"],
+        'user_comments': ["SELECT MAX(last_user_comment_repository_id) FROM logs"],
+    }
+    for stage, stage_queries in queries.items():
+        last_id = 0
+        for sql in stage_queries:
+            cursor.execute(sql)
+            last_id = max(last_id, cursor.fetchone()[0] or 0)
+        # Insert every stage, even at 0, so the migration never runs again
+        cursor.execute(f"INSERT INTO checkpoints (stage, last_id) VALUES ({PH}, {PH})", (stage, last_id))
+
+# Issues per batch when copying the labels and reactions JSON columns of an older database
+MIGRATE_ISSUES_BATCH = 1000
+
+def _json_value(value):
+    """
+    Decodes a JSON column, Postgres returns JSONB decoded and SQLite returns its text.
+    """
+    return json.loads(value) if isinstance(value, str) else value
+
+def _migrate_issue_labels(conn):
+    """
+    Copies the labels and reactions JSON columns of issues in a database created by an older version
+    into the labels and issue_labels tables and the reaction columns, then drops the JSON columns,
+    so the migration runs only once. Issues whose reactions were already written by a newer version
+    are left out, as are labels stored since, so newer data is never overwritten by the old columns.
+    """
     cursor = conn.cursor()
-    sql = f'''
+    cursor.execute("SELECT * FROM issues LIMIT 0")
+    if 'labels' not in [column[0] for column in cursor.description]:
+        return
+
+    label_conflict_sql = 'ON CONFLICT(id) DO NOTHING'
+    update_sql = f"UPDATE issues SET {', '.join(f'{column} = {PH}' for column in ISSUE_REACTION_COLUMNS)}, write_seq = {PH} WHERE id = {PH}"
+    last_id = 0
+    count = 0
+    while True:
+        cursor.execute(f'''
+        SELECT id, repository_id, labels, reactions FROM issues
+        WHERE id > {PH} AND reactions_total_count IS NULL
+        ORDER BY id ASC
+        LIMIT {PH}
+        ''', (last_id, MIGRATE_ISSUES_BATCH))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        issues = [{'id': row[0], 'repository_id': row[1], 'labels': _json_value(row[2]) or [], 'reactions': _json_value(row[3]) or {}} for row in rows]
+        labels = {label['id']: _label_values(label, issue['repository_id']) for issue in issues for label in issue['labels'] if label.get('id') is not None}
+        _upsert_many(conn, 'labels', LABEL_INSERT_SQL, label_conflict_sql, list(labels.values()))
+        _replace_issue_labels(conn, issues)
+        # Rewritten issues get a new write sequence, so the next incremental export picks up their labels and reactions
+        write_seq = _next_write_seq(cursor)
+        cursor.executemany(update_sql, [tuple(issue['reactions'].get(key) for key in ISSUE_REACTIONS.values()) + (write_seq, issue['id']) for issue in issues])
+        last_id = rows[-1][0]
+        count += len(rows)
+
+    cursor.execute("ALTER TABLE issues DROP COLUMN labels")
+    cursor.execute("ALTER TABLE issues DROP COLUMN reactions")
+    print(f"Moved the labels and reactions of {count} issues out of their JSON columns.")
+
+def _unique_by_id(rows):
+    """
+    Drops all but the last occurrence of each id, Postgres rejects an upsert touching a row twice.
+    """
+    return list({row.get('id'): row for row in rows}.values())
+
+def _copy_text(value):
+    """
+    Formats a value for COPY in the text format.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def _copy_merge(cursor, table, insert_sql, conflict_sql, rows):
+    """
+    Streams rows into a staging table with COPY and merges them into the table with one
+    INSERT ... SELECT ... ON CONFLICT. The staging table is a temporary table of the session,
+    which Postgres never writes to the WAL and which workers on other connections never contend for.
+    """
+    staging = f"{table}_staging"
+    columns = insert_sql[insert_sql.index('(') + 1:insert_sql.index(')')]
+    cursor.execute(f"CREATE TEMPORARY TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+    # Rows of an earlier merge of the same transaction
+    cursor.execute(f"TRUNCATE {staging}")
+    data = io.StringIO(''.join('\t'.join(_copy_text(value) for value in row) + '\n' for row in rows))
+    cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN", data)
+    cursor.execute(f"{insert_sql} SELECT {columns} FROM {staging} {conflict_sql}")
+
+# Tables whose rows carry the write sequence of their last insert or change
+WRITE_SEQ_TABLES = ('organizations', 'users', 'repositories', 'issues', 'comments', 'labels')
+
+def _next_write_seq(cursor):
+    """
+    Returns the write sequence of the rows written next. Postgres rows get the id of their
+    transaction, SQLite rows the next value of a counter, taken under SQLite's write lock.
+    """
+    if DBMS == 'POSTGRES':
+        cursor.execute("SELECT txid_current()")
+    else:
+        cursor.execute("UPDATE write_sequence SET value = value + 1 WHERE id = 1")
+        cursor.execute("SELECT value FROM write_sequence WHERE id = 1")
+    return cursor.fetchone()[0]
+
+def get_write_horizon(conn):
+    """
+    Returns the write sequence below which all writes are committed. On Postgres that is the
+    oldest transaction still running, a transaction with a lower id than a committed one may
+    commit later, on SQLite the counter's next value.
+    """
+    cursor = conn.cursor()
+    if DBMS == 'POSTGRES':
+        cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+    else:
+        cursor.execute("SELECT value + 1 FROM write_sequence WHERE id = 1")
+    return cursor.fetchone()[0]
+
+def _content_hash(values):
+    return hashlib.blake2b(repr(values).encode('utf-8'), digest_size=16).hexdigest()
+
+def _upsert_many(conn, table, insert_sql, conflict_sql, rows, write_seq=None):
+    """
+    Upserts many rows of a table at once. On Postgres batches of PG_COPY_MIN_ROWS rows or more are
+    loaded with COPY and merged, smaller ones with a multi-row VALUES statement; SQLite uses executemany.
+    The content hash and the write sequence of each row are appended to its values, stored rows
+    with the same hash are left untouched by the conflict update and keep their write sequence.
+    Returns the number of rows inserted or changed.
+    - write_seq: The write sequence to stamp, by default the next one.
+    The caller commits.
+    """
+    if not rows:
+        return 0
+    cursor = conn.cursor()
+    if write_seq is None:
+        write_seq = _next_write_seq(cursor)
+    rows = [values + (_content_hash(values), write_seq) for values in rows]
+    with DB_UPSERT_SECONDS.time(table=table):
+        if DBMS == 'POSTGRES' and PG_COPY_MIN_ROWS and len(rows) >= PG_COPY_MIN_ROWS:
+            _copy_merge(cursor, table, insert_sql, conflict_sql, rows)
+        elif DBMS == 'POSTGRES':
+            execute_values(cursor, f"{insert_sql} VALUES %s {conflict_sql}", rows, page_size=len(rows))
+        else:
+            placeholders = ', '.join([PH] * len(rows[0]))
+            cursor.executemany(f"{insert_sql} VALUES ({placeholders}) {conflict_sql}", rows)
+    written = cursor.rowcount
+    ROWS_WRITTEN.inc(written, table=table)
+    ROWS_UNCHANGED.inc(len(rows) - written, table=table)
+    return written
+
+ORGANIZATION_INSERT_SQL = '''
     INSERT INTO organizations 
-    (id, login, node_id, description) 
-    VALUES ({PH}, {PH}, {PH}, {PH})
+    (id, login, node_id, description, content_hash, write_seq) 
+    '''
+ORGANIZATION_CONFLICT_SQL = f'''
     ON CONFLICT(id) DO UPDATE SET 
         login = EXCLUDED.login, 
         node_id = EXCLUDED.node_id,
-        description = EXCLUDED.description
+        description = EXCLUDED.description,
+        content_hash = EXCLUDED.content_hash,
+        write_seq = EXCLUDED.write_seq
+    WHERE organizations.content_hash {IS_DISTINCT_FROM} EXCLUDED.content_hash
     '''
-    cursor.execute(sql, (
+
+def _organization_values(org_data):
+    return (
         org_data.get('id'), 
         org_data.get('login'), 
         org_data.get('node_id'), 
         org_data.get('description')
-    ))
+    )
+
+def insert_organization_data(conn, org_data):
+    insert_organizations_batch(conn, [org_data])
+
+def insert_organizations_batch(conn, orgs):
+    """
+    Inserts or updates a whole page of organizations with one statement and one commit.
+    """
+    _upsert_many(conn, 'organizations', ORGANIZATION_INSERT_SQL, ORGANIZATION_CONFLICT_SQL, [_organization_values(row) for row in _unique_by_id(orgs)])
     conn.commit()
 
-def insert_user_data(conn, user_data):
-    cursor = conn.cursor()
-    sql = f'''
+USER_INSERT_SQL = '''
     INSERT INTO users (
         id, login, node_id, type, avatar_url, gravatar_id, url, html_url,
         site_admin, name, company, blog, location, email, hireable, bio, 
         twitter_username, public_repos, public_gists, followers, following, 
-        created_at, updated_at, error
+        created_at, updated_at, error, content_hash, write_seq
     ) 
-    VALUES ({PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH})
+    '''
+USER_CONFLICT_SQL = f'''
     ON CONFLICT(id) DO UPDATE SET 
         login = EXCLUDED.login, 
         node_id = EXCLUDED.node_id, 
@@ -254,9 +670,14 @@ def insert_user_data(conn, user_data):
         following = EXCLUDED.following, 
         created_at = EXCLUDED.created_at, 
         updated_at = EXCLUDED.updated_at,
-        error = EXCLUDED.error
+        error = EXCLUDED.error,
+        content_hash = EXCLUDED.content_hash,
+        write_seq = EXCLUDED.write_seq
+    WHERE users.content_hash {IS_DISTINCT_FROM} EXCLUDED.content_hash
     '''
-    cursor.execute(sql, (
+
+def _user_values(user_data):
+    return (
         user_data.get('id'), user_data.get('login'), user_data.get('node_id'), user_data.get('type'), 
         user_data.get('avatar_url'), user_data.get('gravatar_id'), user_data.get('url'), user_data.get('html_url'), 
         user_data.get('site_admin'), user_data.get('name'), user_data.get('company'), user_data.get('blog'),
@@ -264,20 +685,28 @@ def insert_user_data(conn, user_data):
         user_data.get('twitter_username'), user_data.get('public_repos'), user_data.get('public_gists'),
         user_data.get('followers'), user_data.get('following'), user_data.get('created_at'), 
         user_data.get('updated_at'), user_data.get('error', False)
-    ))
+    )
+
+def insert_user_data(conn, user_data):
+    insert_users_batch(conn, [user_data])
+
+def insert_users_batch(conn, users):
+    """
+    Inserts or updates a whole page of users with one statement and one commit.
+    """
+    _upsert_many(conn, 'users', USER_INSERT_SQL, USER_CONFLICT_SQL, [_user_values(row) for row in _unique_by_id(users)])
     conn.commit()
 
 
-def insert_repository_data(conn, repo_data):
-    cursor = conn.cursor()
-    sql = f'''
+REPOSITORY_INSERT_SQL = '''
     INSERT INTO repositories (
         id, node_id, name, full_name, private, owner, owner_type, owner_id, html_url, description, fork, url, created_at, updated_at, pushed_at, homepage, 
         size, stargazers_count, watchers_count, language, has_issues, has_projects, has_downloads, has_wiki, has_pages, has_discussions, forks_count, 
         mirror_url, archived, disabled, open_issues_count, license, allow_forking, is_template, web_commit_signoff_required, 
-        topics, visibility, forks, open_issues, watchers, default_branch, permissions
+        topics, visibility, forks, open_issues, watchers, default_branch, permissions, content_hash, write_seq
     ) 
-    VALUES ({PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH})
+    '''
+REPOSITORY_CONFLICT_SQL = f'''
     ON CONFLICT(id) DO UPDATE SET
         node_id = EXCLUDED.node_id,
         name = EXCLUDED.name,
@@ -319,9 +748,14 @@ def insert_repository_data(conn, repo_data):
         open_issues = EXCLUDED.open_issues,
         watchers = EXCLUDED.watchers,
         default_branch = EXCLUDED.default_branch,
-        permissions = EXCLUDED.permissions
+        permissions = EXCLUDED.permissions,
+        content_hash = EXCLUDED.content_hash,
+        write_seq = EXCLUDED.write_seq
+    WHERE repositories.content_hash {IS_DISTINCT_FROM} EXCLUDED.content_hash
     '''
-    cursor.execute(sql, (
+
+def _repository_values(repo_data):
+    return (
         repo_data.get('id'), repo_data.get('node_id'), repo_data.get('name'), repo_data.get('full_name'), repo_data.get('private'), 
         repo_data.get('owner'), repo_data.get('owner_type'), repo_data.get('owner_id'), repo_data.get('html_url'), repo_data.get('description'), 
         repo_data.get('fork'), repo_data.get('url'), repo_data.get('created_at'), repo_data.get('updated_at'), repo_data.get('pushed_at'), 
@@ -332,15 +766,33 @@ def insert_repository_data(conn, repo_data):
         json.dumps(repo_data.get('license', {})), repo_data.get('allow_forking'), repo_data.get('is_template'), repo_data.get('web_commit_signoff_required'), 
         json.dumps(repo_data.get('topics', [])), repo_data.get('visibility'), repo_data.get('forks'), repo_data.get('open_issues'), 
         repo_data.get('watchers'), repo_data.get('default_branch'), json.dumps(repo_data.get('permissions', {}))
-    ))
-    conn.commit()
+    )
 
-def insert_issue_data(conn, issue_data):
-    cursor = conn.cursor()
-    sql = f'''
+def insert_repository_data(conn, repo_data):
+    insert_repos_batch(conn, [repo_data])
+
+def insert_repos_batch(conn, repos, commit=True):
+    """
+    Inserts or updates a whole page of repositories with one statement and one commit.
+    - commit: Set to False to leave the page in the caller's transaction.
+    """
+    _upsert_many(conn, 'repositories', REPOSITORY_INSERT_SQL, REPOSITORY_CONFLICT_SQL, [_repository_values(row) for row in _unique_by_id(repos)])
+    if commit:
+        conn.commit()
+
+# Reaction counts of an issue by the columns they are stored in
+ISSUE_REACTIONS = {
+    'reactions_total_count': 'total_count', 'reactions_plus_one': '+1', 'reactions_minus_one': '-1',
+    'reactions_laugh': 'laugh', 'reactions_hooray': 'hooray', 'reactions_confused': 'confused',
+    'reactions_heart': 'heart', 'reactions_rocket': 'rocket', 'reactions_eyes': 'eyes',
+}
+ISSUE_REACTION_COLUMNS = list(ISSUE_REACTIONS)
+
+ISSUE_INSERT_SQL = f'''
     INSERT INTO issues 
-    (id, url, repository_id, repository_url, node_id, number, title, owner, owner_type, owner_id, labels, state, locked, comments, created_at, updated_at, closed_at, author_association, active_lock_reason, body, reactions, state_reason) 
-    VALUES ({PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH}, {PH})
+    (id, url, repository_id, repository_url, node_id, number, title, owner, owner_type, owner_id, state, locked, comments, created_at, updated_at, closed_at, author_association, active_lock_reason, body, state_reason, {', '.join(ISSUE_REACTION_COLUMNS)}, content_hash, write_seq) 
+    '''
+ISSUE_CONFLICT_SQL = f'''
     ON CONFLICT(id) DO UPDATE SET 
         url = EXCLUDED.url,
         repository_id = EXCLUDED.repository_id,
@@ -351,7 +803,6 @@ def insert_issue_data(conn, issue_data):
         owner = EXCLUDED.owner,
         owner_type = EXCLUDED.owner_type,
         owner_id = EXCLUDED.owner_id,
-        labels = EXCLUDED.labels,
         state = EXCLUDED.state,
         locked = EXCLUDED.locked,        
         comments = EXCLUDED.comments,
@@ -361,48 +812,300 @@ def insert_issue_data(conn, issue_data):
         author_association = EXCLUDED.author_association,
         active_lock_reason = EXCLUDED.active_lock_reason,
         body = EXCLUDED.body,
-        reactions = EXCLUDED.reactions,
-        state_reason = EXCLUDED.state_reason
+        state_reason = EXCLUDED.state_reason,
+        {', '.join(f"{column} = EXCLUDED.{column}" for column in ISSUE_REACTION_COLUMNS)},
+        content_hash = EXCLUDED.content_hash,
+        write_seq = EXCLUDED.write_seq
+    WHERE issues.content_hash {IS_DISTINCT_FROM} EXCLUDED.content_hash
     '''
-    cursor.execute(sql, (
+
+def _issue_values(issue_data):
+    reactions = issue_data.get('reactions') or {}
+    return (
         issue_data.get('id'), issue_data.get('url'), issue_data.get('repository_id'), issue_data.get('repository_url'), 
         issue_data.get('node_id'), issue_data.get('number'), remove_nul_characters(issue_data.get('title')), issue_data.get('user', {}).get('login'), 
         issue_data.get('user', {}).get('type'), issue_data.get('user', {}).get('id'),
-        json.dumps(issue_data.get('labels', [])), issue_data.get('state'), issue_data.get('locked'), 
+        issue_data.get('state'), issue_data.get('locked'), 
         issue_data.get('comments'), issue_data.get('created_at'), 
         issue_data.get('updated_at'), issue_data.get('closed_at'), issue_data.get('author_association'), 
-        issue_data.get('active_lock_reason'), remove_nul_characters(issue_data.get('body')), json.dumps(issue_data.get('reactions', {})), issue_data.get('state_reason')
-    ))
-    conn.commit()
+        issue_data.get('active_lock_reason'), remove_nul_characters(issue_data.get('body')), issue_data.get('state_reason')
+    ) + tuple(reactions.get(key) for key in ISSUE_REACTIONS.values())
+
+LABEL_INSERT_SQL = '''
+    INSERT INTO labels 
+    (id, repository_id, node_id, url, name, color, "default", description, content_hash, write_seq) 
+    '''
+LABEL_CONFLICT_SQL = f'''
+    ON CONFLICT(id) DO UPDATE SET 
+        repository_id = EXCLUDED.repository_id,
+        node_id = EXCLUDED.node_id,
+        url = EXCLUDED.url,
+        name = EXCLUDED.name,
+        color = EXCLUDED.color,
+        "default" = EXCLUDED."default",
+        description = EXCLUDED.description,
+        content_hash = EXCLUDED.content_hash,
+        write_seq = EXCLUDED.write_seq
+    WHERE labels.content_hash {IS_DISTINCT_FROM} EXCLUDED.content_hash
+    '''
+
+def _label_values(label_data, repository_id):
+    return (
+        label_data.get('id'), repository_id, label_data.get('node_id'), label_data.get('url'),
+        remove_nul_characters(label_data.get('name')), label_data.get('color'), label_data.get('default'),
+        remove_nul_characters(label_data.get('description'))
+    )
+
+# Issue ids per statement when reading the stored label links, below SQLite's limit of bound parameters
+ISSUE_LABELS_CHUNK = 500
+
+def _replace_issue_labels(conn, issues, write_seq=None):
+    """
+    Makes the stored label links of the issues match their labels. The stored links are read
+    through the primary key and only the difference is written, so unchanged issues cost no writes.
+    Issues whose links changed get the write sequence, by default the next one, so incremental exports
+    pick up their labels. Issues the same write already stamped with it are not updated again.
+    An issue with a label whose id is unknown keeps its stored links, they are more complete than its labels.
+    The caller commits.
+    """
+    issues = [issue for issue in issues if all(label.get('id') is not None for label in issue.get('labels') or [])]
+    wanted = {(issue['id'], label['id']) for issue in issues for label in issue.get('labels') or []}
+    issue_ids = [issue['id'] for issue in issues]
+    cursor = conn.cursor()
+    stored = set()
+    for start in range(0, len(issue_ids), ISSUE_LABELS_CHUNK):
+        chunk = issue_ids[start:start + ISSUE_LABELS_CHUNK]
+        placeholders = ', '.join([PH] * len(chunk))
+        cursor.execute(f"SELECT issue_id, label_id FROM issue_labels WHERE issue_id IN ({placeholders})", chunk)
+        stored.update((row[0], row[1]) for row in cursor.fetchall())
+    removed = sorted(stored - wanted)
+    added = sorted(wanted - stored)
+    with DB_UPSERT_SECONDS.time(table='issue_labels'):
+        if removed:
+            cursor.executemany(f"DELETE FROM issue_labels WHERE issue_id = {PH} AND label_id = {PH}", removed)
+        if added and DBMS == 'POSTGRES':
+            execute_values(cursor, "INSERT INTO issue_labels (issue_id, label_id) VALUES %s ON CONFLICT DO NOTHING", added, page_size=len(added))
+        elif added:
+            cursor.executemany(f"INSERT INTO issue_labels (issue_id, label_id) VALUES ({PH}, {PH}) ON CONFLICT DO NOTHING", added)
+        changed = sorted({issue_id for issue_id, _ in removed + added})
+        if changed and write_seq is None:
+            write_seq = _next_write_seq(cursor)
+        for start in range(0, len(changed), ISSUE_LABELS_CHUNK):
+            chunk = changed[start:start + ISSUE_LABELS_CHUNK]
+            placeholders = ', '.join([PH] * len(chunk))
+            cursor.execute(f"UPDATE issues SET write_seq = {PH} WHERE id IN ({placeholders}) AND write_seq {IS_DISTINCT_FROM} {PH}", (write_seq, *chunk, write_seq))
+    ROWS_WRITTEN.inc(len(removed) + len(added), table='issue_labels')
+    ROWS_UNCHANGED.inc(len(stored & wanted), table='issue_labels')
+
+def insert_issue_data(conn, issue_data):
+    insert_issues_batch(conn, [issue_data])
+
+def insert_issues_batch(conn, issues, commit=True):
+    """
+    Inserts or updates a whole page of issues, their labels and the links between them in one transaction.
+    - commit: Set to False to leave the page in the caller's transaction.
+    """
+    issues = _unique_by_id(issues)
+    if issues:
+        # One write sequence for the page, so issues whose row was just written are not stamped again for their links
+        write_seq = _next_write_seq(conn.cursor())
+        _upsert_many(conn, 'issues', ISSUE_INSERT_SQL, ISSUE_CONFLICT_SQL, [_issue_values(row) for row in issues], write_seq)
+        labels = {label['id']: _label_values(label, issue.get('repository_id')) for issue in issues for label in issue.get('labels') or [] if label.get('id') is not None}
+        _upsert_many(conn, 'labels', LABEL_INSERT_SQL, LABEL_CONFLICT_SQL, list(labels.values()), write_seq)
+        _replace_issue_labels(conn, issues, write_seq)
+    if commit:
+        conn.commit()
     
-def get_max_ids(conn):
+def get_http_cache(conn, cache_key):
     """
-    Fetches the maximum values for columns starting with 'last_' in a specified table.
+    Fetches the stored ETag, Last-Modified and Link headers and the row count of a page, or None if the page was never stored.
     """
     cursor = conn.cursor()
-    # SQL to fetch maximum values of specific columns
-    sql = '''
-    SELECT MAX(last_org_id) as max_last_org_id, 
-           MAX(last_user_id) as max_last_user_id, 
-           MAX(last_org_repository_id) as max_last_org_repository_id, 
-           MAX(last_user_repository_id) as max_last_user_repository_id 
-    FROM logs
+    cursor.execute(f"SELECT etag, last_modified, link, row_count FROM http_cache WHERE cache_key = {PH}", (cache_key,))
+    result = cursor.fetchone()
+    if result:
+        return {'etag': result[0], 'last_modified': result[1], 'link': result[2], 'row_count': result[3]}
+    return None
+
+def upsert_http_cache(conn, cache_key, etag, last_modified, link, row_count=None):
+    """
+    Stores the validators of a page and its number of rows. Call it only after the page's rows are stored.
+    """
+    cursor = conn.cursor()
+    sql = f'''
+    INSERT INTO http_cache 
+    (cache_key, etag, last_modified, link, row_count, updated_at) 
+    VALUES ({PH}, {PH}, {PH}, {PH}, {PH}, CURRENT_TIMESTAMP)
+    ON CONFLICT(cache_key) DO UPDATE SET 
+        etag = EXCLUDED.etag,
+        last_modified = EXCLUDED.last_modified,
+        link = EXCLUDED.link,
+        row_count = EXCLUDED.row_count,
+        updated_at = EXCLUDED.updated_at
     '''
-    cursor.execute(sql)
+    cursor.execute(sql, (cache_key, etag, last_modified, link, row_count))
+    conn.commit()
+
+COMMENT_INSERT_SQL = '''
+    INSERT INTO comments 
+    (id, node_id, url, issue_id, issue_url, "user", created_at, updated_at, author_association, body, reactions, content_hash, write_seq) 
+    '''
+COMMENT_CONFLICT_SQL = f'''
+    ON CONFLICT(id) DO UPDATE SET 
+        node_id = EXCLUDED.node_id,
+        url = EXCLUDED.url,
+        issue_id = EXCLUDED.issue_id,
+        issue_url = EXCLUDED.issue_url,
+        "user" = EXCLUDED."user",
+        created_at = EXCLUDED.created_at,
+        updated_at = EXCLUDED.updated_at,
+        author_association = EXCLUDED.author_association,
+        body = EXCLUDED.body,
+        reactions = EXCLUDED.reactions,
+        content_hash = EXCLUDED.content_hash,
+        write_seq = EXCLUDED.write_seq
+    WHERE comments.content_hash {IS_DISTINCT_FROM} EXCLUDED.content_hash
+    '''
+
+def _comment_values(comment_data):
+    return (
+        comment_data.get('id'), comment_data.get('node_id'), comment_data.get('url'), comment_data.get('issue_id'),
+        comment_data.get('issue_url'), (comment_data.get('user') or {}).get('login'), comment_data.get('created_at'),
+        comment_data.get('updated_at'), comment_data.get('author_association'), remove_nul_characters(comment_data.get('body')),
+        json.dumps(comment_data.get('reactions', {}))
+    )
+
+def insert_comments_batch(conn, comments):
+    """
+    Inserts or updates a whole page of comments with one statement and one commit.
+    """
+    _upsert_many(conn, 'comments', COMMENT_INSERT_SQL, COMMENT_CONFLICT_SQL, [_comment_values(row) for row in _unique_by_id(comments)])
+    conn.commit()
+
+def get_issue_ids_by_number(conn, repository_id, numbers):
+    """
+    Maps issue numbers of a repository to the ids of the stored issues.
+    """
+    numbers = list(set(numbers))
+    if not numbers:
+        return {}
+    cursor = conn.cursor()
+    placeholders = ', '.join([PH] * len(numbers))
+    cursor.execute(f"SELECT number, id FROM issues WHERE repository_id = {PH} AND number IN ({placeholders})", (repository_id, *numbers))
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+def get_checkpoint(conn, stage):
+    """
+    Fetches the id of the last owner or repository a stage has completely processed.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT last_id FROM checkpoints WHERE stage = {PH}", (stage,))
     result = cursor.fetchone()
     if result:
-        return {
-            "max_last_org_id": result[0] or 0,
-            "max_last_user_id": result[1] or 0,
-            "max_last_org_repository_id": result[2] or 0,
-            "max_last_user_repository_id": result[3] or 0
-        }
-    return {
-        "max_last_org_id": 0, 
-        "max_last_user_id": 0, 
-        "max_last_org_repository_id": 0, 
-        "max_last_user_repository_id": 0
-    }
+        return result[0] or 0
+    return 0
+
+def _upsert_page_cursor(cursor, stage, entity_id, next_page, after_cursor=None):
+    sql = f'''
+    INSERT INTO page_cursors 
+    (stage, entity_id, next_page, after_cursor, updated_at) 
+    VALUES ({PH}, {PH}, {PH}, {PH}, CURRENT_TIMESTAMP)
+    ON CONFLICT(stage, entity_id) DO UPDATE SET 
+        next_page = EXCLUDED.next_page,
+        after_cursor = EXCLUDED.after_cursor,
+        updated_at = EXCLUDED.updated_at
+    '''
+    cursor.execute(sql, (stage, entity_id, next_page, after_cursor))
+
+def get_page_cursors(conn, stage, entity_ids):
+    """
+    Fetches the page cursors of owners or repositories of a stage.
+    Returns a dictionary of entity id to the next page to fetch, None for entities whose pages are all stored.
+    Entities without a cursor are missing from the dictionary.
+    """
+    if not entity_ids:
+        return {}
+    cursor = conn.cursor()
+    placeholders = ', '.join([PH] * len(entity_ids))
+    cursor.execute(f"SELECT entity_id, next_page FROM page_cursors WHERE stage = {PH} AND entity_id IN ({placeholders})", (stage, *entity_ids))
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+def get_after_cursor(conn, stage, entity_id):
+    """
+    Fetches the GraphQL cursor after the last stored page of an owner or repository, None when there is none.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT after_cursor FROM page_cursors WHERE stage = {PH} AND entity_id = {PH}", (stage, entity_id))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+def set_page_cursor(conn, stage, entity_id, next_page):
+    """
+    Stores the next page to fetch for an owner or repository, None once all its pages are stored.
+    """
+    cursor = conn.cursor()
+    _upsert_page_cursor(cursor, stage, entity_id, next_page)
+    conn.commit()
+
+def clear_page_cursors(conn, stage, entity_ids):
+    """
+    Drops the page cursors of owners or repositories that were completely processed.
+    """
+    if not entity_ids:
+        return
+    cursor = conn.cursor()
+    placeholders = ', '.join([PH] * len(entity_ids))
+    cursor.execute(f"DELETE FROM page_cursors WHERE stage = {PH} AND entity_id IN ({placeholders})", (stage, *entity_ids))
+    conn.commit()
+
+def store_page(conn, insert_batch, rows, stage, entity_id, next_page, after_cursor=None):
+    """
+    Stores a page of rows and the page cursor of its owner or repository in one transaction,
+    so a restart resumes right after the last stored page.
+    - insert_batch: insert_repos_batch or insert_issues_batch.
+    - after_cursor: The GraphQL cursor after the page, if it was fetched with GraphQL.
+    """
+    insert_batch(conn, rows, commit=False)
+    _upsert_page_cursor(conn.cursor(), stage, entity_id, next_page, after_cursor)
+    conn.commit()
+
+def set_checkpoint(conn, stage, last_id):
+    """
+    Stores the id of the last owner or repository a stage has completely processed
+    and drops the page cursors it makes obsolete.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM page_cursors WHERE stage = {PH} AND entity_id <= {PH}", (stage, last_id))
+    sql = f'''
+    INSERT INTO checkpoints 
+    (stage, last_id, updated_at) 
+    VALUES ({PH}, {PH}, CURRENT_TIMESTAMP)
+    ON CONFLICT(stage) DO UPDATE SET 
+        last_id = EXCLUDED.last_id,
+        updated_at = EXCLUDED.updated_at
+    '''
+    cursor.execute(sql, (stage, last_id))
+    conn.commit()
+
+def reset_stage_progress(conn, stage):
+    """
+    Resets the checkpoints of a stage to 0 and drops its crawl plan, so its next run crawls all of
+    its owners or repositories again. The checkpoints are kept rather than deleted, an empty
+    checkpoints table marks a database of an older version to _migrate_checkpoints.
+    The work units and page cursors are only dropped once every unit of the stage is done,
+    units still pending or leased belong to other workers sharing the queue.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'''
+    UPDATE checkpoints SET last_id = 0, updated_at = CURRENT_TIMESTAMP
+    WHERE stage IN ({PH}, {PH}, {PH})
+    ''', (stage, f"{stage}_follow", f"{stage}_plan"))
+    cursor.execute(f"DELETE FROM crawl_plan WHERE stage = {PH}", (stage,))
+    cursor.execute(f"SELECT 1 FROM work_units WHERE stage = {PH} AND status <> 'done' LIMIT 1", (stage,))
+    if cursor.fetchone() is None:
+        cursor.execute(f"DELETE FROM work_units WHERE stage = {PH}", (stage,))
+        cursor.execute(f"DELETE FROM page_cursors WHERE stage = {PH}", (stage,))
+    conn.commit()
 
 def get_max_id(conn, table_name):
     """
@@ -417,8 +1120,7 @@ def get_max_id(conn, table_name):
 
 def fetch_users_batch(conn, last_owner_id=0, batch_size=100):
     """
-    Fetches a batch of users from the database whose ID is greater than the last maximum owner_id
-    found in the repositories table and greater than any previously processed user ID.
+    Fetches a batch of users from the database whose ID is greater than the last processed user ID.
     
     Args:
         conn: Database connection object.
@@ -430,27 +1132,21 @@ def fetch_users_batch(conn, last_owner_id=0, batch_size=100):
     """
     cursor = conn.cursor()
 
-    # First, find the current maximum owner_id in the repositories table
-    cursor.execute("SELECT MAX(owner_id) FROM repositories")
-    max_owner_id = cursor.fetchone()[0] or 0
-    max_id_to_fetch = max(last_owner_id, max_owner_id)
-
-    # Fetch users whose ID is greater than max_id_to_fetch
+    # Fetch users whose ID is greater than last_owner_id
     sql = f"""
         SELECT id, login, type FROM users 
         WHERE id > {PH} 
         ORDER BY id ASC 
         LIMIT {PH}
         """
-    cursor.execute(sql, (max_id_to_fetch, batch_size))
+    cursor.execute(sql, (last_owner_id, batch_size))
 
     users = cursor.fetchall()
     return [{'id': user[0], 'login': user[1], 'type': user[2]} for user in users]
 
 def fetch_organizations_batch(conn, last_owner_id=0, batch_size=100):
     """
-    Fetches a batch of orgs from the database whose ID is greater than the last maximum owner_id
-    found in the repositories table and greater than any previously processed user ID.
+    Fetches a batch of orgs from the database whose ID is greater than the last processed org ID.
     
     Args:
         conn: Database connection object.
@@ -462,27 +1158,21 @@ def fetch_organizations_batch(conn, last_owner_id=0, batch_size=100):
     """
     cursor = conn.cursor()
 
-    # First, find the current maximum owner_id in the repositories table
-    cursor.execute("SELECT MAX(owner_id) FROM repositories")
-    max_owner_id = cursor.fetchone()[0] or 0
-    max_id_to_fetch = max(last_owner_id, max_owner_id)
-
-    # Fetch orgs whose ID is greater than max_id_to_fetch
+    # Fetch orgs whose ID is greater than last_owner_id
     sql = f"""
         SELECT id, login FROM organizations 
         WHERE id > {PH} 
         ORDER BY id ASC 
         LIMIT {PH}
         """
-    cursor.execute(sql, (max_id_to_fetch, batch_size))
+    cursor.execute(sql, (last_owner_id, batch_size))
 
     orgs = cursor.fetchall()
     return [{'id': org[0], 'login': org[1], 'type': 'Organization'} for org in orgs]
 
 def fetch_repos_batch(conn, last_repository_id=0, batch_size=100, owner_type='*'):
     """
-    Fetches a batch of repos from the database whose ID is greater than the last maximum repository_id
-    found in the issues table and greater than any previously processed repository ID.
+    Fetches a batch of repos from the database whose ID is greater than the last processed repository ID.
     
     Args:
         conn: Database connection object.
@@ -494,12 +1184,7 @@ def fetch_repos_batch(conn, last_repository_id=0, batch_size=100, owner_type='*'
     """
     cursor = conn.cursor()
 
-    # First, find the current maximum repository_id in the issues table
-    cursor.execute("SELECT MAX(repository_id) FROM issues")
-    max_repository_id = cursor.fetchone()[0] or 0
-    max_id_to_fetch = max(last_repository_id, max_repository_id)
-
-    # Fetch repositories whose ID is greater than max_id_to_fetch
+    # Fetch repositories whose ID is greater than last_repository_id
     sql = f"""
         SELECT id, full_name FROM repositories 
         WHERE id > {PH} 
@@ -507,7 +1192,403 @@ def fetch_repos_batch(conn, last_repository_id=0, batch_size=100, owner_type='*'
         ORDER BY id ASC 
         LIMIT {PH}
         """
-    cursor.execute(sql, (max_id_to_fetch, owner_type, batch_size))
+    cursor.execute(sql, (last_repository_id, owner_type, batch_size))
+
+    repos = cursor.fetchall()
+    return [{'id': repo[0], 'full_name': repo[1]} for repo in repos]
+
+def fetch_repos_of_owners_batch(conn, last_owner_id=0, up_to_owner_id=0, batch_size=100, owner_type='*'):
+    """
+    Fetches all repositories of the next batch_size owners whose ID is greater than last_owner_id
+    and at most up_to_owner_id, ordered by owner and repository, so an owner is never split across batches.
+    """
+    cursor = conn.cursor()
+    sql = f"""
+        SELECT id, full_name, owner_id FROM repositories
+        WHERE owner_type = {PH}
+        AND owner_id > {PH}
+        AND owner_id <= (
+            SELECT MAX(owner_id) FROM (
+                SELECT DISTINCT owner_id FROM repositories
+                WHERE owner_type = {PH} AND owner_id > {PH} AND owner_id <= {PH}
+                ORDER BY owner_id ASC
+                LIMIT {PH}
+            ) AS owners
+        )
+        ORDER BY owner_id ASC, id ASC
+        """
+    cursor.execute(sql, (owner_type, last_owner_id, owner_type, last_owner_id, up_to_owner_id, batch_size))
+    return [{'id': repo[0], 'full_name': repo[1], 'owner_id': repo[2]} for repo in cursor.fetchall()]
+
+def fetch_repos_refresh_batch(conn, last_repository_id=0, batch_size=100, owner_type='*'):
+    """
+    Fetches a batch of repos together with the issue watermark of their last refresh.
+    
+    Args:
+        conn: Database connection object.
+        last_repository_id: The maximum repository id processed in the last batch.
+        batch_size: Number of repositories to fetch per batch.
+    
+    Returns:
+        A list of dictionaries, each representing a repository. The repository timestamps of the
+        watermark are None for repositories that were never refreshed, their max_updated_at is
+        seeded from the newest stored issue, so a refresh after a full crawl only fetches updates.
+    """
+    cursor = conn.cursor()
+    sql = f"""
+        SELECT r.id, r.full_name, r.updated_at, r.pushed_at, w.max_updated_at, w.repo_updated_at, w.repo_pushed_at, w.repository_id,
+            CASE WHEN w.repository_id IS NULL THEN (SELECT MAX(i.updated_at) FROM issues i WHERE i.repository_id = r.id) END
+        FROM repositories r
+        LEFT JOIN issue_watermarks w ON w.repository_id = r.id
+        WHERE r.id > {PH} 
+        AND r.owner_type = {PH}
+        ORDER BY r.id ASC 
+        LIMIT {PH}
+        """
+    cursor.execute(sql, (last_repository_id, owner_type, batch_size))
 
     repos = cursor.fetchall()
-    return [{'id': repo[0], 'full_name': repo[1]} for repo in repos]
\ No newline at end of file
+    return [{
+        'id': repo[0], 'full_name': repo[1], 'updated_at': repo[2], 'pushed_at': repo[3],
+        'max_updated_at': repo[4] if repo[7] is not None else _iso_timestamp(repo[8]),
+        'repo_updated_at': repo[5], 'repo_pushed_at': repo[6], 'refreshed': repo[7] is not None
+    } for repo in repos]
+
+def _iso_timestamp(value):
+    """
+    Formats a stored timestamp the way GitHub does, e.g. 2015-01-01T00:00:00Z. Postgres returns
+    datetimes, SQLite the stored text.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def upsert_issue_watermark(conn, repository_id, max_updated_at, repo_updated_at, repo_pushed_at):
+    """
+    Stores the newest issue updated_at seen for a repository and the repository timestamps at that time.
+    """
+    cursor = conn.cursor()
+    sql = f'''
+    INSERT INTO issue_watermarks 
+    (repository_id, max_updated_at, repo_updated_at, repo_pushed_at, refreshed_at) 
+    VALUES ({PH}, {PH}, {PH}, {PH}, CURRENT_TIMESTAMP)
+    ON CONFLICT(repository_id) DO UPDATE SET 
+        max_updated_at = EXCLUDED.max_updated_at,
+        repo_updated_at = EXCLUDED.repo_updated_at,
+        repo_pushed_at = EXCLUDED.repo_pushed_at,
+        refreshed_at = EXCLUDED.refreshed_at
+    '''
+    cursor.execute(sql, (repository_id, max_updated_at, repo_updated_at, repo_pushed_at))
+    conn.commit()
+
+def get_comment_watermarks(conn, repository_ids):
+    """
+    Fetches the newest comment updated_at stored by the last complete comment crawl of each repository.
+    Returns a dictionary by repository id, repositories that were never completely crawled are left out.
+    """
+    if not repository_ids:
+        return {}
+    cursor = conn.cursor()
+    placeholders = ', '.join([PH] * len(repository_ids))
+    cursor.execute(f"SELECT repository_id, max_updated_at FROM comment_watermarks WHERE repository_id IN ({placeholders})", repository_ids)
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+def upsert_comment_watermark(conn, repository_id, max_updated_at):
+    """
+    Stores the newest comment updated_at seen for a repository.
+    """
+    cursor = conn.cursor()
+    sql = f'''
+    INSERT INTO comment_watermarks 
+    (repository_id, max_updated_at, refreshed_at) 
+    VALUES ({PH}, {PH}, CURRENT_TIMESTAMP)
+    ON CONFLICT(repository_id) DO UPDATE SET 
+        max_updated_at = EXCLUDED.max_updated_at,
+        refreshed_at = EXCLUDED.refreshed_at
+    '''
+    cursor.execute(sql, (repository_id, max_updated_at))
+    conn.commit()
+
+# Owner or repository ids a stage's work units are cut from
+WORK_UNIT_SOURCES = {
+    'org_repositories': ("SELECT id FROM organizations WHERE id > {ph}", ()),
+    'user_repositories': ("SELECT id FROM users WHERE id > {ph}", ()),
+    'org_issues': ("SELECT id FROM repositories WHERE id > {ph} AND owner_type = {ph}", ('Organization',)),
+    'user_issues': ("SELECT id FROM repositories WHERE id > {ph} AND owner_type = {ph}", ('User',)),
+}
+
+def enqueue_work_units(conn, stage, unit_size=100):
+    """
+    Cuts the ids a stage has not queued yet into work units of unit_size ids each.
+    Units are appended after the last queued one, so this is cheap to call on every start and
+    workers calling it at the same time only insert the same units once.
+    Returns the number of new work units.
+    """
+    source_sql, source_args = WORK_UNIT_SOURCES[stage]
+    source_sql = source_sql.format(ph=PH)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MAX(range_end) FROM work_units WHERE stage = {PH}", (stage,))
+    range_start = cursor.fetchone()[0] or 0
+    count = 0
+    while True:
+        # The id unit_size positions further along, or the last id when fewer are left
+        cursor.execute(f"{source_sql} ORDER BY id ASC LIMIT 1 OFFSET {PH}", (range_start, *source_args, unit_size - 1))
+        result = cursor.fetchone()
+        if result is None:
+            cursor.execute(source_sql.replace('SELECT id', 'SELECT MAX(id)', 1), (range_start, *source_args))
+            result = cursor.fetchone()
+            if result[0] is None:
+                break
+        range_end = result[0]
+        cursor.execute(f'''
+        INSERT INTO work_units (stage, range_start, range_end) 
+        VALUES ({PH}, {PH}, {PH})
+        ON CONFLICT(stage, range_start) DO NOTHING
+        ''', (stage, range_start, range_end))
+        count += cursor.rowcount
+        range_start = range_end
+    conn.commit()
+    return count
+
+def claim_work_unit(conn, stage, worker_id, lease_seconds):
+    """
+    Leases the first pending work unit of a stage, or one whose lease expired because its worker died.
+    On Postgres the candidate row is locked with FOR UPDATE SKIP LOCKED, so concurrent workers
+    never wait on each other and never claim the same unit. SQLite serializes writers, so there
+    the claim is a compare-and-set update of the candidate.
+    Returns the (range_start, range_end, last_id) of the unit, or None when no unit is left.
+    last_id is the id the unit was last processed up to, range_start for a fresh unit.
+    """
+    cursor = conn.cursor()
+    claimable = f"stage = {PH} AND (status = 'pending' OR (status = 'leased' AND lease_expires_at < {NOW_EPOCH}))"
+    lease = f"status = 'leased', lease_owner = {PH}, lease_expires_at = {NOW_EPOCH} + {PH}, attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP"
+    if DBMS == 'POSTGRES':
+        cursor.execute(f'''
+        UPDATE work_units SET {lease}
+        WHERE stage = {PH} AND range_start = (
+            SELECT range_start FROM work_units
+            WHERE {claimable}
+            ORDER BY range_start ASC
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING range_start, range_end, COALESCE(last_id, range_start)
+        ''', (worker_id, lease_seconds, stage, stage))
+        unit = cursor.fetchone()
+        conn.commit()
+        return tuple(unit) if unit else None
+
+    while True:
+        cursor.execute(f"SELECT range_start, range_end, COALESCE(last_id, range_start) FROM work_units WHERE {claimable} ORDER BY range_start ASC LIMIT 1", (stage,))
+        unit = cursor.fetchone()
+        if unit is None:
+            conn.commit()
+            return None
+        cursor.execute(f"UPDATE work_units SET {lease} WHERE range_start = {PH} AND {claimable}", (worker_id, lease_seconds, unit[0], stage))
+        conn.commit()
+        if cursor.rowcount == 1:
+            return tuple(unit)
+        # Another worker claimed it first, try the next one
+
+def enqueue_id_partitions(conn, stage, start, end, partition_size):
+    """
+    Splits the id space [start, end) into work units of partition_size ids each.
+    Units that already exist keep their progress, so this is safe to call on every start.
+    Returns the number of new work units.
+    """
+    cursor = conn.cursor()
+    count = 0
+    for partition_start in range(start, end, partition_size):
+        partition_end = min(partition_start + partition_size, end)
+        # Work units cover (range_start, range_end], like the since parameter of the API
+        cursor.execute(f'''
+        INSERT INTO work_units (stage, range_start, range_end) 
+        VALUES ({PH}, {PH}, {PH})
+        ON CONFLICT(stage, range_start) DO NOTHING
+        ''', (stage, partition_start - 1, partition_end - 1))
+        count += cursor.rowcount
+    conn.commit()
+    return count
+
+def set_work_unit_progress(conn, stage, range_start, last_id):
+    """
+    Stores the id a work unit was processed up to. Call it only after the rows up to that id are stored.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'''
+    UPDATE work_units SET last_id = {PH}, updated_at = CURRENT_TIMESTAMP
+    WHERE stage = {PH} AND range_start = {PH}
+    ''', (last_id, stage, range_start))
+    conn.commit()
+
+def renew_work_unit(conn, stage, range_start, worker_id, lease_seconds):
+    """
+    Extends the lease of a work unit held by the worker.
+    Returns False when the lease was lost to another worker after it expired.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'''
+    UPDATE work_units SET lease_expires_at = {NOW_EPOCH} + {PH}, updated_at = CURRENT_TIMESTAMP
+    WHERE stage = {PH} AND range_start = {PH} AND status = 'leased' AND lease_owner = {PH}
+    ''', (lease_seconds, stage, range_start, worker_id))
+    renewed = cursor.rowcount == 1
+    conn.commit()
+    return renewed
+
+def complete_work_unit(conn, stage, range_start):
+    """
+    Marks a work unit as done and drops the page cursors of its owners or repositories.
+    Call it only after the unit's rows are stored.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'''
+    DELETE FROM page_cursors WHERE stage = {PH} AND entity_id > {PH}
+    AND entity_id <= (SELECT range_end FROM work_units WHERE stage = {PH} AND range_start = {PH})
+    ''', (stage, range_start, stage, range_start))
+    cursor.execute(f'''
+    UPDATE work_units SET status = 'done', lease_owner = NULL, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+    WHERE stage = {PH} AND range_start = {PH}
+    ''', (stage, range_start))
+    conn.commit()
+
+# Per stage: the table the planned entities come from, the columns read for the crawler, the condition
+# dropping entities whose requests are guaranteed to return nothing, and the columns allowed as priority
+PLAN_SOURCES = {
+    'org_repositories': {
+        'table': 'organizations', 'columns': ['id', 'login'], 'where': 'TRUE', 'keep': 'TRUE',
+        'priorities': ['id'],
+    },
+    'user_repositories': {
+        'table': 'users', 'columns': ['id', 'login', 'type'], 'where': 'TRUE',
+        # Leaves out users whose details were fetched and who have no public repository, users without details are kept
+        'keep': 'COALESCE(public_repos, 1) <> 0 OR error IS TRUE',
+        'priorities': ['id', 'followers', 'public_repos'],
+    },
+    'org_issues': {
+        'table': 'repositories', 'columns': ['id', 'full_name'], 'where': "owner_type = 'Organization'",
+        # Repositories with issues disabled answer 410 Gone
+        'keep': 'has_issues IS NOT FALSE',
+        'priorities': ['id', 'stargazers_count', 'open_issues_count', 'forks_count', 'watchers_count', 'pushed_at', 'updated_at'],
+    },
+    'user_issues': {
+        'table': 'repositories', 'columns': ['id', 'full_name'], 'where': "owner_type = 'User'",
+        'keep': 'has_issues IS NOT FALSE',
+        'priorities': ['id', 'stargazers_count', 'open_issues_count', 'forks_count', 'watchers_count', 'pushed_at', 'updated_at'],
+    },
+}
+
+def build_crawl_plan(conn, stage, priority, checkpoint_stage):
+    """
+    Replaces the crawl plan of a stage: the owners or repositories whose requests may return data,
+    ordered by the priority column, highest first.
+    The page cursors of the stage are dropped and the checkpoint of the plan is reset, so the
+    new plan is crawled from its start.
+    Returns the number of planned and of skipped entities.
+    """
+    source = PLAN_SOURCES[stage]
+    if priority not in source['priorities']:
+        raise ValueError(f"Unsupported priority {priority} for {stage}, use one of {', '.join(source['priorities'])}")
+    order = 'id ASC' if priority == 'id' else f"{priority} DESC NULLS LAST, id ASC"
+
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM crawl_plan WHERE stage = {PH}", (stage,))
+    cursor.execute(f"DELETE FROM page_cursors WHERE stage = {PH}", (stage,))
+    cursor.execute(f'''
+    INSERT INTO crawl_plan (stage, position, entity_id)
+    SELECT {PH}, ROW_NUMBER() OVER (ORDER BY {order}), id
+    FROM {source['table']}
+    WHERE {source['where']} AND {source['keep']}
+    ''', (stage,))
+    planned = cursor.rowcount
+    cursor.execute(f"SELECT COUNT(*) FROM {source['table']} WHERE {source['where']}")
+    skipped = cursor.fetchone()[0] - planned
+    cursor.execute(f'''
+    INSERT INTO checkpoints (stage, last_id, updated_at) 
+    VALUES ({PH}, 0, CURRENT_TIMESTAMP)
+    ON CONFLICT(stage) DO UPDATE SET 
+        last_id = EXCLUDED.last_id,
+        updated_at = EXCLUDED.updated_at
+    ''', (checkpoint_stage,))
+    conn.commit()
+    return planned, skipped
+
+def has_crawl_plan(conn, stage):
+    """
+    Tells whether a crawl plan was built for the stage.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT 1 FROM crawl_plan WHERE stage = {PH} LIMIT 1", (stage,))
+    return cursor.fetchone() is not None
+
+def fetch_plan_batch(conn, stage, last_position=0, batch_size=100):
+    """
+    Fetches the next batch of a stage's crawl plan after the last processed position.
+    
+    Returns:
+        A list of dictionaries in plan order, each with the entity's columns and its 'position'.
+    """
+    source = PLAN_SOURCES[stage]
+    columns = ', '.join(f"e.{column}" for column in source['columns'])
+    cursor = conn.cursor()
+    sql = f"""
+        SELECT p.position, {columns} FROM crawl_plan p
+        JOIN {source['table']} e ON e.id = p.entity_id
+        WHERE p.stage = {PH} 
+        AND p.position > {PH}
+        ORDER BY p.position ASC 
+        LIMIT {PH}
+        """
+    cursor.execute(sql, (stage, last_position, batch_size))
+
+    batch = []
+    for row in cursor.fetchall():
+        entity = dict(zip(['position'] + source['columns'], row))
+        if source['table'] == 'organizations':
+            entity['type'] = 'Organization'
+        batch.append(entity)
+    return batch
+
+def get_column_types(conn, table_name):
+    """
+    Fetches the declared type of each column of a table, in column order.
+    Returns a list of (column name, lower case type) pairs.
+    """
+    cursor = conn.cursor()
+    if DBMS == 'SQLITE':
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        return [(row[1], row[2].lower()) for row in cursor.fetchall()]
+    cursor.execute(f'''
+    SELECT column_name, data_type FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = {PH}
+    ORDER BY ordinal_position
+    ''', (table_name,))
+    return [(row[0], row[1].lower()) for row in cursor.fetchall()]
+
+def fetch_issue_label_ids(conn, issue_ids):
+    """
+    Fetches the ids of the labels linked to each of the issues, read through the primary key of issue_labels.
+    Returns a dictionary of the sorted label ids by issue id, issues without labels are left out.
+    """
+    cursor = conn.cursor()
+    label_ids = {}
+    for start in range(0, len(issue_ids), ISSUE_LABELS_CHUNK):
+        chunk = issue_ids[start:start + ISSUE_LABELS_CHUNK]
+        placeholders = ', '.join([PH] * len(chunk))
+        cursor.execute(f"SELECT issue_id, label_id FROM issue_labels WHERE issue_id IN ({placeholders}) ORDER BY issue_id, label_id", chunk)
+        for issue_id, label_id in cursor.fetchall():
+            label_ids.setdefault(issue_id, []).append(label_id)
+    return label_ids
+
+def fetch_rows_written(conn, table_name, from_seq, to_seq, after=None, batch_size=10000):
+    """
+    Fetches the next rows of a table whose write sequence is in [from_seq, to_seq), ordered by write
+    sequence and id, after the (write_seq, id) key of the last fetched row, for keyset paginated exports.
+    Returns the column names and the rows as tuples.
+    """
+    cursor = conn.cursor()
+    if after is None:
+        cursor.execute(f"SELECT * FROM {table_name} WHERE write_seq >= {PH} AND write_seq < {PH} ORDER BY write_seq, id LIMIT {PH}", (from_seq, to_seq, batch_size))
+    else:
+        cursor.execute(f"SELECT * FROM {table_name} WHERE (write_seq, id) > ({PH}, {PH}) AND write_seq < {PH} ORDER BY write_seq, id LIMIT {PH}", (*after, to_seq, batch_size))
+    rows = cursor.fetchall()
+    return [column[0] for column in cursor.description], rows
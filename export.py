@@ -0,0 +1,171 @@
+import glob
+import json
+import os
+from datetime import datetime
+from database import open_connection, close_connection, create_tables, get_checkpoint, set_checkpoint, get_column_types, fetch_rows_written, get_write_horizon, fetch_issue_label_ids
+from pipeline import apply_write
+from config import EXPORT_DIR, EXPORT_TABLES, EXPORT_CHUNK_ROWS, EXPORT_FILE_ROWS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+def _nested_types():
+    """
+    Typed nested columns for the JSON columns GitHub returns with a known shape.
+    """
+    reaction_counts = ['total_count', '+1', '-1', 'laugh', 'hooray', 'confused', 'heart', 'rocket', 'eyes']
+    return {
+        'reactions': pa.struct([('url', pa.string())] + [(count, pa.int64()) for count in reaction_counts]),
+        'topics': pa.list_(pa.string()),
+        'license': pa.struct([
+            ('key', pa.string()), ('name', pa.string()), ('spdx_id', pa.string()), ('url', pa.string()), ('node_id', pa.string())
+        ]),
+        'permissions': pa.struct([
+            ('admin', pa.bool_()), ('maintain', pa.bool_()), ('push', pa.bool_()), ('triage', pa.bool_()), ('pull', pa.bool_())
+        ]),
+    }
+
+def _arrow_type(column, declared_type, nested_types):
+    if column in nested_types:
+        return nested_types[column]
+    if 'int' in declared_type or 'serial' in declared_type:
+        return pa.int64()
+    if 'bool' in declared_type:
+        return pa.bool_()
+    if 'timestamp' in declared_type:
+        return pa.timestamp('us', tz='UTC')
+    if 'real' in declared_type or 'double' in declared_type or 'numeric' in declared_type:
+        return pa.float64()
+    # Text and JSON columns of unknown shape are exported as strings
+    return pa.string()
+
+def _to_json(value):
+    # SQLite returns the stored JSON text, Postgres returns the decoded value of JSONB
+    if isinstance(value, str):
+        value = json.loads(value)
+    # Missing objects were stored as {}
+    return value if value != {} else None
+
+def _to_timestamp(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+def _converter(arrow_type, declared_type):
+    """
+    Returns the function converting a database value into a value of the Arrow type.
+    """
+    if pa.types.is_struct(arrow_type) or pa.types.is_list(arrow_type):
+        return _to_json
+    if pa.types.is_boolean(arrow_type):
+        return lambda value: None if value is None else bool(value)
+    if pa.types.is_timestamp(arrow_type):
+        return _to_timestamp
+    if pa.types.is_string(arrow_type) and 'json' in declared_type:
+        return lambda value: value if value is None or isinstance(value, str) else json.dumps(value)
+    return lambda value: value
+
+def _schema(conn, table):
+    """
+    Builds the Arrow schema of a table from the declared column types, and the converter of each column.
+    """
+    nested_types = _nested_types()
+    fields = []
+    converters = []
+    for column, declared_type in get_column_types(conn, table):
+        arrow_type = _arrow_type(column, declared_type, nested_types)
+        fields.append(pa.field(column, arrow_type))
+        converters.append(_converter(arrow_type, declared_type))
+    return pa.schema(fields), converters
+
+def _to_record_batch(schema, converters, rows):
+    columns = list(zip(*rows))
+    arrays = [pa.array([convert(value) for value in values], type=field.type) for field, convert, values in zip(schema, converters, columns)]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def export_table(conn, table, directory=EXPORT_DIR, incremental=True):
+    """
+    Streams a table into Parquet files in keyset paginated chunks by write sequence and id, so
+    memory use is bounded by one chunk. Each chunk becomes a row group, each file holds up to
+    EXPORT_FILE_ROWS rows and is named after the write sequence the export started at and its number.
+    With incremental set only rows inserted or changed since the last export are written, a changed
+    row appears again in a later file, otherwise the files of earlier exports are replaced.
+    Only writes committed when the export starts are exported, later ones go to the next export.
+    """
+    table_directory = os.path.join(directory, table)
+    os.makedirs(table_directory, exist_ok=True)
+    stage = f"export_{table}_write_seq"
+    from_seq = get_checkpoint(conn, stage) if incremental else 0
+    if incremental and not from_seq and get_checkpoint(conn, f"export_{table}"):
+        # Files of older versions were exported by id and cannot be continued
+        print(f"The files of {table} were exported by an older version, exporting all rows again.")
+        incremental = False
+    if incremental:
+        # Complete files of an interrupted export are written again
+        patterns = [os.path.join(table_directory, f"part-{from_seq:012d}-*.parquet")]
+    else:
+        patterns = [os.path.join(table_directory, 'part-*.parquet')]
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            os.remove(path)
+    to_seq = get_write_horizon(conn)
+
+    schema, converters = _schema(conn, table)
+    id_index = schema.get_field_index('id')
+    seq_index = schema.get_field_index('write_seq')
+    if table == 'issues':
+        # The label links have no id to export them by, so each issue carries the ids of its labels
+        schema = schema.append(pa.field('label_ids', pa.list_(pa.int64())))
+        converters = converters + [lambda value: value]
+    exported = 0
+    files = 0
+    writer = None
+    after = None
+    while True:
+        _, rows = fetch_rows_written(conn, table, from_seq, to_seq, after=after, batch_size=EXPORT_CHUNK_ROWS)
+        if rows:
+            if writer is None:
+                file_name = f"part-{from_seq:012d}-{files:05d}.parquet"
+                temporary_path = os.path.join(table_directory, f"{file_name}.part")
+                writer = pq.ParquetWriter(temporary_path, schema, compression='zstd')
+                file_rows = 0
+            if table == 'issues':
+                label_ids = fetch_issue_label_ids(conn, [row[id_index] for row in rows])
+                writer.write_batch(_to_record_batch(schema, converters, [tuple(row) + (label_ids.get(row[id_index], []),) for row in rows]))
+            else:
+                writer.write_batch(_to_record_batch(schema, converters, rows))
+            after = (rows[-1][seq_index], rows[-1][id_index])
+            file_rows += len(rows)
+            exported += len(rows)
+
+        if writer is not None and (not rows or file_rows >= EXPORT_FILE_ROWS):
+            writer.close()
+            os.replace(temporary_path, os.path.join(table_directory, file_name))
+            writer = None
+            files += 1
+        if not rows:
+            break
+    # Only a complete export moves the checkpoint
+    apply_write(conn, set_checkpoint, stage, to_seq)
+    print(f"Exported {exported} rows of {table}.")
+    return exported
+
+def export_tables(tables=EXPORT_TABLES, directory=EXPORT_DIR, incremental=True):
+    """
+    Exports the crawled tables to Parquet files in one directory per table.
+    """
+    if pa is None:
+        raise RuntimeError("Exporting to Parquet needs pyarrow, install it with: pip install pyarrow")
+    conn = open_connection()
+    try:
+        apply_write(conn, create_tables)
+        for table in tables:
+            export_table(conn, table, directory, incremental)
+    finally:
+        close_connection(conn)
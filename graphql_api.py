@@ -0,0 +1,304 @@
+import base64
+from urllib.parse import quote
+from config import BASE_URL, HEADERS
+from api import safe_request
+from metrics import decode_json
+from archive import archive_page
+
+GRAPHQL_URL = f"{BASE_URL}/graphql"
+
+# Only the fields stored in the issues, labels and issue_labels tables are requested. Issues are
+# ordered like the REST crawler's pages. GitHub charges one point per 100 requested connections,
+# a page of 100 issues asks for the issues and the labels of each, which rounds to one point.
+# The pull request count tells whether the REST endpoint would list pull requests among the issues.
+REPOSITORY_ISSUES_QUERY = '''
+query($owner: String!, $name: String!, $first: Int!, $after: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequests { totalCount }
+    issues(first: $first, after: $after, orderBy: {field: CREATED_AT, direction: ASC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        databaseId id number title url state stateReason locked activeLockReason
+        createdAt updatedAt closedAt authorAssociation body
+        author {
+          __typename login
+          ... on User { databaseId }
+          ... on Bot { databaseId }
+          ... on Organization { databaseId }
+          ... on Mannequin { databaseId }
+        }
+        comments { totalCount }
+        labels(first: 100) { pageInfo { hasNextPage endCursor } nodes { id name color isDefault description } }
+        reactionGroups { content reactors { totalCount } }
+      }
+    }
+  }
+}
+'''
+
+# The labels of an issue after the first 100
+ISSUE_LABELS_QUERY = '''
+query($id: ID!, $after: String) {
+  node(id: $id) {
+    ... on Issue {
+      labels(first: 100, after: $after) { pageInfo { hasNextPage endCursor } nodes { id name color isDefault description } }
+    }
+  }
+}
+'''
+
+# Issues per page, halved down to the minimum when a page fails, e.g. because GitHub times out on
+# long issue bodies, and doubled again after ISSUES_PAGE_SIZE_RECOVERY pages in a row were stored.
+# The rate limit points the pages cost are paced by the limiter from the response headers.
+MAX_ISSUES_PAGE_SIZE = 100
+MIN_ISSUES_PAGE_SIZE = 10
+ISSUES_PAGE_SIZE_RECOVERY = 5
+
+# Reaction contents by their REST names
+REACTION_KEYS = {
+    'THUMBS_UP': '+1', 'THUMBS_DOWN': '-1', 'LAUGH': 'laugh', 'HOORAY': 'hooray',
+    'CONFUSED': 'confused', 'HEART': 'heart', 'ROCKET': 'rocket', 'EYES': 'eyes',
+}
+
+# Only the fields stored in the users table are requested
+USER_DETAILS_QUERY = '''
+query($ids: [ID!]!) {
+  nodes(ids: $ids) {
+    __typename
+    id
+    ... on User {
+      databaseId login avatarUrl url name company websiteUrl location email
+      isHireable bio twitterUsername isSiteAdmin createdAt updatedAt
+      repositories(privacy: PUBLIC, ownerAffiliations: OWNER) { totalCount }
+      gists(privacy: PUBLIC) { totalCount }
+      followers { totalCount }
+      following { totalCount }
+    }
+    ... on Organization {
+      databaseId login avatarUrl url name websiteUrl location email
+      description twitterUsername createdAt updatedAt
+      repositories(privacy: PUBLIC, ownerAffiliations: OWNER) { totalCount }
+    }
+  }
+}
+'''
+
+def _post_query(query, variables, max_retries=3):
+    """
+    Runs a GraphQL query and returns the HTTP response with its decoded body, or (None, None) if the query failed.
+    Queries rejected by the GraphQL rate limit are retried once the limiter allows it.
+    """
+    for attempt in range(max_retries):
+        response = safe_request(GRAPHQL_URL, headers=HEADERS, method='POST', json={'query': query, 'variables': variables}, resource='graphql')
+        if not response or response.status_code != 200:
+            if response is not None:
+                print(f"GraphQL query failed: HTTP {response.status_code}, Error: {response.text}")
+            return None, None
+        result = decode_json(response)
+        if result.get('data') is None and any(error.get('type') == 'RATE_LIMITED' for error in result.get('errors', [])):
+            print(f"GraphQL rate limit exceeded. Attempt {attempt + 1} of {max_retries}.")
+            continue
+        return response, result
+    return None, None
+
+def graphql_request(query, variables, max_retries=3):
+    """
+    Runs a GraphQL query and returns the decoded response body, or None if the query failed.
+    Queries rejected by the GraphQL rate limit are retried once the limiter allows it.
+    """
+    return _post_query(query, variables, max_retries)[1]
+
+def _count(node, field):
+    connection = node.get(field)
+    return connection['totalCount'] if connection else None
+
+def _user_row(node):
+    """
+    Maps a GraphQL User or Organization node onto the fields of the REST /users/{login} response.
+    """
+    login = node['login']
+    is_user = node['__typename'] == 'User'
+    return {
+        'id': node['databaseId'],
+        'login': login,
+        'node_id': node['id'],
+        'type': node['__typename'],
+        'avatar_url': node.get('avatarUrl'),
+        'gravatar_id': '',
+        'url': f"{BASE_URL}/users/{login}",
+        'html_url': node.get('url'),
+        'site_admin': node.get('isSiteAdmin', False),
+        'name': node.get('name'),
+        'company': node.get('company'),
+        'blog': node.get('websiteUrl') or '',
+        'location': node.get('location'),
+        # GraphQL returns an empty string and false where REST returns null
+        'email': node.get('email') or None,
+        'hireable': node.get('isHireable') or None,
+        'bio': node.get('bio') if is_user else node.get('description'),
+        'twitter_username': node.get('twitterUsername'),
+        'public_repos': _count(node, 'repositories'),
+        # GraphQL has no gists or followers of organizations, which REST counts, so they are left unknown
+        'public_gists': _count(node, 'gists') if is_user else None,
+        'followers': _count(node, 'followers') if is_user else None,
+        # Organizations follow no one, REST always returns 0
+        'following': _count(node, 'following') if is_user else 0,
+        'created_at': node.get('createdAt'),
+        'updated_at': node.get('updatedAt'),
+    }
+
+def fetch_user_details(users):
+    """
+    Fetches the detailed information of a page of user summaries with one GraphQL nodes query,
+    using the node_id of each summary.
+    Summaries whose node could not be resolved are returned with the error flag set.
+    Returns None if the whole query failed.
+    """
+    result = graphql_request(USER_DETAILS_QUERY, {'ids': [user['node_id'] for user in users]})
+    if result is None or result.get('data') is None:
+        if result is not None:
+            print(f"GraphQL query for user details failed: {result.get('errors')}")
+        return None
+
+    # Per-node errors point at their node with a path like ['nodes', 3]
+    node_errors = {}
+    for error in result.get('errors', []):
+        path = error.get('path') or []
+        if len(path) >= 2 and path[0] == 'nodes':
+            node_errors[path[1]] = error.get('message')
+
+    nodes = result['data']['nodes']
+    user_rows = []
+    for index, (user_summary, node) in enumerate(zip(users, nodes)):
+        if node and node.get('databaseId') is not None:
+            user_rows.append(_user_row(node))
+        else:
+            print(f"Failed to fetch detailed data for user: {user_summary.get('url')}. Error: {node_errors.get(index, 'Not found')}")
+            user_summary['error'] = True
+            user_rows.append(user_summary)
+    return user_rows
+
+def _read_msgpack_int(data, index):
+    marker = data[index]
+    if marker <= 0x7f:
+        return marker, index + 1
+    sizes = {0xcc: 1, 0xcd: 2, 0xce: 4, 0xcf: 8}
+    if marker not in sizes:
+        raise ValueError(f"Unexpected MessagePack marker {marker:#x}")
+    size = sizes[marker]
+    return int.from_bytes(data[index + 1:index + 1 + size], 'big'), index + 1 + size
+
+def database_id(node_id):
+    """
+    Decodes the database id of an object from its global node id, for objects like labels whose
+    GraphQL type has no databaseId field. Legacy ids are base64 of e.g. '05:Label123', current ids
+    are a type prefix and base64 of a MessagePack array of ids ending with the object's own id.
+    Returns None when the id cannot be decoded.
+    """
+    try:
+        prefix, separator, encoded = node_id.partition('_')
+        if not separator:
+            legacy = base64.b64decode(node_id).decode('ascii')
+            return int(legacy[len(legacy.rstrip('0123456789')):])
+        data = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+        if not 0x91 <= data[0] <= 0x9f:
+            return None
+        index = 1
+        for _ in range(data[0] & 0x0f):
+            value, index = _read_msgpack_int(data, index)
+        return value
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return None
+
+# REST spells the lock reasons in lower case words
+LOCK_REASONS = {'OFF_TOPIC': 'off-topic', 'TOO_HEATED': 'too heated', 'RESOLVED': 'resolved', 'SPAM': 'spam'}
+
+def _label_row(label, full_name):
+    return {
+        'id': database_id(label['id']), 'node_id': label['id'],
+        'url': f"{BASE_URL}/repos/{full_name}/labels/{quote(label['name'], safe='')}",
+        'name': label['name'], 'color': label.get('color'), 'default': label.get('isDefault'), 'description': label.get('description'),
+    }
+
+def _fetch_more_labels(node):
+    """
+    Fetches the labels of an issue node after its first page of labels.
+    Returns the label nodes, or None if a query failed.
+    """
+    labels = []
+    page_info = node['labels']['pageInfo']
+    while page_info['hasNextPage']:
+        result = graphql_request(ISSUE_LABELS_QUERY, {'id': node['id'], 'after': page_info['endCursor']})
+        if result is None or not (result.get('data') or {}).get('node'):
+            if result is not None:
+                print(f"GraphQL query for the labels of issue {node['id']} failed: {result.get('errors')}")
+            return None
+        connection = result['data']['node']['labels']
+        labels.extend(connection['nodes'])
+        page_info = connection['pageInfo']
+    return labels
+
+def _issue_row(node, full_name, repository_id):
+    """
+    Maps a GraphQL Issue node onto the fields of the REST /repos/{owner}/{repo}/issues response that are stored.
+    """
+    author = node.get('author')
+    reactions = {key: 0 for key in REACTION_KEYS.values()}
+    for group in node.get('reactionGroups') or []:
+        if group['content'] in REACTION_KEYS:
+            reactions[REACTION_KEYS[group['content']]] = group['reactors']['totalCount']
+    reactions['total_count'] = sum(reactions.values())
+    return {
+        'url': f"{BASE_URL}/repos/{full_name}/issues/{node['number']}",
+        'repository_id': repository_id,
+        'repository_url': f"{BASE_URL}/repos/{full_name}",
+        'id': node['databaseId'],
+        'node_id': node['id'],
+        'number': node['number'],
+        'title': node.get('title'),
+        # A deleted author is returned as null
+        'user': {'login': author['login'], 'id': author.get('databaseId'), 'type': author['__typename']} if author else {},
+        # A label whose id cannot be decoded keeps the stored labels of the issue, see _replace_issue_labels
+        'labels': [_label_row(label, full_name) for label in node['labels']['nodes']],
+        'state': node['state'].lower(),
+        'locked': node.get('locked'),
+        'comments': node['comments']['totalCount'],
+        'created_at': node.get('createdAt'),
+        'updated_at': node.get('updatedAt'),
+        'closed_at': node.get('closedAt'),
+        'author_association': node.get('authorAssociation'),
+        'active_lock_reason': LOCK_REASONS.get(node.get('activeLockReason')),
+        # GraphQL returns an empty string where REST returns null
+        'body': node.get('body') or None,
+        'reactions': reactions,
+        'state_reason': node['stateReason'].lower() if node.get('stateReason') else None,
+    }
+
+def fetch_issues_page(full_name, repository_id, after, first):
+    """
+    Fetches a page of a repository's issues with a query asking only for the stored fields.
+    Returns the issues as REST shaped rows with their repository_id, as they are archived,
+    the cursor after the page, whether more pages follow and the number of pull requests of the repository,
+    or None if the query failed. Pull requests, which the REST endpoint lists among the issues, are not returned.
+    """
+    owner, _, name = full_name.partition('/')
+    response, result = _post_query(REPOSITORY_ISSUES_QUERY, {'owner': owner, 'name': name, 'first': first, 'after': after})
+    if result is None or result.get('data') is None:
+        if result is not None:
+            print(f"GraphQL query for the issues of {full_name} failed: {result.get('errors')}")
+        return None
+    repository = result['data'].get('repository')
+    if repository is None:
+        print(f"Repository {full_name} was not found: {result.get('errors')}")
+        return [], None, False, 0
+    issues = repository['issues']
+    for node in issues['nodes']:
+        if node['labels']['pageInfo']['hasNextPage']:
+            # Issues with more than 100 labels are rare, their remaining labels are fetched one issue at a time
+            more_labels = _fetch_more_labels(node)
+            if more_labels is None:
+                return None
+            node['labels']['nodes'] = node['labels']['nodes'] + more_labels
+    rows = [_issue_row(node, full_name, repository_id) for node in issues['nodes']]
+    archive_page('issues', GRAPHQL_URL, {'repository': full_name, 'after': after, 'first': first}, response, rows)
+    return rows, issues['pageInfo']['endCursor'], issues['pageInfo']['hasNextPage'], _count(repository, 'pullRequests') or 0
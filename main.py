@@ -29,12 +29,17 @@ def read_yes_no(prompt_message):
             print(f"{red}Invalid input. Please enter 'Y' for Yes or 'N' for No.{reset}")
 
 def main():
-    from api import fetch_organizations, fetch_users, fetch_repositories, fetch_issues
+    from api import fetch_organizations, fetch_users, fetch_repositories, fetch_issues, refresh_issues, fetch_comments, plan_crawls
+    from config import CRAWL_ENGINE, WORK_QUEUE
+    from metrics import start_metrics
+    if CRAWL_ENGINE == 'ASYNCIO' and not WORK_QUEUE:
+        from async_api import fetch_repositories_concurrently as fetch_repositories, fetch_issues_concurrently as fetch_issues
     
     blue = fg('blue')
     green = fg('green')
     reset = attr('reset')
     running = True   
+    start_metrics()
 
     while running:
         print(f"{blue}Welcome to the GitHub CLI!")
@@ -47,6 +52,11 @@ def main():
         print("5. Fetch Issues of Orgs")
         print("6. Fetch Issues of Users")
         print("7. Fetch Comments")
+        print("8. Refresh Issues of Orgs")
+        print("9. Refresh Issues of Users")
+        print("10. Plan Crawls")
+        print("11. Replay Archive")
+        print("12. Export Tables to Parquet")
         command = input(f"Enter a command number: {reset}").strip()
 
         if command == "0":
@@ -76,6 +86,37 @@ def main():
             print(f"{green}Fetching issues for users...{reset}")          
             fetch_issues("users")
             print(f"{green}Successfully fetched all issues.{reset}")        
+        elif command == "7":
+            if read_yes_no("Fetch comments of organizations' repositories? Answer N for users' repositories."):
+                print(f"{green}Fetching comments for orgs...{reset}")          
+                fetch_comments("organizations")
+            else:
+                print(f"{green}Fetching comments for users...{reset}")          
+                fetch_comments("users")
+            print(f"{green}Successfully fetched all comments.{reset}")        
+        elif command == "8":
+            print(f"{green}Refreshing issues for orgs...{reset}")          
+            refresh_issues("organizations")
+            print(f"{green}Successfully refreshed all issues.{reset}")       
+        elif command == "9":
+            print(f"{green}Refreshing issues for users...{reset}")          
+            refresh_issues("users")
+            print(f"{green}Successfully refreshed all issues.{reset}")        
+        elif command == "10":
+            print(f"{green}Planning crawls...{reset}")          
+            plan_crawls()
+            print(f"{green}Successfully planned all crawls.{reset}")        
+        elif command == "11":
+            from archive import replay_archive
+            print(f"{green}Replaying the archive...{reset}")          
+            replay_archive()
+            print(f"{green}Successfully replayed the archive.{reset}")        
+        elif command == "12":
+            from export import export_tables
+            incremental = read_yes_no("Export only rows added or changed since the last export? Answer N to export everything again.")
+            print(f"{green}Exporting tables...{reset}")          
+            export_tables(incremental=incremental)
+            print(f"{green}Successfully exported all tables.{reset}")        
         else:
             print(f"{green}Unknown command number. Please try again.{reset}")  
 
@@ -0,0 +1,241 @@
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config import BASE_URL, METRICS_PORT, METRICS_SNAPSHOT_FILE, METRICS_SNAPSHOT_INTERVAL
+
+# Process wide crawler metrics: counters, gauges and histograms with labels, exposed in the
+# Prometheus text format on METRICS_PORT and written as JSON snapshots to METRICS_SNAPSHOT_FILE.
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{str(value)}"' for name, value in pairs) + '}'
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+class Counter(_Metric):
+    """
+    A value that only goes up, e.g. a number of requests.
+    """
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self):
+        """
+        Returns the sum of the values of all labels.
+        """
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def snapshot(self):
+        with self._lock:
+            return [{'labels': dict(key), 'value': value} for key, value in self._values.items()]
+
+class Gauge(Counter):
+    """
+    A value that is set, e.g. the remaining rate limit quota.
+    """
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+class Histogram(_Metric):
+    """
+    Counts observations, e.g. durations, in cumulative buckets and keeps their sum.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {'counts': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+            series['count'] += 1
+            series['sum'] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the block in seconds.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def totals(self):
+        """
+        Returns the number and the sum of all observations over all labels.
+        """
+        with self._lock:
+            return sum(series['count'] for series in self._values.values()), sum(series['sum'] for series in self._values.values())
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, series in self._values.items():
+                for bound, count in zip(self.buckets, series['counts']):
+                    samples.append((f"{self.name}_bucket", key + (('le', bound),), count))
+                samples.append((f"{self.name}_bucket", key + (('le', '+Inf'),), series['count']))
+                samples.append((f"{self.name}_sum", key, series['sum']))
+                samples.append((f"{self.name}_count", key, series['count']))
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            return [{
+                'labels': dict(key), 'count': series['count'], 'sum': series['sum'],
+                'buckets': {str(bound): count for bound, count in zip(self.buckets, series['counts'])},
+            } for key, series in self._values.items()]
+
+REGISTRY = []
+
+HTTP_REQUESTS = Counter('github_http_requests_total', 'HTTP requests sent to the GitHub API by endpoint and status.')
+HTTP_REQUEST_SECONDS = Histogram('github_http_request_seconds', 'Duration of HTTP round trips to the GitHub API by endpoint.')
+JSON_DECODE_SECONDS = Histogram('github_json_decode_seconds', 'Time spent decoding JSON response bodies.')
+DB_UPSERT_SECONDS = Histogram('github_db_upsert_seconds', 'Duration of bulk upsert statements by table, without the commit.')
+DB_WRITE_SECONDS = Histogram('github_db_write_seconds', 'Duration of queued database writes, commit included, by write function.')
+ROWS_WRITTEN = Counter('github_rows_written_total', 'Rows inserted or changed by table.')
+ROWS_UNCHANGED = Counter('github_rows_unchanged_total', 'Upserted rows left untouched because their content hash did not change, by table.')
+RATE_LIMIT_SLEEP_SECONDS = Counter('github_rate_limit_sleep_seconds_total', 'Seconds spent waiting on rate limits by resource.')
+RATE_LIMIT_REMAINING = Gauge('github_rate_limit_remaining', 'Last known remaining quota by token and resource.')
+
+# Endpoint templates, so the request metrics get one series per endpoint instead of one per owner or repository
+ENDPOINT_PATTERNS = [(re.compile(pattern), template) for pattern, template in [
+    (r'^/users/[^/]+/repos$', '/users/{login}/repos'),
+    (r'^/users/[^/]+$', '/users/{login}'),
+    (r'^/repos/[^/]+/[^/]+/issues/comments$', '/repos/{owner}/{repo}/issues/comments'),
+    (r'^/repos/[^/]+/[^/]+/issues$', '/repos/{owner}/{repo}/issues'),
+    (r'^/repos/[^/]+/[^/]+$', '/repos/{owner}/{repo}'),
+]]
+
+def endpoint_of(url):
+    """
+    Returns the endpoint template of a request URL, e.g. /repos/{owner}/{repo}/issues.
+    """
+    path = url[len(BASE_URL):] if url.startswith(BASE_URL) else url
+    path = path.split('?', 1)[0].rstrip('/') or '/'
+    for pattern, template in ENDPOINT_PATTERNS:
+        if pattern.match(path):
+            return template
+    return path
+
+def decode_json(response):
+    """
+    Decodes the JSON body of a response, timing the decoding.
+    """
+    with JSON_DECODE_SECONDS.time():
+        return response.json()
+
+def render_prometheus():
+    """
+    Renders all metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{_format_labels(key)} {value}")
+    return '\n'.join(lines) + '\n'
+
+def snapshot():
+    """
+    Returns all metrics as a JSON serializable dictionary.
+    """
+    return {
+        'timestamp': time.time(),
+        'metrics': {metric.name: {'type': metric.type, 'help': metric.help, 'series': metric.snapshot()} for metric in REGISTRY},
+    }
+
+def write_snapshot(path=METRICS_SNAPSHOT_FILE):
+    """
+    Writes a JSON snapshot, replacing the previous one at once so readers never see a partial file.
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(temporary_path, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+_started = False
+
+def start_metrics():
+    """
+    Starts the Prometheus endpoint when METRICS_PORT is set and the periodic JSON snapshots when
+    METRICS_SNAPSHOT_FILE is set. Safe to call more than once.
+    """
+    global _started
+    if _started:
+        return
+    _started = True
+
+    if METRICS_PORT:
+        server = ThreadingHTTPServer(('127.0.0.1', METRICS_PORT), _MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        print(f"Serving metrics on http://127.0.0.1:{METRICS_PORT}/metrics")
+
+    if METRICS_SNAPSHOT_FILE:
+        def write_periodically():
+            while True:
+                time.sleep(METRICS_SNAPSHOT_INTERVAL)
+                write_snapshot()
+        threading.Thread(target=write_periodically, name='metrics-snapshots', daemon=True).start()
+        # Keep the final numbers of a run
+        atexit.register(write_snapshot)
@@ -0,0 +1,525 @@
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+# A local stand-in for the GitHub REST endpoints the crawlers use, serving synthetic data.
+# Every object is derived from its id, so nothing is stored and any size can be served:
+# users have ids 1..users, organizations the ids after them, repository k of an owner has
+# the id owner_id * 100 + k and issue n of a repository the id repository_id * 100000 + n.
+
+EPOCH = datetime(2015, 1, 1, tzinfo=timezone.utc)
+
+def _timestamp(seconds):
+    return (EPOCH + timedelta(seconds=seconds)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _node_id(prefix, *ids):
+    """
+    Encodes a global node id the way GitHub does: a type prefix and the base64 of a MessagePack array of ids.
+    """
+    data = bytes([0x90 | len(ids)])
+    for value in ids:
+        data += bytes([value]) if value <= 0x7f else b'\xce' + value.to_bytes(4, 'big') if value < 2 ** 32 else b'\xcf' + value.to_bytes(8, 'big')
+    return f"{prefix}_{base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')}"
+
+class MockGitHub:
+    """
+    The synthetic data set and the behaviour of the mock API.
+    - latency: Seconds added to every response.
+    - error_rate: Share of requests answered with 502 Bad Gateway.
+    - secondary_rate: Share of requests rejected by a secondary rate limit with Retry-After.
+    - rate_limit, rate_window: Requests each token may send per window of seconds.
+    """
+
+    def __init__(self, users=1000, organizations=100, repos_per_owner=3, issues_per_repo=150, comments_per_repo=50,
+                 latency=0.0, error_rate=0.0, secondary_rate=0.0, rate_limit=1000000, rate_window=60, seed=0):
+        self.users = users
+        self.organizations = organizations
+        self.repos_per_owner = min(repos_per_owner, 100)
+        self.issues_per_repo = issues_per_repo
+        self.comments_per_repo = comments_per_repo
+        self.latency = latency
+        self.error_rate = error_rate
+        self.secondary_rate = secondary_rate
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.base_url = ''
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._quotas = {}
+        self.stats = {'requests': 0, 'pages': 0, 'not_modified': 0, 'rows': 0, 'errors': 0, 'rate_limited': 0}
+
+    def count(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def roll(self):
+        """
+        Decides whether a request fails: returns 'error', 'secondary' or None.
+        """
+        with self._lock:
+            value = self._random.random()
+        if value < self.error_rate:
+            return 'error'
+        if value < self.error_rate + self.secondary_rate:
+            return 'secondary'
+        return None
+
+    def use_quota(self, token, resource):
+        """
+        Counts a request against the token's quota.
+        Returns the limit, remaining and reset of the window, remaining is -1 when the quota is exhausted.
+        """
+        now = int(time.time())
+        with self._lock:
+            window_start, used = self._quotas.get((token, resource), (now, 0))
+            if now >= window_start + self.rate_window:
+                window_start, used = now, 0
+            reset = window_start + self.rate_window
+            if used >= self.rate_limit:
+                return self.rate_limit, -1, reset
+            used += 1
+            self._quotas[(token, resource)] = (window_start, used)
+            return self.rate_limit, self.rate_limit - used, reset
+
+    # Owners
+
+    def owner(self, login):
+        """
+        Returns the id and type of an owner login, or None when it does not exist.
+        """
+        match = re.fullmatch(r'(user|org)(\d+)', login)
+        if not match:
+            return None
+        number = int(match.group(2))
+        if match.group(1) == 'user' and 1 <= number <= self.users:
+            return number, 'User'
+        if match.group(1) == 'org' and 1 <= number <= self.organizations:
+            return self.users + number, 'Organization'
+        return None
+
+    def login(self, owner_id):
+        return f"user{owner_id}" if owner_id <= self.users else f"org{owner_id - self.users}"
+
+    def owner_repo_count(self, owner_id):
+        # Every fourth owner has no public repository
+        return 0 if owner_id % 4 == 0 else self.repos_per_owner
+
+    def user_summary(self, user_id):
+        login = self.login(user_id)
+        return {
+            'login': login, 'id': user_id, 'node_id': f"U_{user_id}",
+            'avatar_url': f"https://avatars.example.com/u/{user_id}", 'gravatar_id': '',
+            'url': f"{self.base_url}/users/{login}", 'html_url': f"https://github.com/{login}",
+            'repos_url': f"{self.base_url}/users/{login}/repos",
+            'type': 'User' if user_id <= self.users else 'Organization', 'site_admin': False,
+        }
+
+    def user_detail(self, user_id):
+        user = self.user_summary(user_id)
+        user.update({
+            'name': f"Name {user_id}", 'company': None, 'blog': '', 'location': None, 'email': None,
+            'hireable': None, 'bio': None, 'twitter_username': None,
+            'public_repos': self.owner_repo_count(user_id), 'public_gists': user_id % 5,
+            'followers': (user_id * 37) % 1000, 'following': user_id % 50,
+            'created_at': _timestamp(user_id * 60), 'updated_at': _timestamp(user_id * 60 + 86400),
+        })
+        return user
+
+    def organization_summary(self, org_id):
+        login = self.login(org_id)
+        return {
+            'login': login, 'id': org_id, 'node_id': f"O_{org_id}",
+            'url': f"{self.base_url}/orgs/{login}", 'repos_url': f"{self.base_url}/orgs/{login}/repos",
+            'avatar_url': f"https://avatars.example.com/u/{org_id}", 'description': f"Organization {org_id}",
+        }
+
+    # Repositories, issues and comments
+
+    def has_issues(self, k):
+        # Every fifth repository is a fork with issues disabled
+        return k % 5 != 4
+
+    def repository(self, owner_id, k):
+        login = self.login(owner_id)
+        repo_id = owner_id * 100 + k
+        name = f"repo{k}"
+        return {
+            'id': repo_id, 'node_id': f"R_{repo_id}", 'name': name, 'full_name': f"{login}/{name}", 'private': False,
+            'owner': self.user_summary(owner_id), 'html_url': f"https://github.com/{login}/{name}",
+            'description': f"Repository {repo_id}", 'fork': k % 5 == 4, 'url': f"{self.base_url}/repos/{login}/{name}",
+            'created_at': _timestamp(repo_id), 'updated_at': _timestamp(repo_id + 3600), 'pushed_at': _timestamp(repo_id + 7200),
+            'homepage': None, 'size': repo_id % 10000, 'stargazers_count': (repo_id * 13) % 5000, 'watchers_count': (repo_id * 13) % 5000,
+            'language': 'Python', 'has_issues': self.has_issues(k), 'has_projects': True, 'has_downloads': True, 'has_wiki': True,
+            'has_pages': False, 'has_discussions': False, 'forks_count': repo_id % 100, 'mirror_url': None, 'archived': False,
+            'disabled': False, 'open_issues_count': self.issues_per_repo // 2,
+            'license': {'key': 'mit', 'name': 'MIT License', 'spdx_id': 'MIT', 'url': f"{self.base_url}/licenses/mit", 'node_id': 'L_mit'},
+            'allow_forking': True, 'is_template': False, 'web_commit_signoff_required': False, 'topics': ['crawler', f"topic{k}"],
+            'visibility': 'public', 'forks': repo_id % 100, 'open_issues': self.issues_per_repo // 2, 'watchers': (repo_id * 13) % 5000,
+            'default_branch': 'main',
+        }
+
+    def issue(self, full_name, repo_id, number):
+        issue_id = repo_id * 100000 + number
+        author_id = (issue_id % self.users) + 1 if self.users else 1
+        closed = number % 2 == 0
+        label_id = repo_id * 10 + number % 7 + 1
+        return {
+            'url': f"{self.base_url}/repos/{full_name}/issues/{number}", 'repository_url': f"{self.base_url}/repos/{full_name}",
+            'id': issue_id, 'node_id': f"I_{issue_id}", 'number': number, 'title': f"Issue {number} of {full_name}",
+            'user': self.user_summary(author_id),
+            'labels': [{
+                'id': label_id, 'node_id': _node_id('LA', 0, repo_id, label_id), 'url': f"{self.base_url}/repos/{full_name}/labels/label{number % 7}",
+                'name': f"label{number % 7}", 'color': 'ededed', 'default': number % 7 == 0, 'description': None,
+            }],
+            'state': 'closed' if closed else 'open', 'locked': False, 'assignee': None, 'assignees': [], 'milestone': None,
+            'comments': number % 4, 'created_at': _timestamp(repo_id + number * 60), 'updated_at': _timestamp(repo_id + number * 60 + 30),
+            'closed_at': _timestamp(repo_id + number * 60 + 60) if closed else None, 'author_association': 'NONE',
+            'active_lock_reason': None, 'body': f"Body of issue {number}.\n" * 3,
+            'reactions': {'url': f"{self.base_url}/repos/{full_name}/issues/{number}/reactions", 'total_count': number % 3,
+                          '+1': number % 3, '-1': 0, 'laugh': 0, 'hooray': 0, 'confused': 0, 'heart': 0, 'rocket': 0, 'eyes': 0},
+            'state_reason': 'completed' if closed else None,
+        }
+
+    def issue_node(self, full_name, repo_id, number):
+        """
+        Returns issue number of a repository as a node of the GraphQL repository issues query.
+        """
+        issue = self.issue(full_name, repo_id, number)
+        reactions = issue['reactions']
+        contents = {'THUMBS_UP': '+1', 'THUMBS_DOWN': '-1', 'LAUGH': 'laugh', 'HOORAY': 'hooray',
+                    'CONFUSED': 'confused', 'HEART': 'heart', 'ROCKET': 'rocket', 'EYES': 'eyes'}
+        return {
+            'databaseId': issue['id'], 'id': issue['node_id'], 'number': number, 'title': issue['title'],
+            'url': f"https://github.com/{full_name}/issues/{number}", 'state': issue['state'].upper(),
+            'stateReason': issue['state_reason'].upper() if issue['state_reason'] else None, 'locked': issue['locked'],
+            'activeLockReason': None, 'createdAt': issue['created_at'], 'updatedAt': issue['updated_at'],
+            'closedAt': issue['closed_at'], 'authorAssociation': issue['author_association'], 'body': issue['body'],
+            'author': {'__typename': issue['user']['type'], 'login': issue['user']['login'], 'databaseId': issue['user']['id']},
+            'comments': {'totalCount': issue['comments']},
+            'labels': {'pageInfo': {'hasNextPage': False, 'endCursor': None},
+                       'nodes': [{'id': label['node_id'], 'name': label['name'], 'color': label['color'],
+                                  'isDefault': label['default'], 'description': label['description']} for label in issue['labels']]},
+            'reactionGroups': [{'content': content, 'reactors': {'totalCount': reactions[key]}} for content, key in contents.items()],
+        }
+
+    def comment(self, full_name, repo_id, index):
+        comment_id = repo_id * 100000 + index
+        number = index % max(self.issues_per_repo, 1) + 1
+        return {
+            'url': f"{self.base_url}/repos/{full_name}/issues/comments/{comment_id}", 'id': comment_id, 'node_id': f"IC_{comment_id}",
+            'issue_url': f"{self.base_url}/repos/{full_name}/issues/{number}", 'user': self.user_summary((comment_id % max(self.users, 1)) + 1),
+            'created_at': _timestamp(repo_id + index * 90), 'updated_at': _timestamp(repo_id + index * 90 + 10),
+            'author_association': 'NONE', 'body': f"Comment {index}.",
+            'reactions': {'url': f"{self.base_url}/repos/{full_name}/issues/comments/{comment_id}/reactions", 'total_count': 0},
+        }
+
+    def repository_by_name(self, full_name):
+        """
+        Returns the owner id and repository index of a full name, or None when it does not exist.
+        """
+        login, _, name = full_name.partition('/')
+        owner = self.owner(login)
+        match = re.fullmatch(r'repo(\d+)', name)
+        if owner is None or not match or int(match.group(1)) >= self.owner_repo_count(owner[0]):
+            return None
+        return owner[0], int(match.group(1))
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so pooled clients reuse their connections
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def _send(self, status, body=None, headers=None):
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def _quota_headers(self, resource):
+        token = self.headers.get('Authorization', '')
+        limit, remaining, reset = self.mock.use_quota(token, resource)
+        headers = {
+            'X-RateLimit-Limit': limit, 'X-RateLimit-Remaining': max(remaining, 0),
+            'X-RateLimit-Reset': reset, 'X-RateLimit-Used': limit - max(remaining, 0), 'X-RateLimit-Resource': resource,
+        }
+        return headers, remaining < 0
+
+    def _admit(self, resource='core'):
+        """
+        Applies latency, injected errors and the rate limit. Returns the rate limit headers,
+        or None when the request was already answered.
+        """
+        self.mock.count(requests=1)
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+        failure = self.mock.roll()
+        if failure == 'error':
+            self.mock.count(errors=1)
+            self._send(502, {'message': 'Server Error'})
+            return None
+        if failure == 'secondary':
+            self.mock.count(rate_limited=1)
+            self._send(403, {'message': 'You have exceeded a secondary rate limit. Please wait a few minutes before you try again.'}, {'Retry-After': 1})
+            return None
+        headers, exhausted = self._quota_headers(resource)
+        if exhausted:
+            self.mock.count(rate_limited=1)
+            self._send(403, {'message': 'API rate limit exceeded.'}, headers)
+            return None
+        return headers
+
+    def _send_page(self, items, headers, link=None):
+        """
+        Sends a page with an ETag, answering 304 Not Modified to a matching If-None-Match.
+        """
+        body = json.dumps(items).encode('utf-8')
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        headers = dict(headers, ETag=etag)
+        if link:
+            headers['Link'] = link
+        if self.headers.get('If-None-Match') == etag:
+            self.mock.count(not_modified=1)
+            self._send(304, None, headers)
+            return
+        self.mock.count(pages=1, rows=len(items) if isinstance(items, list) else 1)
+        self._send(200, items, headers)
+
+    def _paginate(self, path, query, total, make_item):
+        """
+        Serves page 'page' of per_page items out of total, with a Link header like GitHub's.
+        """
+        per_page = min(int(query.get('per_page', 30)), 100)
+        page = max(int(query.get('page', 1)), 1)
+        start = (page - 1) * per_page
+        items = [make_item(index) for index in range(start, min(start + per_page, total))]
+        last_page = max((total + per_page - 1) // per_page, 1)
+        links = []
+        if page < last_page:
+            links.append(f'<{self.mock.base_url}{path}?{urlencode(dict(query, page=page + 1))}>; rel="next"')
+            links.append(f'<{self.mock.base_url}{path}?{urlencode(dict(query, page=last_page))}>; rel="last"')
+        if page > 1:
+            links.append(f'<{self.mock.base_url}{path}?{urlencode(dict(query, page=page - 1))}>; rel="prev"')
+            links.append(f'<{self.mock.base_url}{path}?{urlencode(dict(query, page=1))}>; rel="first"')
+        return items, ', '.join(links)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path
+        query = dict(parse_qsl(url.query))
+        mock = self.mock
+
+        headers = self._admit()
+        if headers is None:
+            return
+
+        if path == '/rate_limit':
+            core = {key: int(headers[f"X-RateLimit-{key.capitalize()}"]) for key in ('limit', 'remaining', 'reset', 'used')}
+            self._send(200, {'resources': {'core': core}, 'rate': core}, headers)
+            return
+
+        if path in ('/users', '/organizations'):
+            since = int(query.get('since', 0))
+            per_page = min(int(query.get('per_page', 30)), 100)
+            if path == '/users':
+                ids = range(max(since + 1, 1), mock.users + 1)
+                make = mock.user_summary
+            else:
+                ids = range(max(since + 1, mock.users + 1), mock.users + mock.organizations + 1)
+                make = mock.organization_summary
+            items = [make(owner_id) for owner_id in ids[:per_page]]
+            link = None
+            if items:
+                link = f'<{mock.base_url}{path}?{urlencode(dict(query, since=items[-1]["id"]))}>; rel="next"'
+            self._send_page(items, headers, link)
+            return
+
+        match = re.fullmatch(r'/users/([^/]+)', path)
+        if match:
+            owner = mock.owner(match.group(1))
+            if owner is None:
+                self._send(404, {'message': 'Not Found'}, headers)
+                return
+            self._send_page(mock.user_detail(owner[0]), headers)
+            return
+
+        match = re.fullmatch(r'/users/([^/]+)/repos', path)
+        if match:
+            owner = mock.owner(match.group(1))
+            if owner is None:
+                self._send(404, {'message': 'Not Found'}, headers)
+                return
+            owner_id = owner[0]
+            items, link = self._paginate(path, query, mock.owner_repo_count(owner_id), lambda k: mock.repository(owner_id, k))
+            self._send_page(items, headers, link)
+            return
+
+        match = re.fullmatch(r'/repos/([^/]+/[^/]+)/issues(/comments)?', path)
+        if match:
+            full_name = match.group(1)
+            repository = mock.repository_by_name(full_name)
+            if repository is None:
+                self._send(404, {'message': 'Not Found'}, headers)
+                return
+            owner_id, k = repository
+            repo_id = owner_id * 100 + k
+            if match.group(2):
+                comments = [mock.comment(full_name, repo_id, index) for index in range(mock.comments_per_repo)]
+                if 'since' in query:
+                    comments = [comment for comment in comments if comment['updated_at'] >= query['since']]
+                items, link = self._paginate(path, query, len(comments), lambda index: comments[index])
+            elif not mock.has_issues(k):
+                self._send(410, {'message': 'Issues are disabled for this repo'}, headers)
+                return
+            else:
+                issues = [mock.issue(full_name, repo_id, number) for number in range(1, mock.issues_per_repo + 1)]
+                if 'since' in query:
+                    issues = [issue for issue in issues if issue['updated_at'] >= query['since']]
+                items, link = self._paginate(path, query, len(issues), lambda index: issues[index])
+            self._send_page(items, headers, link)
+            return
+
+        self._send(404, {'message': 'Not Found'}, headers)
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/graphql':
+            self._send(404, {'message': 'Not Found'})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        headers = self._admit('graphql')
+        if headers is None:
+            return
+        variables = body.get('variables') or {}
+        if 'owner' in variables and 'name' in variables:
+            self._send(200, self._repository_issues(variables), headers)
+            return
+        ids = variables.get('ids')
+        if ids is None:
+            self._send(200, {'errors': [{'message': 'The mock API only resolves nodes(ids:) and repository issues queries.'}]}, headers)
+            return
+        nodes = []
+        for node_id in ids:
+            match = re.fullmatch(r'U_(\d+)', node_id)
+            owner_id = int(match.group(1)) if match else 0
+            if not 1 <= owner_id <= self.mock.users:
+                nodes.append(None)
+                continue
+            user = self.mock.user_detail(owner_id)
+            nodes.append({
+                '__typename': 'User', 'id': node_id, 'databaseId': owner_id, 'login': user['login'], 'avatarUrl': user['avatar_url'],
+                'url': user['html_url'], 'name': user['name'], 'company': None, 'websiteUrl': None, 'location': None, 'email': '',
+                'isHireable': False, 'bio': None, 'twitterUsername': None, 'isSiteAdmin': False,
+                'createdAt': user['created_at'], 'updatedAt': user['updated_at'],
+                'repositories': {'totalCount': user['public_repos']}, 'gists': {'totalCount': user['public_gists']},
+                'followers': {'totalCount': user['followers']}, 'following': {'totalCount': user['following']},
+            })
+        self.mock.count(pages=1, rows=len(nodes))
+        self._send(200, {'data': {'nodes': nodes}}, headers)
+
+    def _repository_issues(self, variables):
+        full_name = f"{variables['owner']}/{variables['name']}"
+        repository = self.mock.repository_by_name(full_name)
+        if repository is None:
+            return {'data': {'repository': None}, 'errors': [{'type': 'NOT_FOUND', 'path': ['repository'],
+                                                              'message': f"Could not resolve to a Repository with the name '{full_name}'."}]}
+        first = variables.get('first') or 0
+        if not 1 <= first <= 100:
+            return {'data': None, 'errors': [{'message': 'Requesting between 1 and 100 records of the issues connection is allowed.'}]}
+        owner_id, k = repository
+        repo_id = owner_id * 100 + k
+        total = self.mock.issues_per_repo if self.mock.has_issues(k) else 0
+        # Cursors encode the index of the issue they follow
+        start = int(base64.b64decode(variables['after']).decode('ascii').split(':')[1]) + 1 if variables.get('after') else 0
+        end = min(start + first, total)
+        nodes = [self.mock.issue_node(full_name, repo_id, index + 1) for index in range(start, end)]
+        end_cursor = base64.b64encode(f"cursor:{end - 1}".encode('ascii')).decode('ascii') if nodes else variables.get('after')
+        self.mock.count(pages=1, rows=len(nodes))
+        # The mock lists no pull requests among the issues
+        return {'data': {'repository': {'pullRequests': {'totalCount': 0}, 'issues': {'pageInfo': {'hasNextPage': end < total, 'endCursor': end_cursor}, 'nodes': nodes}}}}
+
+class MockGitHubServer:
+    """
+    Runs the mock API on a local port in a background thread.
+    """
+
+    def __init__(self, mock=None, host='127.0.0.1', port=0):
+        self.mock = mock or MockGitHub()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self.mock
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self.mock.base_url = self.url
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-github', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def add_mock_arguments(parser):
+    """
+    Adds the options of the mock data set and its behaviour to an argument parser.
+    """
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--organizations', type=int, default=100)
+    parser.add_argument('--repos-per-owner', type=int, default=3)
+    parser.add_argument('--issues-per-repo', type=int, default=150)
+    parser.add_argument('--comments-per-repo', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 502.')
+    parser.add_argument('--secondary-rate', type=float, default=0.0, help='Share of requests hitting a secondary rate limit.')
+    parser.add_argument('--rate-limit', type=int, default=1000000, help='Requests per token and window.')
+    parser.add_argument('--rate-window', type=int, default=60, help='Length of the rate limit window in seconds.')
+    parser.add_argument('--seed', type=int, default=0)
+
+def mock_from_arguments(args):
+    return MockGitHub(
+        users=args.users, organizations=args.organizations, repos_per_owner=args.repos_per_owner,
+        issues_per_repo=args.issues_per_repo, comments_per_repo=args.comments_per_repo, latency=args.latency,
+        error_rate=args.error_rate, secondary_rate=args.secondary_rate, rate_limit=args.rate_limit,
+        rate_window=args.rate_window, seed=args.seed
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves a synthetic GitHub API for offline crawls. Point GITHUB_API_URL at it.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockGitHubServer(mock_from_arguments(args), args.host, args.port)
+    print(f"Mock GitHub API listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
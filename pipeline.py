@@ -0,0 +1,217 @@
+import atexit
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from database import DBMS, open_connection, close_connection, checkpoint_wal
+from config import CRAWL_CONCURRENCY, WRITE_QUEUE_SIZE, SQLITE_CHECKPOINT_SECONDS
+from metrics import DB_WRITE_SECONDS
+
+# On SQLite every write of a process goes through one writer thread: pipeline writes are queued with
+# Pipeline.write, and writes whose caller waits for them, like migrations and work unit leases, with apply_write.
+
+class WriteSession:
+    """
+    The writes of one producer on a Writer, with an error state of their own: after a failed write
+    all later writes of the session are skipped, so a checkpoint never gets ahead of its data, while
+    the writes of other sessions on the same writer go on.
+    """
+
+    def __init__(self, writer):
+        self._writer = writer
+        self.error = None
+
+    def submit(self, function, *args):
+        """
+        Queues a write, blocking while the queue is full.
+        """
+        if self.error is not None:
+            raise RuntimeError("The database writer has failed.") from self.error
+        self._writer._queue.put((function, args, self))
+
+    def close(self):
+        """
+        Waits until all writes queued by this session are applied.
+        """
+        applied = threading.Event()
+        self._writer._queue.put((None, applied, self))
+        applied.wait()
+        if self.error is not None:
+            raise RuntimeError("The database writer has failed.") from self.error
+
+class Writer:
+    """
+    Applies database writes on a dedicated thread that owns its own connection from open_connection().
+
+    Writes are queued as (function, args) pairs and applied in order, each function being called
+    as function(conn, *args). The queue is bounded, so producers block when the writer falls behind.
+    Writes are grouped in sessions, see WriteSession; submit() and close() use the writer's own session.
+    On SQLite the writer also checkpoints the WAL every SQLITE_CHECKPOINT_SECONDS.
+    """
+
+    def __init__(self, queue_size=WRITE_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._session = WriteSession(self)
+        self._thread = threading.Thread(target=self._run, name='database-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        conn = open_connection()
+        checkpointed_at = time.monotonic()
+        try:
+            while True:
+                try:
+                    task = self._queue.get(timeout=SQLITE_CHECKPOINT_SECONDS)
+                except queue.Empty:
+                    task = ()
+                if task is None:
+                    break
+                if task:
+                    self._apply(conn, *task)
+                if time.monotonic() - checkpointed_at >= SQLITE_CHECKPOINT_SECONDS:
+                    checkpoint_wal(conn)
+                    checkpointed_at = time.monotonic()
+            checkpoint_wal(conn, 'TRUNCATE')
+        finally:
+            close_connection(conn)
+
+    def _apply(self, conn, function, args, session):
+        if function is None:
+            # A session waits for its writes
+            args.set()
+            return
+        if session.error is not None:
+            # Keep draining so producers never block on a dead session
+            return
+        try:
+            with DB_WRITE_SECONDS.time(function=function.__name__):
+                function(conn, *args)
+        except Exception as e:
+            print(f"Database write {function.__name__} failed: {e}")
+            traceback.print_exc()
+            # Drop the partial write, so the next write does not commit it
+            conn.rollback()
+            session.error = e
+
+    def session(self):
+        """
+        Opens a session of writes with its own error state.
+        """
+        return WriteSession(self)
+
+    def submit(self, function, *args):
+        """
+        Queues a write, blocking while the queue is full.
+        """
+        self._session.submit(function, *args)
+
+    def close(self):
+        """
+        Applies all queued writes and stops the writer.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._session.error is not None:
+            raise RuntimeError("The database writer has failed.") from self._session.error
+
+_shared_writer = None
+_shared_writer_lock = threading.Lock()
+
+def open_writer(queue_size=WRITE_QUEUE_SIZE):
+    """
+    Returns the writer of a pipeline: a Writer of its own on Postgres, and a session on the one
+    writer of the process on SQLite, which allows a single writer at a time anyway. Concurrent
+    stages then never fail with 'database is locked'. Either way close() waits for its writes.
+    """
+    global _shared_writer
+    if DBMS != 'SQLITE':
+        return Writer(queue_size)
+    with _shared_writer_lock:
+        if _shared_writer is None:
+            _shared_writer = Writer(queue_size)
+            atexit.register(_shared_writer.close)
+        return _shared_writer.session()
+
+def apply_write(conn, function, *args):
+    """
+    Applies a write outside of a pipeline and returns its result, for writes like schema migrations,
+    work unit leases, crawl plans and checkpoints whose caller waits for them. On SQLite it runs as
+    function(writer_conn, *args) on the one writer of the process like every other write, on Postgres
+    as function(conn, *args) on the caller's connection.
+    Must not be called from the writer thread itself.
+    """
+    if DBMS != 'SQLITE':
+        return function(conn, *args)
+    result = []
+    def apply(writer_conn):
+        result.append(function(writer_conn, *args))
+    apply.__name__ = function.__name__
+    session = open_writer()
+    session.submit(apply)
+    session.close()
+    return result[0]
+
+class Pipeline:
+    """
+    Overlaps network and disk work: fetcher workers run the HTTP round trips and JSON decoding,
+    and hand their rows to a single Writer through its bounded queue, on SQLite the one writer of the process.
+    Fetchers that need to read the database get a connection of their own per thread.
+    """
+
+    def __init__(self, workers=CRAWL_CONCURRENCY, queue_size=WRITE_QUEUE_SIZE):
+        self.writer = open_writer(queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetcher')
+        self._local = threading.local()
+        self._read_connections = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(raise_errors=exc_type is None)
+
+    def fetch(self, function, *args):
+        """
+        Runs a fetch function on a fetcher worker and returns its future.
+        """
+        return self._executor.submit(function, *args)
+
+    def map(self, function, items):
+        """
+        Runs a fetch function for every item on the fetcher workers and returns the results in order.
+        """
+        return list(self._executor.map(function, items))
+
+    def write(self, function, *args):
+        """
+        Queues a write for the writer thread.
+        """
+        self.writer.submit(function, *args)
+
+    def read_connection(self):
+        """
+        Returns a database connection for reads owned by the calling thread.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = open_connection()
+            self._local.conn = conn
+            with self._lock:
+                self._read_connections.append(conn)
+        return conn
+
+    def close(self, raise_errors=True):
+        """
+        Waits for the fetchers, drains the writer completely and closes all connections.
+        """
+        self._executor.shutdown(wait=True)
+        try:
+            self.writer.close()
+        except RuntimeError:
+            if raise_errors:
+                raise
+        finally:
+            for conn in self._read_connections:
+                close_connection(conn)
@@ -0,0 +1,114 @@
+import threading
+import time
+from metrics import RATE_LIMIT_SLEEP_SECONDS, RATE_LIMIT_REMAINING
+
+# Back-off used for secondary (abuse) rate limits that come without a Retry-After header
+SECONDARY_LIMIT_DELAY = 60
+SECONDARY_LIMIT_MAX_DELAY = 15 * 60
+
+class RateLimiter:
+    """
+    Paces requests using the rate limit headers of every GitHub response.
+
+    The remaining quota of each resource (core, search, graphql, ...) is spread evenly
+    over the time left until its reset, so the quota is never burned early.
+    Responses rejected by the primary or secondary rate limits block all requests
+    until the time given by Retry-After, X-RateLimit-Reset or an exponential back-off.
+    """
+
+    def __init__(self, name='default'):
+        # Identifies the limiter in the metrics
+        self.name = name
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._next_request_at = {}
+        self._blocked_until = 0.0
+        self._secondary_strikes = 0
+
+    def wait(self, resource='core'):
+        """
+        Blocks until the next request against the given resource may be sent.
+        """
+        with self._lock:
+            now = time.time()
+            start = max(now, self._blocked_until, self._next_request_at.get(resource, 0.0))
+            interval = 0.0
+            bucket = self._buckets.get(resource)
+            if bucket and bucket['reset'] > start:
+                if bucket['remaining'] <= 0:
+                    # Quota is exhausted, wait for the window to reset
+                    start = bucket['reset'] + 1
+                else:
+                    interval = (bucket['reset'] - start) / bucket['remaining']
+                    # Reserve one request of the quota for this caller
+                    bucket['remaining'] -= 1
+            self._next_request_at[resource] = start + interval
+        sleep_duration = start - now
+        if sleep_duration > 1:
+            print(f"Rate limit reached for {resource}. Sleeping for {sleep_duration:.0f} seconds.")
+        if sleep_duration > 0:
+            RATE_LIMIT_SLEEP_SECONDS.inc(sleep_duration, resource=resource)
+            time.sleep(sleep_duration)
+
+    def ready_at(self, resource='core'):
+        """
+        Returns the time at which the next request against the resource may be sent.
+        """
+        with self._lock:
+            ready = max(self._blocked_until, self._next_request_at.get(resource, 0.0))
+            bucket = self._buckets.get(resource)
+            if bucket and bucket['reset'] > ready and bucket['remaining'] <= 0:
+                ready = bucket['reset'] + 1
+            return ready
+
+    def remaining(self, resource='core'):
+        """
+        Returns the last known remaining quota of the resource, or None when unknown.
+        """
+        with self._lock:
+            bucket = self._buckets.get(resource)
+            if bucket is None:
+                return None
+            if bucket['reset'] <= time.time():
+                return bucket['limit']
+            return bucket['remaining']
+
+    def update(self, response, resource='core'):
+        """
+        Records the rate limit headers of a response.
+        Returns True when the request was rejected by a rate limit and should be retried.
+        """
+        headers = response.headers
+        now = time.time()
+        with self._lock:
+            resource = headers.get('X-RateLimit-Resource', resource)
+            if 'X-RateLimit-Remaining' in headers and 'X-RateLimit-Reset' in headers:
+                remaining = int(headers['X-RateLimit-Remaining'])
+                reset = int(headers['X-RateLimit-Reset'])
+                limit = int(headers.get('X-RateLimit-Limit', remaining))
+                bucket = self._buckets.get(resource)
+                if bucket and bucket['reset'] == reset:
+                    # Responses of concurrent requests arrive out of order, keep the lowest count
+                    remaining = min(remaining, bucket['remaining'])
+                self._buckets[resource] = {'limit': limit, 'remaining': remaining, 'reset': reset}
+                RATE_LIMIT_REMAINING.set(remaining, token=self.name, resource=resource)
+
+            if response.status_code not in (403, 429):
+                self._secondary_strikes = 0
+                return False
+
+            retry_after = headers.get('Retry-After')
+            if retry_after is not None:
+                blocked_until = now + int(retry_after)
+            elif headers.get('X-RateLimit-Remaining') == '0':
+                blocked_until = int(headers['X-RateLimit-Reset']) + 1
+            elif 'rate limit' in response.text.lower():
+                # Secondary limit without a hint, back off exponentially
+                delay = min(SECONDARY_LIMIT_DELAY * 2 ** self._secondary_strikes, SECONDARY_LIMIT_MAX_DELAY)
+                self._secondary_strikes += 1
+                blocked_until = now + delay
+            else:
+                # A plain permission error, not a rate limit
+                return False
+            self._blocked_until = max(self._blocked_until, blocked_until)
+            return True
@@ -0,0 +1,200 @@
+import argparse
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+# Headless crawler for cron and systemd: runs the selected stages of a crawl cycle as a dependency
+# graph, up to STAGE_CONCURRENCY stages at once, and repeats the cycle every RECRAWL_INTERVAL seconds.
+
+# Stage name, the crawler and its arguments, the stages it depends on, and the repository stage an
+# issue stage can follow while it is still running
+STAGES = [
+    ('organizations', 'fetch_organizations', (), (), None),
+    ('users', 'fetch_users', (), (), None),
+    ('org_repositories', 'fetch_repositories', ('organizations',), ('organizations',), None),
+    ('user_repositories', 'fetch_repositories', ('users',), ('users',), None),
+    ('org_issues', 'fetch_issues', ('organizations',), ('org_repositories',), 'org_repositories'),
+    ('user_issues', 'fetch_issues', ('users',), ('user_repositories',), 'user_repositories'),
+    ('org_refresh', 'refresh_issues', ('organizations',), ('org_issues',), None),
+    ('user_refresh', 'refresh_issues', ('users',), ('user_issues',), None),
+    ('org_comments', 'fetch_comments', ('organizations',), ('org_issues',), None),
+    ('user_comments', 'fetch_comments', ('users',), ('user_issues',), None),
+]
+
+STAGE_NAMES = [name for name, _, _, _, _ in STAGES]
+
+# Stages that only crawl the owners or repositories after their checkpoint, their progress is reset
+# once they finished so that the next cycle crawls everything again, which conditional requests keep cheap
+RECRAWLED_STAGES = ('org_repositories', 'user_repositories', 'org_issues', 'user_issues', 'org_comments', 'user_comments')
+
+class Scheduler:
+    """
+    Runs crawl cycles. A stage starts once the stages it depends on have finished, except that an
+    issue stage starts as soon as its repository stage has started and follows that stage's progress,
+    when both crawl in the default keyset order. Stages that are not selected count as finished,
+    stages whose dependencies failed are skipped until the next cycle.
+    """
+
+    def __init__(self, stages, stage_concurrency, interval):
+        unknown = [stage for stage in stages if stage not in STAGE_NAMES]
+        if unknown:
+            raise ValueError(f"Unknown stages: {', '.join(unknown)}. Known stages: {', '.join(STAGE_NAMES)}")
+        self.stages = [stage for stage in STAGES if stage[0] in stages]
+        self.stage_concurrency = stage_concurrency
+        self.interval = interval
+        self._stop = threading.Event()
+        self.crawlers = self._load_crawlers()
+
+    @staticmethod
+    def _load_crawlers():
+        import api
+        from config import CRAWL_ENGINE, WORK_QUEUE, CRAWL_PLAN
+        crawlers = {name: getattr(api, name) for name in ('fetch_organizations', 'fetch_users', 'fetch_repositories', 'fetch_issues', 'refresh_issues', 'fetch_comments')}
+        if CRAWL_ENGINE == 'ASYNCIO' and not WORK_QUEUE:
+            import async_api
+            crawlers['fetch_repositories'] = async_api.fetch_repositories_concurrently
+            crawlers['fetch_issues'] = async_api.fetch_issues_concurrently
+        elif not WORK_QUEUE and not CRAWL_PLAN:
+            # Following needs the owner checkpoints of the keyset ordered repository crawl
+            crawlers['follow_issues'] = api.follow_issues
+        return crawlers
+
+    def stop(self):
+        """
+        Starts no more stages or cycles, running stages are finished.
+        """
+        self._stop.set()
+
+    def _run_stage(self, name, function, args, upstream_running):
+        started = time.time()
+        print(f"Stage {name} started.")
+        if upstream_running is not None:
+            self.crawlers['follow_issues'](*args, upstream_running=upstream_running)
+        else:
+            self.crawlers[function](*args)
+        print(f"Stage {name} finished in {time.time() - started:.0f} seconds.")
+
+    def run_cycle(self):
+        """
+        Runs every selected stage once. Returns the names of the stages that failed or were skipped.
+        """
+        selected = {stage[0] for stage in self.stages}
+        pending = list(self.stages)
+        running = {}
+        finished = set(STAGE_NAMES) - selected
+        failed = set()
+
+        with ThreadPoolExecutor(max_workers=self.stage_concurrency, thread_name_prefix='stage') as executor:
+            while pending or running:
+                for stage in list(pending):
+                    if self._stop.is_set() or len(running) >= self.stage_concurrency:
+                        break
+                    name, function, args, dependencies, follows = stage
+                    if any(dependency in failed for dependency in dependencies):
+                        print(f"Stage {name} is skipped, a stage it depends on failed.")
+                        pending.remove(stage)
+                        failed.add(name)
+                        continue
+                    upstream_running = None
+                    if follows and 'follow_issues' in self.crawlers:
+                        # Following keeps its own checkpoint, so it is used whether or not the repository stage still runs
+                        upstream = next((future for future, stage_name in running.items() if stage_name == follows), None)
+                        if upstream is None and follows not in finished:
+                            continue
+                        upstream_running = (lambda upstream=upstream: not upstream.done()) if upstream else (lambda: False)
+                    elif not all(dependency in finished for dependency in dependencies):
+                        continue
+                    pending.remove(stage)
+                    running[executor.submit(self._run_stage, name, function, args, upstream_running)] = name
+
+                if not running:
+                    # Stopped before the remaining stages could start
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        finished.add(name)
+                    except Exception as e:
+                        print(f"Stage {name} failed: {e}")
+                        traceback.print_exc()
+                        failed.add(name)
+        return failed | {stage[0] for stage in pending}
+
+    def reset_finished(self, incomplete):
+        """
+        Resets the progress of the recrawled stages that finished in the last cycle. Stages that
+        failed or were interrupted keep their checkpoints and resume in the next cycle.
+        """
+        from database import open_connection, close_connection, reset_stage_progress
+        from pipeline import apply_write
+        conn = open_connection()
+        try:
+            for name, _, _, _, _ in self.stages:
+                if name in RECRAWLED_STAGES and name not in incomplete:
+                    apply_write(conn, reset_stage_progress, name)
+        finally:
+            close_connection(conn)
+
+    def run(self):
+        """
+        Runs cycles until stopped, one cycle every interval seconds, or a single cycle when interval is 0.
+        """
+        from database import open_connection, close_connection, create_tables
+        from pipeline import apply_write
+        # Migrate the schema once, before concurrent stages would race to add the same columns
+        conn = open_connection()
+        try:
+            apply_write(conn, create_tables)
+        finally:
+            close_connection(conn)
+        while not self._stop.is_set():
+            started = time.time()
+            print(f"Crawl cycle started with stages {', '.join(stage[0] for stage in self.stages)}.")
+            incomplete = self.run_cycle()
+            self.reset_finished(incomplete)
+            if incomplete:
+                print(f"Crawl cycle ended after {time.time() - started:.0f} seconds, incomplete stages: {', '.join(sorted(incomplete))}.")
+            else:
+                print(f"Crawl cycle completed in {time.time() - started:.0f} seconds.")
+            if not self.interval:
+                return not incomplete
+            if self._stop.is_set():
+                break
+            next_cycle_at = started + self.interval
+            print(f"Next crawl cycle at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(next_cycle_at))}.")
+            self._stop.wait(max(0, next_cycle_at - time.time()))
+        return True
+
+def main():
+    load_dotenv()
+    from config import SCHEDULE_STAGES, STAGE_CONCURRENCY, RECRAWL_INTERVAL
+    from metrics import start_metrics
+
+    parser = argparse.ArgumentParser(description='Runs the crawl stages without the interactive menu, e.g. under cron or systemd.')
+    parser.add_argument('--stages', default=','.join(SCHEDULE_STAGES), help=f"Comma separated stages to run, of: {', '.join(STAGE_NAMES)}.")
+    parser.add_argument('--stage-concurrency', type=int, default=STAGE_CONCURRENCY, help='Number of stages running at once.')
+    parser.add_argument('--interval', type=int, default=RECRAWL_INTERVAL, help='Seconds from the start of one crawl cycle to the next, 0 runs a single cycle.')
+    parser.add_argument('--once', action='store_true', help='Run a single cycle regardless of the interval, e.g. under cron.')
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    scheduler = Scheduler(stages, max(1, args.stage_concurrency), 0 if args.once else args.interval)
+
+    def stop(signum, frame):
+        print("Stopping after the running stages have finished, press Ctrl-C again to abort them...")
+        scheduler.stop()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    start_metrics()
+    # Exit with an error when a stage of the last cycle failed, so cron and systemd report it
+    raise SystemExit(0 if scheduler.run() else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import threading
+import time
+from rate_limiter import RateLimiter
+
+class Token:
+    """
+    A GitHub personal access token with its own rate limit state.
+    """
+
+    def __init__(self, value):
+        self.value = value
+        # A short digest names the token in the metrics without revealing it
+        self.rate_limiter = RateLimiter(hashlib.sha256(value.encode('utf-8')).hexdigest()[:8])
+
+    def __repr__(self):
+        # Never print the full secret
+        return f"Token({self.value[:8]}...)"
+
+class TokenPool:
+    """
+    Schedules requests over several tokens, always picking the token with the most headroom:
+    the one that may send soonest and, among those, the one with the largest remaining quota.
+    Tokens rejected with HTTP 401 are removed from the pool.
+    """
+
+    def __init__(self, values):
+        self._lock = threading.Lock()
+        self._tokens = [Token(value) for value in dict.fromkeys(values)]
+
+    @classmethod
+    def from_env(cls):
+        """
+        Loads the tokens from PAT_KEYS (comma separated), the file named by PAT_KEYS_FILE
+        (one token per line, '#' starts a comment) and PAT_KEY.
+        """
+        values = [value.strip() for value in os.environ.get('PAT_KEYS', '').split(',')]
+        tokens_file = os.environ.get('PAT_KEYS_FILE')
+        if tokens_file:
+            with open(tokens_file) as f:
+                values.extend(line.split('#', 1)[0].strip() for line in f)
+        values.append((os.environ.get('PAT_KEY') or '').strip())
+        return cls([value for value in values if value])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tokens)
+
+    @staticmethod
+    def _headroom(token, resource):
+        remaining = token.rate_limiter.remaining(resource)
+        # A token that has not been used yet still has its full quota
+        return float('inf') if remaining is None else remaining
+
+    def acquire(self, resource='core'):
+        """
+        Picks the token with the most headroom for the resource and waits until it may be used.
+        Returns None when no usable token is left.
+        """
+        with self._lock:
+            if not self._tokens:
+                return None
+            now = time.time()
+            # Every token that may send now ties on readiness, so the remaining quota decides among them
+            token = min(self._tokens, key=lambda t: (max(t.rate_limiter.ready_at(resource), now), -self._headroom(t, resource)))
+        token.rate_limiter.wait(resource)
+        return token
+
+    def remove(self, token):
+        """
+        Drops a revoked or invalid token from the pool.
+        """
+        with self._lock:
+            if token in self._tokens:
+                self._tokens.remove(token)
+                print(f"{token} was rejected and removed from the pool. {len(self._tokens)} token(s) left.")
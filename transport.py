@@ -0,0 +1,80 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+from config import HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP2
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Exceptions raised by the transport when the server could not be reached
+if httpx is not None:
+    TRANSPORT_ERRORS = (ConnectionError, Timeout, httpx.TransportError)
+else:
+    TRANSPORT_ERRORS = (ConnectionError, Timeout)
+
+_client = None
+_client_lock = threading.Lock()
+
+def _create_client():
+    """
+    Creates the HTTP client shared by all crawlers.
+    An HTTP/2 client is used when HTTP2 is enabled and httpx (with h2) is installed,
+    otherwise a pooled keep-alive requests session is used.
+    """
+    if HTTP2:
+        if httpx is None:
+            print("HTTP2 is enabled but httpx is not installed. Falling back to HTTP/1.1.")
+        else:
+            try:
+                return httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_connections=HTTP_POOL_SIZE,
+                        max_keepalive_connections=HTTP_POOL_SIZE
+                    ),
+                    timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+                )
+            except ImportError as e:
+                print(f"HTTP2 is enabled but not available: {e}. Falling back to HTTP/1.1.")
+
+    session = requests.Session()
+    # Block instead of opening throwaway connections when all pooled ones are busy
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_client():
+    """
+    Returns the shared HTTP client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client()
+    return _client
+
+def close_client():
+    """
+    Closes the shared HTTP client and all of its pooled connections.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+def request(method, url, headers=None, params=None, json=None):
+    """
+    Sends a HTTP request over the shared keep-alive connection pool
+    with the configured connect and read timeouts.
+    """
+    client = get_client()
+    if isinstance(client, requests.Session):
+        return client.request(method, url, headers=headers, params=params, json=json,
+                              timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return client.request(method, url, headers=headers, params=params, json=json)